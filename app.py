@@ -3,45 +3,98 @@ import cv2
 import numpy as np
 import json
 import os
+import time
 from core.traffic_system import TrafficSystem
-from utils import save_zones, load_zones, save_config, MinioClient
+from utils import save_zones, load_zones, save_config, MinioClient, ViolationIndex
+from utils.storage import PresignedUrlCache
 
 # Initialize System
 # TrafficSystem represents the physical detection system, so a single global instance is appropriate.
 system = TrafficSystem()
 
-# Initialize MinIO Client gracefully
+# Initialize the storage client (S3/MinIO or local, per storage.backend) gracefully
 try:
     minio_client = MinioClient()
 except Exception as e:
-    print(f"Warning: Could not initialize MinIO Client: {e}")
+    print(f"Warning: Could not initialize storage client: {e}")
     minio_client = None
 
+# Gallery images are served from storage through expiring presigned URLs, reused while valid
+storage_cfg = system.config.get('storage', {})
+url_cache = PresignedUrlCache(minio_client, maxsize=storage_cfg.get('url_cache_size', 1024),
+                              expires=storage_cfg.get('url_expires', 3600)) if minio_client else None
+
+# Violation index, written by the save worker
+try:
+    index_path = storage_cfg.get('index_path')
+    violation_index = ViolationIndex(index_path) if index_path else None
+except Exception as e:
+    print(f"Warning: Could not open violation index: {e}")
+    violation_index = None
+
 # --- Dashboard Logic ---
 def get_dashboard_stats():
-    if not minio_client:
-        return "MinIO storage not available."
+    if violation_index is None:
+        return "Violation index not available."
     try:
-        proofs = minio_client.s3.list_objects_v2(Bucket=minio_client.buckets['proofs'])
-        count = proofs.get('KeyCount', 0)
-        return f"Total Violations Recorded: {count}"
+        now = time.time()
+        total = violation_index.count()
+        today = violation_index.count(start=now - 24 * 3600)
+        by_type = violation_index.count_by_type()
+        lines = [f"Total Violations Recorded: {total}", f"Last 24 hours: {today}"]
+        lines += [f"{violation_type}: {count}" for violation_type, count in sorted(by_type.items())]
+        return "\n".join(lines)
     except Exception as e:
-        return f"Error connecting to MinIO: {e}"
+        return f"Error reading violation index: {e}"
+
+def get_live_counters():
+    # Rolling counters of the detection loop, no storage access
+    summary = system.stats.summary(granularity='hour', last=1)
+    window = summary['window']
+    lines = [
+        f"Camera: {summary['camera']}",
+        f"Vehicles (last hour): {window.get('vehicles', 0)} / total {summary['totals'].get('vehicles', 0)}",
+        f"Violations (last hour): {window.get('violations', 0)} / total {summary['totals'].get('violations', 0)}",
+    ]
+    lines += [f"  {violation_type}: {count}" for violation_type, count in sorted(summary['violations_by_type'].items())]
+    if summary['plate_read_rate'] is not None:
+        lines.append(f"Plate read rate (last hour): {summary['plate_read_rate']:.0%}")
+    per_minute = system.stats.series('vehicles', granularity='minute', last=5)
+    lines.append("Vehicles per minute (last 5): " + ", ".join(str(count) for _, count in per_minute))
+    return "\n".join(lines)
 
-def get_proof_gallery():
-    if not minio_client:
-        return []
+def get_proof_gallery(page=0, plate="", page_size=10):
+    """Thumbnails of one page of the violation index, and the rows for show_full_proof"""
+    if url_cache is None or violation_index is None:
+        return [], []
     try:
-        objects = minio_client.s3.list_objects_v2(Bucket=minio_client.buckets['proofs'], MaxKeys=10)
-        images = []
-        if 'Contents' in objects:
-            for obj in objects['Contents']:
-                # Note: In a real deployment, use presigned URLs or a proxy.
-                # Assuming localhost access for now as per original code.
-                images.append((f"http://localhost:9000/{minio_client.buckets['proofs']}/{obj['Key']}", obj['Key']))
-        return images
-    except:
-        return []
+        rows = violation_index.query(limit=page_size, offset=int(page) * page_size, plate=plate or None)
+        images, shown = [], []
+        for row in rows:
+            # Older rows have no thumbnail, fall back to the crop
+            key = row['thumbnail_key'] or row['proof_key']
+            if key is None:
+                continue
+            caption = f"{row['violation_type']} {row['plate']} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['timestamp']))}"
+            images.append((url_cache.get(minio_client.buckets['proofs'], key), caption))
+            shown.append(row)
+        return images, shown
+    except Exception as e:
+        print(f"Error loading proof gallery: {e}")
+        return [], []
+
+def show_full_proof(evt: gr.SelectData, rows):
+    """Full resolution proof of the clicked thumbnail"""
+    row = rows[evt.index]
+    key = row.get('labeled_key') or row.get('proof_key')
+    if key is None:
+        # Older runs, or only the thumbnail / video was stored
+        gr.Warning("No proof stored for this violation")
+        return None
+    if key.endswith('.json'):
+        # Labeled proof stored as an annotation of the retraining image, render it
+        return cv2.cvtColor(minio_client.render_proof(key), cv2.COLOR_BGR2RGB)
+    return url_cache.get(minio_client.buckets['proofs'], key)
 
 # --- Visualization Logic ---
 def stream_video():
@@ -249,7 +302,20 @@ with gr.Blocks(title="Traffic Violation Detection System", theme=gr.themes.Soft(
             gr.Markdown("### System Statistics")
             stats_output = gr.Textbox(label="Status", value=get_dashboard_stats)
             refresh_btn = gr.Button("Refresh Stats")
+            counters_output = gr.Textbox(label="Live Counters", value=get_live_counters, lines=8)
             refresh_btn.click(get_dashboard_stats, outputs=stats_output)
+            refresh_btn.click(get_live_counters, outputs=counters_output)
+
+            gr.Markdown("### Recent Violations")
+            with gr.Row():
+                plate_input = gr.Textbox(label="License Plate")
+                page_input = gr.Number(label="Page", value=0, precision=0, minimum=0)
+            gallery_output = gr.Gallery(label="Proofs", columns=5)
+            gallery_rows = gr.State([])
+            gallery_btn = gr.Button("Search")
+            full_proof_output = gr.Image(label="Full Resolution Proof")
+            gallery_btn.click(get_proof_gallery, inputs=[page_input, plate_input], outputs=[gallery_output, gallery_rows])
+            gallery_output.select(show_full_proof, inputs=gallery_rows, outputs=full_proof_output)
             
         # --- Tab 2: Visualization ---
         with gr.Tab("Visualization"):
@@ -334,4 +400,6 @@ with gr.Blocks(title="Traffic Violation Detection System", theme=gr.themes.Soft(
                                     outputs=settings_status)
 
 if __name__ == "__main__":
-    demo.launch(server_name="0.0.0.0", server_port=7860)
+    # With the local backend the gallery images are files under its root
+    local_root = getattr(minio_client.backend, 'root', None) if minio_client else None
+    demo.launch(server_name="0.0.0.0", server_port=7860, allowed_paths=[local_root] if local_root else None)
@@ -0,0 +1,174 @@
+import queue
+
+from utils.logger import get_logger
+
+
+class EvidenceBatch:
+    """
+    Collect the violations finalized in one frame into a single evidence job.
+
+    Vehicle.mark_violation() only calls put() on its save queue, so a batch is handed to it in place
+    of the real queue. flush() then sends one job per frame to the save worker:
+
+        {
+            'records': [ {vehicle_id, identifier, violation_type, timestamp, frame, frame_idx, bbox, crop_box, bboxes, proof_crop,
+                          class_id, score, low_conf_hits, plate_read, detections}, ... ],
+            'frame_store': FrameRetentionBuffer,  # shared by all records
+            'window': list,                       # pre/post-roll frame indices, pinned once for the job
+            'frame_buffer': list,                 # pre-roll frames when there is no frame_store
+            'fps': int
+        }
+
+    The worker encodes the shared frames and the clip once and draws every offending box on them,
+    while still writing a record and a crop per vehicle.
+    """
+    RECORD_KEYS = ('vehicle_id', 'identifier', 'violation_type', 'timestamp', 'frame', 'frame_idx', 'bbox', 'crop_box', 'bboxes', 'proof_crop',
+                   'class_id', 'score', 'low_conf_hits', 'plate_read', 'detections')
+
+    def __init__(self):
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, data):
+        self.items.append(data)
+
+    put_nowait = put
+
+    def flush(self, save_queue):
+        """Send the collected violations to save_queue as one job per frame store. Returns the number of jobs."""
+        jobs = []
+        for data in self.items:
+            job = next((job for job in jobs if job['frame_store'] is data.get('frame_store')), None)
+            if job is None:
+                job = {
+                    'records': [],
+                    'frame_store': data.get('frame_store'),
+                    'window': data.get('window'),
+                    'frame_buffer': data.get('frame_buffer', []),
+                    'fps': data.get('fps', 30),
+                }
+                jobs.append(job)
+            elif data.get('window'):
+                # Every record pinned the same pre-roll window, one set of pins is enough
+                if job['window'] is None:
+                    job['window'] = data['window']
+                else:
+                    data['frame_store'].release_all(data['window'])
+            job['records'].append({key: data.get(key) for key in self.RECORD_KEYS})
+
+        for job in jobs:
+            submit_job(save_queue, job)
+        self.items = []
+        return len(jobs)
+
+
+class EvidenceQueue(queue.Queue):
+    """
+    Bounded queue of evidence jobs for the save worker.
+
+    When it is full, submit_job() applies the overflow policy:
+      - 'copy': the job's pinned frames are copied out of the frame buffer and the job is queued past
+        maxsize, so its slots return to the capture loop and no evidence is lost. At most overflow_size
+        such jobs (default maxsize) wait at a time, further ones are dropped
+      - 'drop': the job is dropped
+
+    copied and dropped count the jobs each way, logger (set by EvidencePipeline) reports them.
+    """
+    def __init__(self, maxsize=0, overflow='copy', overflow_size=None, logger=None):
+        super().__init__(maxsize)
+        if overflow not in ('copy', 'drop'):
+            raise ValueError(f"Unknown queue overflow policy: {overflow}")
+        self.overflow = overflow
+        self.overflow_size = maxsize if overflow_size is None else overflow_size
+        self.logger = logger
+        self.copied = 0
+        self.dropped = 0
+        self._overflow_ids = set()  # ids of the queued jobs put past maxsize
+
+    def has_overflow_room(self) -> bool:
+        with self.mutex:
+            return self.overflow == 'copy' and len(self._overflow_ids) < self.overflow_size
+
+    def put_overflow(self, job) -> bool:
+        """Queue job past maxsize, False if overflow_size jobs are already waiting that way"""
+        with self.not_full:
+            if self.overflow != 'copy' or len(self._overflow_ids) >= self.overflow_size:
+                return False
+            self._overflow_ids.add(id(job))
+            self._put(job)
+            self.unfinished_tasks += 1
+            self.copied += 1
+            self.not_empty.notify()
+        return True
+
+    def _get(self):
+        job = super()._get()
+        self._overflow_ids.discard(id(job))
+        return job
+
+
+def submit_job(save_queue, job) -> bool:
+    """
+    Hand an evidence job (or single violation dict) to the save worker without blocking the frame loop.
+
+    If save_queue is full, an EvidenceQueue with the 'copy' policy takes the job past its size with
+    private copies of the pinned frames (post-roll frames not recorded yet are left out of the clip).
+    Otherwise the job is dropped: its frame pins are released and it is counted in save_queue.dropped.
+    Returns False if the job was dropped.
+    """
+    try:
+        save_queue.put_nowait(job)
+        return True
+    except queue.Full:
+        pass
+
+    records = job['records'] if 'records' in job else [job]
+    identifiers = [record.get('identifier') for record in records]
+    logger = getattr(save_queue, 'logger', None) or get_logger("violation_worker", file_logging=True)
+    if hasattr(save_queue, 'put_overflow') and save_queue.has_overflow_room():
+        _detach_frames(job, records)
+        if save_queue.put_overflow(job):
+            logger.warning(f"Save queue full, evidence of {identifiers} queued with copied frames")
+            return True
+    else:
+        _release_pins(job, records)
+    if hasattr(save_queue, 'dropped'):
+        save_queue.dropped += 1
+    logger.error(f"Save queue full, dropping evidence of {identifiers}")
+    return False
+
+
+def _release_pins(job, records):
+    frame_store = job.get('frame_store')
+    if frame_store is None:
+        return
+    for record in records:
+        if record.get('frame_idx') is not None:
+            frame_store.release(record['frame_idx'])
+    frame_store.release_all(job.get('window') or [])
+
+
+def _detach_frames(job, records):
+    """Replace the job's pinned frames by private copies and release the pins"""
+    frame_store = job.get('frame_store')
+    if frame_store is None:
+        return
+    copies = {}
+    for record in records:
+        frame_idx = record.get('frame_idx')
+        if record.get('frame') is None and frame_idx is not None:
+            if frame_idx not in copies:
+                frame = frame_store.get(frame_idx)
+                copies[frame_idx] = None if frame is None else frame.copy()
+            # Records of one frame keep sharing it, the worker encodes it once
+            record['frame'] = copies[frame_idx]
+            record['frame_idx'] = None
+            frame_store.release(frame_idx)  # the pin this record held
+    window = job.get('window') or []
+    frame_buffer = [(idx, frame_store.get(idx)) for idx in window]
+    job['frame_buffer'] = [(idx, frame.copy()) for idx, frame in frame_buffer if frame is not None]
+    frame_store.release_all(window)
+    job['window'] = None
+    job['frame_store'] = None
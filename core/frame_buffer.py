@@ -0,0 +1,494 @@
+import os
+import time
+import tempfile
+import threading
+import cv2
+import numpy as np
+from collections import deque
+
+class FrameRetentionBuffer:
+    """
+    Ring of preallocated frame slots, shared by the video pre-roll and the violation evidence.
+
+    append() copies each frame into a free slot, so the capture loop does not allocate a new frame
+    per tick. Iterating the buffer yields the (frame_idx, frame) pairs of the last maxlen frames like
+    the deque it replaces, but the frames are views into the slots. Violations never copy frames:
+    they pin single frames (pin) or the whole window (pin_window), and a pinned slot is not reused
+    until every holder has released it, even after it left the window. Besides the window there
+    are spare_slots slots for frames pinned by pending jobs. When every slot is pinned, append()
+    either drops the new frame (on_full='drop') or waits up to block_timeout seconds for the save
+    worker to release one (on_full='block'). Post-roll is handled with reserve(): frames that have
+    not been written yet are pinned as soon as they arrive, and wait_for() blocks until they have.
+
+    Single frames pinned with pin() are capped at max_pinned frames (half the spare slots by default):
+    past it pin() fails and the caller keeps its own copy, so pins that are never released cannot
+    use up the slots the pending jobs need.
+    """
+    def __init__(self, maxlen: int, spare_slots: int = None, on_full: str = 'drop', block_timeout: float = 1.0,
+                 max_pinned: int = None):
+        if on_full not in ('drop', 'block'):
+            raise ValueError(f"on_full must be 'drop' or 'block', got {on_full}")
+        self.maxlen = maxlen
+        spare_slots = maxlen if spare_slots is None else spare_slots
+        self.capacity = maxlen + spare_slots
+        self.max_pinned = max(1, spare_slots // 2) if max_pinned is None else max_pinned
+        self.on_full = on_full
+        self.block_timeout = block_timeout
+        self.dropped = 0  # frames dropped because all slots were pinned
+
+        self._slots = None                                 # (capacity, h, w, c), allocated on the first frame
+        self._slot_frame_idx = [None] * self.capacity
+        self._refs = np.zeros(self.capacity, dtype=np.int64)
+        self._index = {}                                   # frame_idx -> slot
+        self._window = deque()                             # slots of the last maxlen frames, oldest first
+        self._free = list(range(self.capacity - 1, -1, -1))
+        self._reserved = {}                                # frame_idx not written yet -> pins waiting for it
+        self._latest = None                                # index of the last frame written
+        self._pins = {}                                    # frame_idx -> pins taken with pin()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._window)
+
+    def __iter__(self):
+        with self._cond:
+            return iter([(self._slot_frame_idx[slot], self._slots[slot]) for slot in self._window])
+
+    @property
+    def latest_idx(self):
+        return self._latest
+
+    def append(self, item) -> bool:
+        """Copy a (frame_idx, frame) pair into a slot. Returns False if the frame was dropped."""
+        frame_idx, frame = item
+        with self._cond:
+            if self._slots is None:
+                self._slots = self._allocate_slots(frame.shape, frame.dtype)
+            elif frame.shape != self._slots.shape[1:]:
+                raise ValueError(f"Frame shape changed from {self._slots.shape[1:]} to {frame.shape}")
+
+            slot = self._acquire_slot()
+            deadline = time.monotonic() + self.block_timeout
+            while slot is None and self.on_full == 'block' and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+                slot = self._acquire_slot()
+            if slot is None:
+                self.dropped += 1
+                print(f"All {self.capacity} frame slots are pinned, dropping frame {frame_idx}")
+                return False
+
+        # The slot is in neither the window nor the free list, nobody else touches it
+        np.copyto(self._slots[slot], frame)
+
+        with self._cond:
+            self._slot_frame_idx[slot] = frame_idx
+            self._index[frame_idx] = slot
+            self._refs[slot] = self._reserved.pop(frame_idx, 0)
+            self._window.append(slot)
+            self._latest = frame_idx
+            self._cond.notify_all()
+        return True
+
+    def pin(self, frame_idx) -> bool:
+        """Keep the slot of frame_idx until release(). Returns False if the frame is not held or max_pinned is reached."""
+        with self._cond:
+            slot = self._index.get(frame_idx)
+            if slot is None:
+                return False
+            if frame_idx not in self._pins and len(self._pins) >= self.max_pinned:
+                print(f"{len(self._pins)} frames are pinned already, not pinning frame {frame_idx}")
+                return False
+            self._refs[slot] += 1
+            self._pins[frame_idx] = self._pins.get(frame_idx, 0) + 1
+            return True
+
+    def pin_window(self) -> list:
+        """Pin every frame of the current window, returns their indices (oldest first)"""
+        with self._cond:
+            frame_indices = [self._slot_frame_idx[slot] for slot in self._window]
+            for slot in self._window:
+                self._refs[slot] += 1
+            return frame_indices
+
+    def reserve(self, start_idx, end_idx) -> list:
+        """Pin frames start_idx..end_idx, including ones not written yet. Returns their indices."""
+        with self._cond:
+            frame_indices = list(range(start_idx, end_idx + 1))
+            for frame_idx in frame_indices:
+                slot = self._index.get(frame_idx)
+                if slot is not None:
+                    self._refs[slot] += 1
+                else:
+                    self._reserved[frame_idx] = self._reserved.get(frame_idx, 0) + 1
+            return frame_indices
+
+    def wait_for(self, frame_idx, timeout=None) -> bool:
+        """Block until frame_idx has been written. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._latest is not None and self._latest >= frame_idx, timeout)
+
+    def release(self, frame_idx):
+        """Drop one pin of frame_idx"""
+        with self._cond:
+            slot = self._index.get(frame_idx)
+            if slot is None:
+                self._release_reservation(frame_idx)
+                return
+            if self._refs[slot] == 0:
+                return
+            self._refs[slot] -= 1
+            count = self._pins.get(frame_idx, 0)
+            if count > 1:
+                self._pins[frame_idx] = count - 1
+            elif count == 1:
+                del self._pins[frame_idx]
+            if self._refs[slot] == 0 and slot not in self._window:
+                self._free_slot(slot)
+                self._cond.notify_all()
+
+    def release_all(self, frame_indices):
+        for frame_idx in frame_indices:
+            self.release(frame_idx)
+
+    def get(self, frame_idx):
+        """
+        View of the frame with index frame_idx, or None if it is not held.
+        The view only stays valid while the frame is pinned.
+        """
+        with self._cond:
+            slot = self._index.get(frame_idx)
+            return None if slot is None else self._slots[slot]
+
+    def pinned_count(self, frame_idx) -> int:
+        with self._cond:
+            slot = self._index.get(frame_idx)
+            return 0 if slot is None else int(self._refs[slot])
+
+    def _allocate_slots(self, shape, dtype):
+        return np.empty((self.capacity,) + shape, dtype=dtype)
+
+    def _release_reservation(self, frame_idx):
+        count = self._reserved.get(frame_idx, 0)
+        if count > 1:
+            self._reserved[frame_idx] = count - 1
+        elif count == 1:
+            del self._reserved[frame_idx]
+
+    def _acquire_slot(self):
+        if len(self._window) >= self.maxlen:
+            oldest = self._window[0]
+            if self._refs[oldest] == 0:
+                self._window.popleft()
+                self._unmap(oldest)
+                return oldest
+            if self._free:
+                # The oldest frame leaves the window but its slot stays pinned
+                self._window.popleft()
+                return self._free.pop()
+            return None
+        return self._free.pop() if self._free else None
+
+    def _free_slot(self, slot):
+        self._unmap(slot)
+        self._free.append(slot)
+
+    def _unmap(self, slot):
+        frame_idx = self._slot_frame_idx[slot]
+        if frame_idx is not None and self._index.get(frame_idx) == slot:
+            del self._index[frame_idx]
+        self._slot_frame_idx[slot] = None
+
+
+class MappedFrameBuffer(FrameRetentionBuffer):
+    """
+    FrameRetentionBuffer whose slots live in a memory-mapped file on local disk.
+
+    Only the small frame index -> slot map is kept in memory, so 10-30 s windows with post-roll cost
+    disk space instead of RAM. Evidence is read as slices straight from the mapping. The file is
+    unlinked as soon as it is created, so nothing is left behind when the process exits.
+    """
+    def __init__(self, maxlen: int, spare_slots: int = None, on_full: str = 'drop', block_timeout: float = 1.0,
+                 max_pinned: int = None, directory: str = None):
+        super().__init__(maxlen, spare_slots=spare_slots, on_full=on_full, block_timeout=block_timeout, max_pinned=max_pinned)
+        self.directory = directory
+        self._file = None
+
+    def _allocate_slots(self, shape, dtype):
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self._file = tempfile.TemporaryFile(prefix="frame_ring_", dir=self.directory)
+        return np.memmap(self._file, dtype=dtype, mode='w+', shape=(self.capacity,) + shape)
+
+    def close(self):
+        self._slots = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class EncodedFrameBuffer:
+    """
+    Pre-roll buffer that keeps frames JPEG-encoded instead of as raw arrays.
+
+    Same interface as FrameRetentionBuffer. Frames are encoded intra-only (each frame is its own
+    keyframe, so a clip can start anywhere), which takes a 1080p frame from ~6 MB to a few hundred KB.
+    Encoding costs ~10 ms per 1080p frame, so it runs on a background thread: append() only copies the
+    frame into a pending queue, and pending frames are served raw until they are encoded. Once
+    max_pending frames wait, append() drops the new frame (on_full='drop') or waits up to
+    block_timeout seconds for the encoder (on_full='block'). As in FrameRetentionBuffer, single frames
+    pinned with pin() are capped at max_pinned (half the window by default), past it the caller keeps
+    its own copy. Frames are decoded only when
+    evidence is extracted, by the save worker: get() decodes one frame, and a save job decodes just the
+    frames it pinned. Pinned frames keep their encoded bytes after they leave the window, until every
+    holder has released them. Trades CPU for memory, it is off by default (violation.preroll_encoding).
+    """
+    decodes_on_get = True  # get() decodes, the capture loop uses holds() and frame_shape instead
+
+    def __init__(self, maxlen: int, quality: int = 85, max_pending: int = None, on_full: str = 'drop',
+                 block_timeout: float = 1.0, max_pinned: int = None):
+        if on_full not in ('drop', 'block'):
+            raise ValueError(f"on_full must be 'drop' or 'block', got {on_full}")
+        self.maxlen = maxlen
+        self.quality = quality
+        self.max_pending = maxlen if max_pending is None else max_pending
+        self.max_pinned = max(1, maxlen // 2) if max_pinned is None else max_pinned
+        self.on_full = on_full
+        self.block_timeout = block_timeout
+        self.dropped = 0        # frames dropped because the encoder fell behind
+        self.frame_shape = None
+        self._window = deque()  # (frame_idx, jpeg bytes), oldest first
+        self._pending = deque() # (frame_idx, raw frame) not encoded yet, oldest first
+        self._pinned = {}       # frame_idx -> [jpeg bytes, reference count]
+        self._reserved = {}     # frame_idx not encoded yet -> pins waiting for it
+        self._latest = None     # index of the last frame appended
+        self._pins = {}         # frame_idx -> pins taken with pin()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def __len__(self):
+        with self._cond:
+            return len(self._window) + len(self._pending)
+
+    def __iter__(self):
+        with self._cond:
+            window = list(self._window)
+            pending = list(self._pending)
+        return iter([(frame_idx, self._decode(data)) for frame_idx, data in window] + pending)
+
+    @property
+    def latest_idx(self):
+        return self._latest
+
+    @property
+    def nbytes(self) -> int:
+        """Encoded size of the window and the pinned frames"""
+        with self._cond:
+            data = {frame_idx: data for frame_idx, data in self._window}
+            data.update({frame_idx: entry[0] for frame_idx, entry in self._pinned.items()})
+            return sum(len(d) for d in data.values())
+
+    def append(self, item) -> bool:
+        """Queue a (frame_idx, frame) pair for encoding into the window. Returns False if the frame was dropped."""
+        frame_idx, frame = item
+        with self._cond:
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._encode_loop, daemon=True)
+                self._thread.start()
+            # The encoder fell behind by max_pending frames: never grow, drop or wait a bounded time
+            has_room = lambda: len(self._pending) < max(1, self.max_pending)
+            if not has_room() and (self.on_full == 'drop' or not self._cond.wait_for(has_room, self.block_timeout)):
+                self.dropped += 1
+                print(f"{len(self._pending)} frames are waiting to be encoded, dropping frame {frame_idx}")
+                return False
+        frame = frame.copy()
+        with self._cond:
+            self.frame_shape = frame.shape
+            self._pending.append((frame_idx, frame))
+            while len(self._window) + len(self._pending) > self.maxlen and self._window:
+                self._window.popleft()
+            self._latest = frame_idx
+            self._cond.notify_all()
+        return True
+
+    def flush(self, timeout=None) -> bool:
+        """Block until every appended frame is encoded. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def holds(self, frame_idx) -> bool:
+        """Whether frame_idx can still be retrieved, without decoding it"""
+        with self._cond:
+            return frame_idx in self._pinned or self._find_pending(frame_idx) is not None \
+                or self._find_in_window(frame_idx) is not None
+
+    def pin(self, frame_idx) -> bool:
+        """Keep frame_idx retrievable until release(). Returns False if the frame is not held or max_pinned is reached."""
+        with self._cond:
+            if frame_idx not in self._pins and len(self._pins) >= self.max_pinned:
+                print(f"{len(self._pins)} frames are pinned already, not pinning frame {frame_idx}")
+                return False
+            if not self._pin(frame_idx):
+                return False
+            self._pins[frame_idx] = self._pins.get(frame_idx, 0) + 1
+            return True
+
+    def pin_window(self) -> list:
+        """Pin every frame of the current window, returns their indices (oldest first)"""
+        with self._cond:
+            frame_indices = [frame_idx for frame_idx, _ in self._window] + [frame_idx for frame_idx, _ in self._pending]
+            for frame_idx in frame_indices:
+                self._pin(frame_idx)
+            return frame_indices
+
+    def reserve(self, start_idx, end_idx) -> list:
+        """Pin frames start_idx..end_idx, including ones not written yet. Returns their indices."""
+        with self._cond:
+            frame_indices = list(range(start_idx, end_idx + 1))
+            for frame_idx in frame_indices:
+                if not self._pin(frame_idx):
+                    self._reserved[frame_idx] = self._reserved.get(frame_idx, 0) + 1
+            return frame_indices
+
+    def wait_for(self, frame_idx, timeout=None) -> bool:
+        """Block until frame_idx has been written. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._latest is not None and self._latest >= frame_idx, timeout)
+
+    def release(self, frame_idx):
+        """Drop one pin of frame_idx"""
+        with self._cond:
+            count = self._pins.get(frame_idx, 0)
+            if count > 1:
+                self._pins[frame_idx] = count - 1
+            elif count == 1:
+                del self._pins[frame_idx]
+            entry = self._pinned.get(frame_idx)
+            if entry is None:
+                count = self._reserved.get(frame_idx, 0)
+                if count > 1:
+                    self._reserved[frame_idx] = count - 1
+                elif count == 1:
+                    del self._reserved[frame_idx]
+                return
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._pinned[frame_idx]
+
+    def release_all(self, frame_indices):
+        for frame_idx in frame_indices:
+            self.release(frame_idx)
+
+    def get(self, frame_idx):
+        """Frame with index frame_idx (decoded unless it is still pending), or None if it is not held"""
+        with self._cond:
+            frame = self._find_pending(frame_idx)
+            if frame is not None:
+                return frame
+            entry = self._pinned.get(frame_idx)
+            data = entry[0] if entry is not None else self._find_in_window(frame_idx)
+        return None if data is None else self._decode(data)
+
+    def pinned_count(self, frame_idx) -> int:
+        with self._cond:
+            entry = self._pinned.get(frame_idx)
+            if entry is not None:
+                return entry[1]
+            return self._reserved.get(frame_idx, 0)
+
+    def _encode_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or not self._running)
+                if not self._pending:
+                    return
+                frame_idx, frame = self._pending[0]
+
+            ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+
+            with self._cond:
+                self._pending.popleft()
+                if not ok:
+                    print(f"Failed to encode frame {frame_idx}")
+                    self._reserved.pop(frame_idx, None)
+                else:
+                    data = encoded.tobytes()
+                    self._window.append((frame_idx, data))
+                    while len(self._window) + len(self._pending) > self.maxlen and self._window:
+                        self._window.popleft()
+                    count = self._reserved.pop(frame_idx, 0)
+                    if count:
+                        self._pinned[frame_idx] = [data, count]
+                self._cond.notify_all()
+
+    def _pin(self, frame_idx):
+        entry = self._pinned.get(frame_idx)
+        if entry is not None:
+            entry[1] += 1
+            return True
+        if self._find_pending(frame_idx) is not None:
+            # Pinned once it is encoded
+            self._reserved[frame_idx] = self._reserved.get(frame_idx, 0) + 1
+            return True
+        data = self._find_in_window(frame_idx)
+        if data is None:
+            return False
+        self._pinned[frame_idx] = [data, 1]
+        return True
+
+    def _find_pending(self, frame_idx):
+        for idx, frame in self._pending:
+            if idx == frame_idx:
+                return frame
+        return None
+
+    def _find_in_window(self, frame_idx):
+        # Frame indices grow by one per frame, so the position in the window is usually direct
+        if self._window:
+            pos = frame_idx - self._window[0][0]
+            if 0 <= pos < len(self._window) and self._window[pos][0] == frame_idx:
+                return self._window[pos][1]
+        for idx, data in self._window:
+            if idx == frame_idx:
+                return data
+        return None
+
+    @staticmethod
+    def _decode(data):
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def make_frame_buffer(maxlen: int, violation_config: dict = None):
+    """
+    Create the pre-roll frame buffer configured in the violation section of config.yaml
+
+    Args:
+        maxlen (int): number of frames in the pre-roll window
+        violation_config (dict): the 'violation' section of the config
+    """
+    violation_config = violation_config or {}
+    if violation_config.get('preroll_encoding', 'raw') == 'jpeg':
+        if violation_config.get('preroll_storage', 'memory') == 'disk':
+            print("Warning: preroll_encoding 'jpeg' keeps the pre-roll in memory, preroll_storage 'disk' is ignored")
+        return EncodedFrameBuffer(maxlen=maxlen, quality=violation_config.get('preroll_jpeg_quality', 85),
+                                  on_full=violation_config.get('frame_slots_on_full', 'drop'),
+                                  max_pinned=violation_config.get('max_pinned_frames'))
+    if violation_config.get('preroll_storage', 'memory') == 'disk':
+        return MappedFrameBuffer(maxlen=maxlen,
+                                 spare_slots=violation_config.get('spare_frame_slots'),
+                                 on_full=violation_config.get('frame_slots_on_full', 'drop'),
+                                 max_pinned=violation_config.get('max_pinned_frames'),
+                                 directory=violation_config.get('preroll_disk_path'))
+    return FrameRetentionBuffer(maxlen=maxlen,
+                                spare_slots=violation_config.get('spare_frame_slots'),
+                                on_full=violation_config.get('frame_slots_on_full', 'drop'),
+                                max_pinned=violation_config.get('max_pinned_frames'))
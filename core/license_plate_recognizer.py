@@ -1,19 +1,35 @@
 import warnings
+import numpy as np
 
 warnings.filterwarnings("ignore")
 
 class LicensePlateRecognizer:
     """
     Recognize license plate of violated vehicles
+
+    The plate box found by the detector is remembered per vehicle track, relative to
+    the vehicle bbox. Later attempts for the same track propagate that box and go straight
+    to OCR; the plate detector only runs again when OCR confidence drops, the vehicle box
+    shape drifts too far from the one the plate was found in, or the cached box gets too old.
     """
-    def __init__(self, license_model, character_model):
+    def __init__(self, license_model, character_model, min_ocr_confidence=0.6, max_shape_drift=0.2, max_reuse=10, plate_margin=0.1):
         self.license_model = license_model
         self.character_model = character_model
 
-    def update(self, frame, state):
+        self.min_ocr_confidence = min_ocr_confidence # re-detect when OCR on a propagated box is less confident than this
+        self.max_shape_drift = max_shape_drift       # re-detect when vehicle box aspect ratio changes by more than this (relative)
+        self.max_reuse = max_reuse                   # re-detect after this many propagated reads
+        self.plate_margin = plate_margin             # grow propagated box by this fraction of the plate size
+
+        # track_id -> {'rel_box': (rx1, ry1, rx2, ry2), 'aspect': float, 'reuse': int}
+        self.plate_boxes = {}
+
+    def update(self, frame, state, track_id=None):
         """
         Detect + OCR license plate for a single vehicle
         Returns candidate license plate string (NOT final)
+
+        If track_id is given, the plate box is cached for that track and reused on later calls.
         """
         if frame is None:
             return None
@@ -24,11 +40,24 @@ class LicensePlateRecognizer:
         crop = frame[
             max(0, y1):min(h, y2),
             max(0, x1):min(w, x2)
-        ].copy()
+        ]
 
         if crop.size == 0:
             return None
 
+        # Try the propagated plate box first
+        cached = self.plate_boxes.get(track_id) if track_id is not None else None
+        if cached is not None and self._is_reusable(cached, crop.shape):
+            lp_crop = self._crop_relative(crop, cached['rel_box'], margin=self.plate_margin)
+            if lp_crop.size > 0:
+                plate_text, confidence = self._ocr(lp_crop)
+                cached['reuse'] += 1
+                if confidence >= self.min_ocr_confidence and plate_text is not None and len(plate_text) > 3:
+                    print(f"License Plate Text: {plate_text}")
+                    return plate_text
+            # Propagated box is not good enough anymore, fall back to full detection
+            self.plate_boxes.pop(track_id, None)
+
         results = self.license_model.predict(crop, verbose=False)
         if len(results) == 0 or len(results[0].boxes) == 0:
             print('Cannot DETECT any license plates ')
@@ -41,13 +70,56 @@ class LicensePlateRecognizer:
         if lp_crop.size == 0:
             return None
 
-        plate_text = self._ocr(lp_crop)
+        plate_text, confidence = self._ocr(lp_crop)
         if plate_text is None or len(plate_text) <= 3:
             print("Cannot RECOGNIZE license plates")
             return None
+
+        if track_id is not None:
+            ch, cw = crop.shape[:2]
+            self.plate_boxes[track_id] = {
+                'rel_box': (lx1 / cw, ly1 / ch, lx2 / cw, ly2 / ch),
+                'aspect': cw / ch,
+                'reuse': 0
+            }
+
         print(f"License Plate Text: {plate_text}")
         return plate_text
 
+    def forget(self, track_id):
+        """Drop the cached plate box of a track"""
+        self.plate_boxes.pop(track_id, None)
+
+    def prune(self, active_ids):
+        """Drop cached plate boxes of tracks that are no longer active"""
+        active_ids = set(active_ids)
+        for track_id in list(self.plate_boxes):
+            if track_id not in active_ids:
+                del self.plate_boxes[track_id]
+
+    def _is_reusable(self, cached, crop_shape):
+        if cached['reuse'] >= self.max_reuse:
+            return False
+        ch, cw = crop_shape[:2]
+        aspect = cw / ch
+        return abs(aspect - cached['aspect']) / cached['aspect'] <= self.max_shape_drift
+
+    @staticmethod
+    def _crop_relative(crop, rel_box, margin=0.0):
+        ch, cw = crop.shape[:2]
+        rx1, ry1, rx2, ry2 = rel_box
+        mx = (rx2 - rx1) * margin
+        my = (ry2 - ry1) * margin
+        lx1 = max(0, int((rx1 - mx) * cw))
+        ly1 = max(0, int((ry1 - my) * ch))
+        lx2 = min(cw, int(np.ceil((rx2 + mx) * cw)))
+        ly2 = min(ch, int(np.ceil((ry2 + my) * ch)))
+        return crop[ly1:ly2, lx1:lx2]
 
     def _ocr(self, lp_img):
-        return self.character_model.run(lp_img)[0].rstrip("_")
+        """Return (plate text, mean character confidence)"""
+        plates, probs = self.character_model.run(lp_img, return_confidence=True)
+        plate_text = plates[0].rstrip("_")
+        char_probs = np.asarray(probs[0], dtype=float)
+        confidence = float(char_probs.mean()) if char_probs.size > 0 else 0.0
+        return plate_text, confidence
@@ -1,8 +1,20 @@
+import threading
 
+import numpy as np
 
 class LightSignalFSM:
     """
     A finite state machine to manage the states of a light signal.
+
+    With cycle_model enabled, the FSM also learns how long each phase lasts from the
+    transitions it confirms. Between transitions the current state is predicted from that
+    model, and should_sample() only asks for detector samples in a window around the
+    expected change (plus a slow keep-alive sample). A transition seen outside the window is
+    a miss and switches the direction back to continuous sampling until the model hits again.
+    Times are timestamps when update() gets one, frame indices otherwise.
+
+    update() runs on the light worker thread while should_sample() and get_confidence() are
+    called from the capture thread, so the state and cycle model are guarded by a lock.
     """
 
     ALLOWED_NEXT_STATES = {
@@ -11,7 +23,8 @@ class LightSignalFSM:
         'YELLOW': ['RED']
     }
 
-    def __init__(self, initial_states=[None, 'RED', None], confirm_frames=3, strength_threshold=15):
+    def __init__(self, initial_states=[None, 'RED', None], confirm_frames=3, strength_threshold=15,
+                 cycle_model=False, sample_window=2.0, idle_interval=2.0, min_cycles=2, alpha=0.3):
         self.states = initial_states.copy()
         self.candiate_states = initial_states.copy()
         self.states_frame_count = [0, 0, 0]
@@ -19,39 +32,135 @@ class LightSignalFSM:
         self.strength_threshold = strength_threshold
         self.last_change_frames = [0, 0, 0]
 
-    def update(self, candidates: list, frame_idx):
+        # Cycle model
+        self.cycle_model = cycle_model
+        self.sample_window = sample_window  # sample continuously this long before/after an expected change
+        self.idle_interval = idle_interval  # keep-alive sampling period outside the window
+        self.min_cycles = min_cycles        # observed durations needed before a phase is predicted
+        self.alpha = alpha                  # EMA weight of new phase durations
+        self.last_change_times = [None, None, None]  # None until a full phase start has been observed
+        self.phase_durations = [{}, {}, {}]          # state -> {'mean', 'dev', 'n'}
+        self.misses = [0, 0, 0]
+        self.last_sample_time = None
+        self._lock = threading.RLock()
+
+    def update(self, candidates: list, frame_idx, timestamp=None):
         print(
         f"\r{self.states}",
         end="\n",
         flush=True,
     )
-        for i in range(3):
-            if candidates[i] is None:
-                continue
-            else:
-                candidate, strength = candidates[i]
+        with self._lock:
+            now = frame_idx if timestamp is None else timestamp
+            self.last_sample_time = now
 
-                if strength < self.strength_threshold:
+            for i in range(3):
+                if candidates[i] is None:
                     continue
+                else:
+                    candidate, strength = candidates[i]
+
+                    if strength < self.strength_threshold:
+                        continue
 
-                if candidate == self.states[i]:
-                    self.states_frame_count[i] = 0
-                    self.candiate_states[i] = None
+                    if candidate == self.states[i]:
+                        self.states_frame_count[i] = 0
+                        self.candiate_states[i] = None
+                        continue
+
+                    if candidate == self.candiate_states[i]:
+                        self.states_frame_count[i] += 1
+                    else:
+                        self.candiate_states[i] = candidate
+                        self.states_frame_count[i] = 1
+
+                    if self.states_frame_count[i] >= self.confirm_frames:
+                        if candidate in self.ALLOWED_NEXT_STATES[self.states[i]]:
+                            if self.cycle_model:
+                                self._learn_transition(i, now)
+                            self.states[i] = candidate
+                            self.last_change_frames[i] = frame_idx
+                            self.last_change_times[i] = now
+                        self.states_frame_count[i] = 0
+
+            return list(self.states)
+
+    def get_states(self):
+        with self._lock:
+            return list(self.states)
+
+    def expected_change(self, i):
+        """Expected time of the next transition of direction i, or None if it cannot be predicted yet"""
+        with self._lock:
+            model = self.phase_durations[i].get(self.states[i])
+            if self.last_change_times[i] is None or model is None or model['n'] < self.min_cycles:
+                return None
+            return self.last_change_times[i] + model['mean']
+
+    def should_sample(self, now):
+        """Whether the detector should be sampled at time now"""
+        with self._lock:
+            if not self.cycle_model:
+                return True
+            if self.last_sample_time is None or now - self.last_sample_time >= self.idle_interval:
+                return True
+
+            for i in range(3):
+                if self.states[i] is None:
+                    continue
+                # A transition is being confirmed or the model missed: sample continuously
+                if self.candiate_states[i] not in (None, self.states[i]) or self.misses[i] > 0:
+                    return True
+                expected = self.expected_change(i)
+                if expected is None or now >= expected - self.sample_window:
+                    return True
+            return False
+
+    def get_confidence(self, now):
+        """Confidence in [0, 1] of each predicted state (None for directions without a light)"""
+        with self._lock:
+            confidence = []
+            for i in range(3):
+                if self.states[i] is None:
+                    confidence.append(None)
+                    continue
+                if self.candiate_states[i] not in (None, self.states[i]):
+                    # A different colour is being confirmed
+                    confidence.append(0.5)
+                    continue
+                expected = self.expected_change(i)
+                if not self.cycle_model or expected is None:
+                    # No model: the state is as fresh as the continuous sampling
+                    confidence.append(1.0)
                     continue
 
-                if candidate == self.candiate_states[i]:
-                    self.states_frame_count[i] += 1
+                model = self.phase_durations[i][self.states[i]]
+                reliability = model['n'] / (model['n'] + 1) / (1 + model['dev'] / max(model['mean'], 1e-6))
+                remaining = expected - now
+                if remaining >= self.sample_window:
+                    confidence.append(float(reliability))
                 else:
-                    self.candiate_states[i] = candidate
-                    self.states_frame_count[i] = 1
+                    # Falls to half at the expected change and to zero one window after it
+                    confidence.append(float(reliability * np.clip(0.5 + 0.5 * remaining / self.sample_window, 0.0, 1.0)))
+            return confidence
 
-                if self.states_frame_count[i] >= self.confirm_frames:
-                    if candidate in self.ALLOWED_NEXT_STATES[self.states[i]]:
-                        self.states[i] = candidate
-                        self.last_change_frames[i] = frame_idx
-                    self.states_frame_count[i] = 0
+    def _learn_transition(self, i, now):
+        if self.last_change_times[i] is None:
+            # The first phase started before we were watching, its duration is unknown
+            return
 
-        return self.states
-    
-    def get_states(self):
-        return self.states
\ No newline at end of file
+        expected = self.expected_change(i)
+        if expected is not None:
+            if abs(now - expected) > self.sample_window:
+                self.misses[i] += 1
+            else:
+                self.misses[i] = 0
+
+        duration = now - self.last_change_times[i]
+        model = self.phase_durations[i].get(self.states[i])
+        if model is None:
+            self.phase_durations[i][self.states[i]] = {'mean': duration, 'dev': 0.0, 'n': 1}
+        else:
+            model['dev'] = (1 - self.alpha) * model['dev'] + self.alpha * abs(duration - model['mean'])
+            model['mean'] = (1 - self.alpha) * model['mean'] + self.alpha * duration
+            model['n'] += 1
@@ -3,6 +3,12 @@ import numpy as np
 from utils.drawing import draw_light_zone
 
 class LightSignalDetector:
+    DIRECTIONS = ('straight', 'left', 'right')
+    COLORS = ('RED', 'YELLOW', 'GREEN')
+
+    # colour code bit -> colour class (a pixel can fall in several HSV ranges at once)
+    _CODE_BITS = ((np.arange(8)[:, None] >> np.arange(3)) & 1).astype(np.int64)
+
     def __init__(self, h, w, **kwargs):
         
         self.straight_light_zones = []  # List of polygons defining straight light zones
@@ -11,38 +17,70 @@ class LightSignalDetector:
 
         self.draw_zones(kwargs.get('frame', None), kwargs.get('window_name', "Traffic Violation Detection"))
 
-        self.zone_masks = {
-            'straight': [],
-            'left': [],
-            'right': []
-        }
-
         self.build_zone_mask(h, w)
 
     def build_zone_mask(self, h, w):
-        def make_masks(zones):
-            masks = []
-            for polygon in zones:
-                mask = np.zeros((h, w), dtype=np.uint8)
-                pts = np.array(polygon, np.int32).reshape((-1, 1, 2))
-                cv2.fillPoly(mask, [pts], 255)
-                masks.append(mask)
-            return masks
-        
-        self.zone_masks['straight'] = make_masks(self.straight_light_zones)
-        self.zone_masks['left'] = make_masks(self.left_light_zones)
-        self.zone_masks['right'] = make_masks(self.right_light_zones)
+        """Compile all light zones into one integer label image over the light-zone ROI.
 
-    def detect_light_signals(self, image):
-        """Detect light signals in the defined zones.
+        Light zones only cover a few hundred pixels, so colour conversion and counting
+        run on the union bounding box of the zones instead of the whole frame.
+        Pixel labels are zone index + 1 (0 is background); where zones overlap the later zone wins.
+        """
+        zones = []
+        zone_directions = []
+        for d, direction in enumerate(self.DIRECTIONS):
+            for polygon in getattr(self, f'{direction}_light_zones'):
+                zones.append(polygon)
+                zone_directions.append(d)
+        self.zone_directions = np.array(zone_directions, dtype=np.int64)
+
+        self.roi = None
+        self.zone_label_map = None
+        self.zone_pixels = np.empty(0, dtype=np.int64)
+        self.zone_pixel_labels = np.empty(0, dtype=np.int64)
+        if len(zones) == 0:
+            return
+
+        pts = np.array([pt for polygon in zones for pt in polygon], dtype=np.int32)
+        x1, y1 = np.clip(pts.min(axis=0), 0, [w, h])
+        x2, y2 = np.clip(pts.max(axis=0) + 1, 0, [w, h])
+        if x2 <= x1 or y2 <= y1:
+            return
+        self.roi = (int(x1), int(y1), int(x2), int(y2))
+
+        label_map = np.zeros((y2 - y1, x2 - x1), dtype=np.int32)
+        for i, polygon in enumerate(zones):
+            poly_pts = (np.array(polygon, np.int32) - [x1, y1]).reshape((-1, 1, 2))
+            cv2.fillPoly(label_map, [poly_pts], i + 1)
+        self.zone_label_map = label_map
+
+        # Only labelled pixels take part in scoring
+        self.zone_pixels = np.flatnonzero(label_map)
+        self.zone_pixel_labels = label_map.ravel()[self.zone_pixels].astype(np.int64) - 1
+
+    def crop_roi(self, image):
+        """Return the light-zone ROI of a frame (a view, not a copy), or None if no zones are defined"""
+        if self.roi is None:
+            return None
+        x1, y1, x2, y2 = self.roi
+        return image[y1:y2, x1:x2]
+
+    def count_zone_colors(self, image, is_roi=False):
+        """Count red, yellow and green pixels of every light zone.
 
         Args:
-            image (_type_): input image/frame
+            image (np.ndarray): input BGR frame, or its light-zone ROI if is_roi is True
+            is_roi (bool): whether image was already cropped with crop_roi
 
         Returns:
-            _type_: return 3 lists of detected light signals for left, right, and straight directions. If a list is empty, it means no zones were defined for that direction.
+            np.ndarray: (n_zones, 3) pixel counts ordered as COLORS
         """
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        n_zones = len(self.zone_directions)
+        if self.roi is None:
+            return np.zeros((n_zones, 3), dtype=np.int64)
+
+        roi = image if is_roi else self.crop_roi(image)
+        hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
 
         red1 = cv2.inRange(hsv, (0, 20, 50), (30, 255, 255))
         red2 = cv2.inRange(hsv, (160, 20, 50), (180, 255, 255))
@@ -53,35 +91,50 @@ class LightSignalDetector:
 
         green_mask = cv2.inRange(hsv, (55, 70, 120), (95, 255, 255))
 
-        candidates = {
-            'left': None,
-            'right': None,
-            'straight': None
-        }
+        # 3-bit colour code per zone pixel, then one bincount over (zone, code)
+        code = (red_mask.ravel()[self.zone_pixels] & 1) \
+            | (yellow_mask.ravel()[self.zone_pixels] & 2) \
+            | (green_mask.ravel()[self.zone_pixels] & 4)
+        hist = np.bincount(self.zone_pixel_labels * 8 + code, minlength=n_zones * 8).reshape(n_zones, 8)
+
+        return hist @ self._CODE_BITS
+
+    def detect_light_signals(self, image, is_roi=False):
+        """Detect light signals in the defined zones.
+
+        Args:
+            image (_type_): input image/frame
+            is_roi (bool): whether image was already cropped with crop_roi
+
+        Returns:
+            _type_: return 3 lists of detected light signals for left, right, and straight directions. If a list is empty, it means no zones were defined for that direction.
+        """
+        if self.roi is None:
+            return None, None, None
+
+        zone_counts = self.count_zone_colors(image, is_roi=is_roi)
+
+        # Each zone votes for its dominant colour (ties go to RED, then YELLOW)
+        winners = np.argmax(zone_counts, axis=1)
+        winner_counts = zone_counts[np.arange(len(winners)), winners]
+
+        n_dirs = len(self.DIRECTIONS)
+        bins = self.zone_directions * 3 + winners
+        scores = np.bincount(bins, weights=winner_counts, minlength=n_dirs * 3).reshape(n_dirs, 3)
+        counts = np.bincount(bins, minlength=n_dirs * 3).reshape(n_dirs, 3)
+        has_zones = np.bincount(self.zone_directions, minlength=n_dirs) > 0
+
+        best = np.argmax(scores, axis=1)
+        best_scores = scores[np.arange(n_dirs), best]
+        best_counts = counts[np.arange(n_dirs), best]
 
-        for direction in self.zone_masks:
-            if len(self.zone_masks[direction]) == 0:
+        candidates = {}
+        for d, direction in enumerate(self.DIRECTIONS):
+            if not has_zones[d]:
+                candidates[direction] = None
                 continue
-            scores = {'RED': 0, 'YELLOW': 0, 'GREEN': 0}
-            counts = {'RED': 0, 'YELLOW': 0, 'GREEN': 0}
-            for mask in self.zone_masks[direction]:
-                r = cv2.countNonZero(cv2.bitwise_and(red_mask, red_mask, mask=mask))
-                y = cv2.countNonZero(cv2.bitwise_and(yellow_mask, yellow_mask, mask=mask))
-                g = cv2.countNonZero(cv2.bitwise_and(green_mask, green_mask, mask=mask))
-
-                if r >= y and r >= g:
-                    scores['RED'] += r; counts['RED'] += 1
-                elif y >= g:
-                    scores['YELLOW'] += y; counts['YELLOW'] += 1
-                else:
-                    scores['GREEN'] += g; counts['GREEN'] += 1
-
-            best = max(scores, key=scores.get)
-            if counts[best] == 0:
-                score = 0
-            else:
-                score = scores[best] / counts[best]
-            candidates[direction] = (best, score)
+            score = float(best_scores[d] / best_counts[d]) if best_counts[d] > 0 else 0
+            candidates[direction] = (self.COLORS[best[d]], score)
 
         return candidates['left'], candidates['straight'], candidates['right']
 
@@ -0,0 +1,107 @@
+import time
+import threading
+from collections import deque
+from core.light_signal_detector import LightSignalDetector
+from core.light_signal_FSM import LightSignalFSM
+from core.light_state_provider import LightStateProvider
+
+class LightSignalStage(LightStateProvider):
+    """
+    Run light signal detection as its own pipeline stage.
+
+    The tracking loop hands every frame to submit(), which only keeps a copy of the light-zone
+    ROI when a sample is due (time-based, independent of FPS). A worker thread runs the detector
+    and the FSM on that sample and publishes the resulting states together with the frame index
+    and timestamp they belong to. get_states() returns the state for a given frame without blocking.
+    If the FSM runs a cycle model, samples are only taken when the FSM asks for them and each
+    published state carries the FSM confidence.
+    """
+    def __init__(self, detector: LightSignalDetector, fsm: LightSignalFSM, interval: float = 0.2, history: int = 32):
+        self.detector = detector
+        self.fsm = fsm
+        self.interval = interval
+
+        # Published states, oldest first: {'states': list, 'confidence': list, 'frame_idx': int, 'timestamp': float}
+        self.published = deque(maxlen=history)
+        self.initial_states = list(fsm.get_states())
+
+        self._pending = None
+        self._last_sample_time = None
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def submit(self, frame, frame_idx, timestamp=None):
+        """Offer a frame to the stage. Returns True if it was taken as a sample."""
+        now = time.monotonic()
+        if self._last_sample_time is not None and now - self._last_sample_time < self.interval:
+            return False
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        # Between predicted transitions the cycle model does not need a sample
+        if not self.fsm.should_sample(timestamp):
+            return False
+        self._last_sample_time = now
+
+        # Only the small ROI is copied, the frame itself is annotated in place later on
+        roi = self.detector.crop_roi(frame)
+        if roi is None:
+            return False
+
+        with self._cond:
+            # A sample the worker has not picked up yet is simply replaced by the newer one
+            self._pending = (frame_idx, timestamp, roi.copy())
+            self._cond.notify()
+        return True
+
+    def process(self, roi, frame_idx, timestamp):
+        """Run detector + FSM on one ROI sample and publish the result"""
+        detected_lights = self.detector.detect_light_signals(roi, is_roi=True)
+        states = list(self.fsm.update(candidates=detected_lights, frame_idx=frame_idx, timestamp=timestamp))
+        confidence = self.fsm.get_confidence(timestamp)
+        with self._cond:
+            self.published.append({'states': states, 'confidence': confidence, 'frame_idx': frame_idx, 'timestamp': timestamp})
+        return states
+
+    def get_state(self, frame_idx=None):
+        """Latest published state at or before frame_idx (latest overall if frame_idx is None)"""
+        with self._cond:
+            for state in reversed(self.published):
+                if frame_idx is None or state['frame_idx'] <= frame_idx:
+                    return state
+        return None
+
+    def get_states(self, frame_idx=None, timestamp=None):
+        """Light states [left, straight, right] that apply to frame_idx"""
+        state = self.get_state(frame_idx)
+        if state is None:
+            return list(self.initial_states)
+        return list(state['states'])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and self._pending is None:
+                    self._cond.wait()
+                if not self._running:
+                    break
+                frame_idx, timestamp, roi = self._pending
+                self._pending = None
+            self.process(roi, frame_idx, timestamp)
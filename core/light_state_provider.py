@@ -0,0 +1,170 @@
+import abc
+import json
+import time
+import socket
+import bisect
+import threading
+from urllib.parse import urlparse
+
+class LightStateProvider(abc.ABC):
+    """
+    Base class of all sources of traffic light states.
+
+    A provider answers which light states [left, straight, right] apply to a frame,
+    identified by its index and/or capture timestamp. Vision-based detection and
+    external controller feeds both implement this interface.
+    """
+    def start(self):
+        return self
+
+    def stop(self, timeout=1.0):
+        pass
+
+    def submit(self, frame, frame_idx, timestamp=None):
+        """Offer a frame to the provider. Providers that do not look at frames ignore it."""
+        return False
+
+    @abc.abstractmethod
+    def get_states(self, frame_idx=None, timestamp=None):
+        """Light states [left, straight, right] that apply to the given frame"""
+
+
+class ControllerLightProvider(LightStateProvider):
+    """
+    Light states taken from the traffic controller instead of the camera.
+
+    Reads newline-delimited JSON phase messages from a UDP socket ("udp://host:port") or from a
+    file / named pipe, and aligns them to frame timestamps. A message looks like
+
+        {"timestamp": 1718000000.25, "states": ["RED", "GREEN", null]}
+
+    or uses "left" / "straight" / "right" keys instead of "states". Messages without a timestamp
+    are stamped with the time they were received. The controller phase is authoritative, so
+    messages bypass LightSignalFSM debouncing and go straight to the violation rules.
+    """
+    DIRECTIONS = ('left', 'straight', 'right')
+    STATES = ('RED', 'YELLOW', 'GREEN')
+
+    def __init__(self, source=None, clock_offset=0.0, stale_after=5.0,
+                 default_states=[None, 'RED', None], history=256, poll_interval=0.05):
+        self.source = source
+        self.clock_offset = clock_offset     # added to message timestamps to bring them onto the frame clock
+        self.stale_after = stale_after       # seconds without messages before default_states are used again
+        self.default_states = list(default_states)
+        self.history = history
+        self.poll_interval = poll_interval
+
+        self._timestamps = []
+        self._states = []
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._sock = None
+
+    def start(self):
+        if self.source is not None and (self._thread is None or not self._thread.is_alive()):
+            self._running = True
+            if str(self.source).startswith("udp://"):
+                url = urlparse(self.source)
+                self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self._sock.bind((url.hostname or "0.0.0.0", url.port))
+                self._sock.settimeout(self.poll_interval)
+                target = self._read_udp
+            else:
+                target = self._read_file
+            self._thread = threading.Thread(target=target, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def feed(self, message, received_at=None):
+        """Add one phase message (JSON string or dict). Returns False if it could not be parsed."""
+        if received_at is None:
+            received_at = time.time()
+        try:
+            if isinstance(message, (str, bytes)):
+                message = json.loads(message)
+            states = self._parse_states(message)
+            timestamp = float(message.get('timestamp', received_at)) + self.clock_offset
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"Invalid controller message {message!r}: {e}")
+            return False
+
+        with self._lock:
+            # Messages normally arrive in order, but UDP may reorder them
+            i = bisect.bisect_right(self._timestamps, timestamp)
+            self._timestamps.insert(i, timestamp)
+            self._states.insert(i, states)
+            if len(self._timestamps) > self.history:
+                del self._timestamps[0]
+                del self._states[0]
+        return True
+
+    def get_states(self, frame_idx=None, timestamp=None):
+        """Controller phase in force at the frame timestamp (latest phase if timestamp is None)"""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            i = bisect.bisect_right(self._timestamps, timestamp)
+            if i == 0:
+                return list(self.default_states)
+            if self.stale_after is not None and timestamp - self._timestamps[i - 1] > self.stale_after:
+                return list(self.default_states)
+            return list(self._states[i - 1])
+
+    def _parse_states(self, message):
+        if 'states' in message:
+            states = list(message['states'])
+        else:
+            states = [message.get(direction) for direction in self.DIRECTIONS]
+        if len(states) != 3:
+            raise ValueError("expected 3 light states")
+
+        parsed = []
+        for state in states:
+            if state is None:
+                parsed.append(None)
+                continue
+            state = str(state).upper()
+            if state not in self.STATES:
+                raise ValueError(f"unknown light state {state}")
+            parsed.append(state)
+        return parsed
+
+    def _read_udp(self):
+        while self._running:
+            try:
+                data, _ = self._sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            received_at = time.time()
+            for line in data.decode("utf-8", errors="ignore").splitlines():
+                if line.strip():
+                    self.feed(line, received_at=received_at)
+
+    def _read_file(self):
+        # Works for growing files and named pipes: at EOF wait and keep reading
+        partial = ''
+        with open(self.source, 'r') as f:
+            while self._running:
+                line = f.readline()
+                if not line:
+                    time.sleep(self.poll_interval)
+                    continue
+                # The writer may not have finished the line yet
+                partial += line
+                if not partial.endswith('\n'):
+                    continue
+                line, partial = partial, ''
+                if line.strip():
+                    self.feed(line)
@@ -0,0 +1,116 @@
+import numpy as np
+import supervision as sv
+
+class LineCrossingEngine:
+    """
+    Vectorized line crossing for many lines and many tracks at once.
+
+    All lines are kept as arrays of endpoints with a category tag. Every frame the anchors of
+    all detections are computed once, and one cross-product test against all lines gives the
+    side of every (track, line) pair. The side each track was last seen on is kept per line in
+    an array, so crossings follow the same rules as sv.LineZone.trigger: a crossing only counts
+    while the anchor is within the perpendicular limits of the line, and "in" means moving to
+    the left of start -> end.
+    """
+    UNKNOWN, RIGHT, LEFT = -1, 0, 1
+
+    def __init__(self, categories=(), triggering_anchor=sv.Position.CENTER, max_idle_frames=1000):
+        self.categories = list(categories)
+        self.triggering_anchor = triggering_anchor
+        self.max_idle_frames = max_idle_frames  # forget tracks not seen for this many frames
+
+        self.starts = np.empty((0, 2), dtype=float)
+        self.vectors = np.empty((0, 2), dtype=float)
+        self.line_categories = np.empty(0, dtype=np.int64)
+
+        # Per-track state, rows sorted by tracker id
+        self.track_ids = np.empty(0, dtype=np.int64)
+        self.track_sides = np.empty((0, 0), dtype=np.int8)
+        self.track_last_seen = np.empty(0, dtype=np.int64)
+        self.frame_count = 0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add_line(self, start, end, category):
+        """Add a line from start to end (x, y) tagged with category"""
+        start = np.asarray(start, dtype=float)
+        vector = np.asarray(end, dtype=float) - start
+        if not np.any(vector):
+            raise ValueError("The magnitude of the vector cannot be zero.")
+        if category not in self.categories:
+            self.categories.append(category)
+
+        self.starts = np.vstack([self.starts, start])
+        self.vectors = np.vstack([self.vectors, vector])
+        self.line_categories = np.append(self.line_categories, self.categories.index(category))
+        # Existing tracks have not been seen relative to the new line yet
+        self.track_sides = np.hstack([self.track_sides, np.full((len(self.track_ids), 1), self.UNKNOWN, dtype=np.int8)])
+
+    def lines(self, category):
+        """(start, end) pairs of all lines of a category"""
+        if category not in self.categories:
+            return []
+        idx = np.flatnonzero(self.line_categories == self.categories.index(category))
+        return [(tuple(self.starts[i]), tuple(self.starts[i] + self.vectors[i])) for i in idx]
+
+    def trigger(self, detections: sv.Detections):
+        """
+        Update crossing state with the detections of the current frame.
+
+        Returns:
+            dict: category -> (crossed_in, crossed_out) boolean arrays of shape (len(detections),)
+        """
+        self.frame_count += 1
+        n = len(detections)
+        result = {category: (np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)) for category in self.categories}
+        if n == 0 or len(self) == 0 or detections.tracker_id is None:
+            return result
+
+        anchors = detections.get_anchors_coordinates(self.triggering_anchor)  # (N, 2)
+        rel = anchors[:, None, :] - self.starts[None, :, :]                  # (N, L, 2)
+        cross = self.vectors[None, :, 0] * rel[..., 1] - self.vectors[None, :, 1] * rel[..., 0]
+        proj = (rel * self.vectors[None, :, :]).sum(axis=-1)
+        in_limits = (proj >= 0) & (proj <= (self.vectors ** 2).sum(axis=-1)[None, :])
+        sides = np.where(cross < 0, self.LEFT, self.RIGHT).astype(np.int8)
+
+        rows = self._track_rows(np.asarray(detections.tracker_id, dtype=np.int64))
+        previous = self.track_sides[rows]
+
+        changed = in_limits & (previous != self.UNKNOWN) & (previous != sides)
+        crossed_in = changed & (sides == self.LEFT)
+        crossed_out = changed & (sides == self.RIGHT)
+
+        self.track_sides[rows] = np.where(in_limits, sides, previous)
+        self.track_last_seen[rows] = self.frame_count
+
+        # Reduce lines to categories: (N, L) @ (L, C)
+        onehot = np.zeros((len(self), len(self.categories)), dtype=np.int64)
+        onehot[np.arange(len(self)), self.line_categories] = 1
+        in_per_category = (crossed_in.astype(np.int64) @ onehot) > 0
+        out_per_category = (crossed_out.astype(np.int64) @ onehot) > 0
+        for c, category in enumerate(self.categories):
+            result[category] = (in_per_category[:, c], out_per_category[:, c])
+
+        self._forget_idle_tracks()
+        return result
+
+    def _track_rows(self, tracker_ids):
+        """Rows of the per-track state for tracker_ids, adding rows for new tracks"""
+        new_ids = np.setdiff1d(tracker_ids, self.track_ids)
+        if len(new_ids) > 0:
+            ids = np.concatenate([self.track_ids, new_ids])
+            sides = np.vstack([self.track_sides, np.full((len(new_ids), len(self)), self.UNKNOWN, dtype=np.int8)])
+            last_seen = np.concatenate([self.track_last_seen, np.full(len(new_ids), self.frame_count)])
+            order = np.argsort(ids, kind='stable')
+            self.track_ids, self.track_sides, self.track_last_seen = ids[order], sides[order], last_seen[order]
+        return np.searchsorted(self.track_ids, tracker_ids)
+
+    def _forget_idle_tracks(self):
+        if self.max_idle_frames is None:
+            return
+        keep = self.frame_count - self.track_last_seen <= self.max_idle_frames
+        if not np.all(keep):
+            self.track_ids = self.track_ids[keep]
+            self.track_sides = self.track_sides[keep]
+            self.track_last_seen = self.track_last_seen[keep]
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import time
+
+
+class RollingCounter:
+    """
+    Counts per time bucket over a fixed number of the most recent buckets.
+
+    Buckets live in a ring of `length` slots, a slot is cleared when its bucket comes around again,
+    so memory does not grow with time.
+    """
+
+    def __init__(self, bucket_seconds, length):
+        self.bucket_seconds = bucket_seconds
+        self.length = length
+        self.buckets = [None] * length   # bucket number held by each slot
+        self.counts = [0] * length
+
+    def add(self, timestamp, amount=1):
+        bucket = int(timestamp // self.bucket_seconds)
+        slot = bucket % self.length
+        if self.buckets[slot] != bucket:
+            if self.buckets[slot] is not None and self.buckets[slot] > bucket:
+                # Older than the whole window
+                return
+            self.buckets[slot] = bucket
+            self.counts[slot] = 0
+        self.counts[slot] += amount
+
+    def series(self, now, last=None):
+        """[(bucket start, count), ...] of the last buckets up to now, oldest first"""
+        last = self.length if last is None else min(last, self.length)
+        current = int(now // self.bucket_seconds)
+        series = []
+        for bucket in range(current - last + 1, current + 1):
+            slot = bucket % self.length
+            count = self.counts[slot] if self.buckets[slot] == bucket else 0
+            series.append((bucket * self.bucket_seconds, count))
+        return series
+
+    def total(self, now, last=None):
+        return sum(count for _, count in self.series(now, last))
+
+    def to_dict(self):
+        return {'buckets': self.buckets, 'counts': self.counts}
+
+    def load(self, data):
+        if len(data.get('buckets', [])) == self.length:
+            self.buckets = list(data['buckets'])
+            self.counts = list(data['counts'])
+
+
+class TrafficStats:
+    """
+    Streaming counters of one camera, fed by the tracking and violation events.
+
+    Every metric ('vehicles', 'violations', 'violations:<type>', 'plates_read') has a running total
+    and rolling counters per minute, hour and day, each over a fixed number of buckets. The counters
+    are snapshotted to <snapshot_dir>/<camera>.json every snapshot_interval seconds and loaded again
+    on start, so the dashboard reads them without rescanning storage and they survive restarts.
+    """
+    GRANULARITIES = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+    def __init__(self, camera="cam0", snapshot_dir=None, snapshot_interval=60, minutes=60, hours=48, days=30):
+        self.camera = camera
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self.lengths = {'minute': minutes, 'hour': hours, 'day': days}
+
+        self._lock = threading.Lock()
+        self.totals = {}
+        self.rolling = {}
+        self._last_snapshot = time.time()
+
+        if self.snapshot_path is not None and os.path.exists(self.snapshot_path):
+            self.load()
+
+    @property
+    def snapshot_path(self):
+        if self.snapshot_dir is None:
+            return None
+        return os.path.join(self.snapshot_dir, f"{self.camera}.json")
+
+    def _counters(self, metric):
+        if metric not in self.rolling:
+            self.rolling[metric] = {name: RollingCounter(seconds, self.lengths[name])
+                                    for name, seconds in self.GRANULARITIES.items()}
+            self.totals.setdefault(metric, 0)
+        return self.rolling[metric]
+
+    def add(self, metric, amount=1, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for counter in self._counters(metric).values():
+                counter.add(timestamp, amount)
+            self.totals[metric] += amount
+
+    def record_vehicle(self, timestamp=None):
+        """A vehicle entered the monitored zone"""
+        self.add('vehicles', timestamp=timestamp)
+
+    def record_violation(self, violation_type, plate_read, timestamp=None):
+        """A violation was finalized, plate_read tells whether its license plate was recognized"""
+        self.add('violations', timestamp=timestamp)
+        self.add(f"violations:{violation_type}", timestamp=timestamp)
+        if plate_read:
+            self.add('plates_read', timestamp=timestamp)
+
+    def total(self, metric):
+        with self._lock:
+            return self.totals.get(metric, 0)
+
+    def series(self, metric, granularity='minute', last=None, now=None):
+        """[(bucket start, count), ...] of a metric, oldest first"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if metric not in self.rolling:
+                counter = RollingCounter(self.GRANULARITIES[granularity], self.lengths[granularity])
+            else:
+                counter = self.rolling[metric][granularity]
+            return counter.series(now, last)
+
+    def summary(self, granularity='hour', last=1, now=None):
+        """Totals and the counts of the last buckets of the given granularity"""
+        now = time.time() if now is None else now
+        with self._lock:
+            window = {metric: counters[granularity].total(now, last) for metric, counters in self.rolling.items()}
+            totals = dict(self.totals)
+        violations = window.get('violations', 0)
+        return {
+            'camera': self.camera,
+            'totals': totals,
+            'window': window,
+            'violations_by_type': {metric.split(':', 1)[1]: count for metric, count in window.items()
+                                   if metric.startswith('violations:')},
+            'plate_read_rate': window.get('plates_read', 0) / violations if violations else None,
+        }
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'camera': self.camera,
+                'saved_at': time.time(),
+                'totals': dict(self.totals),
+                'rolling': {metric: {name: counter.to_dict() for name, counter in counters.items()}
+                            for metric, counters in self.rolling.items()},
+            }
+
+    def snapshot(self):
+        """Write the counters to snapshot_path (atomically)"""
+        if self.snapshot_path is None:
+            return
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, self.snapshot_path)
+        self._last_snapshot = time.time()
+
+    def maybe_snapshot(self, now=None):
+        now = time.time() if now is None else now
+        if self.snapshot_path is not None and now - self._last_snapshot >= self.snapshot_interval:
+            try:
+                self.snapshot()
+            except OSError as e:
+                print(f"\nFailed to snapshot traffic stats: {e}")
+
+    def load(self):
+        try:
+            with open(self.snapshot_path) as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"\nFailed to load traffic stats from {self.snapshot_path}: {e}")
+            return
+        with self._lock:
+            self.totals = dict(data.get('totals', {}))
+            for metric, counters in data.get('rolling', {}).items():
+                for name, counter in self._counters(metric).items():
+                    counter.load(counters.get(name, {}))
+
+
+def make_traffic_stats(config):
+    """TrafficStats of the configured camera, from the `stats` config section"""
+    stats_cfg = config.get('stats') or {}
+    return TrafficStats(camera=config.get('system', {}).get('camera_id') or "cam0",
+                        snapshot_dir=stats_cfg.get('snapshot_dir'),
+                        snapshot_interval=stats_cfg.get('snapshot_interval', 60),
+                        minutes=stats_cfg.get('minutes', 60),
+                        hours=stats_cfg.get('hours', 48),
+                        days=stats_cfg.get('days', 30))
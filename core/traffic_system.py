@@ -2,8 +2,8 @@ import torch
 import numpy as np
 import supervision as sv
 from collections import deque
-import queue
 import threading
+import time
 from ultralytics import YOLO
 from fast_plate_ocr import LicensePlateRecognizer as FastRecognizer
 import cv2
@@ -14,17 +14,23 @@ from detect.detect import inference_video
 from core.vehicle import Vehicle
 from core.violation import RedLightViolation
 from core.violation_manager import ViolationManager
+from core.evidence_batch import EvidenceQueue
+from core.traffic_stats import make_traffic_stats
+from core.frame_buffer import make_frame_buffer
 from core.license_plate_recognizer import LicensePlateRecognizer
 from core.light_signal_detector import LightSignalDetector
 from core.light_signal_FSM import LightSignalFSM
+from core.light_signal_stage import LightSignalStage
+from core.light_state_provider import ControllerLightProvider
 from utils import (
     load_config,
     violation_save_worker,
     load_zones,
+    build_zone_map,
     render_frame,
     MinioClient
 ) 
-from detect.utils import preprocess_detection_result
+from detect.utils import preprocess_detection_result, filter_detections_in_zone
 
 class TrafficSystem:
     def __init__(self, config_path="config.yaml"):
@@ -45,9 +51,16 @@ class TrafficSystem:
         
         self.tracker_instance = None
         self.violation_manager = None
-        self.polygon_zone = None
-        self.violation_queue = queue.Queue()
+        self.zone_map = None
+        self.prefilter_map = None
+        storage_cfg = self.config.get('storage', {})
+        self.violation_queue = EvidenceQueue(maxsize=storage_cfg.get('queue_size', 0),
+                                             overflow=storage_cfg.get('queue_overflow', 'copy'),
+                                             overflow_size=storage_cfg.get('queue_overflow_size'))
+        # Rolling counters for the dashboard, restored from the last snapshot
+        self.stats = make_traffic_stats(self.config)
         self.worker_thread = None
+        self.light_provider = None
         
         self.running = False
         self.generator = None
@@ -68,7 +81,7 @@ class TrafficSystem:
 
     def start_worker(self):
         if self.worker_thread is None or not self.worker_thread.is_alive():
-            # Start Minio client
+            # Start the storage client (backend selected by storage.backend)
             _ = MinioClient()
             self.worker_thread = threading.Thread(target=violation_save_worker, args=(self.violation_queue,), daemon=True)
             self.worker_thread.start()
@@ -122,13 +135,21 @@ class TrafficSystem:
     def stop(self):
         self.running = False
         self.generator = None
+        self.stats.snapshot()
+        if self.light_provider is not None:
+            self.light_provider.stop()
+            self.light_provider = None
 
     def filter_vehicles_in_zone(self, tracked_objs, all_tracked_objs, sv_detections, frame_counter=0, buffer_maxlen=5):
-        # Trigger zones
-        in_zone_mask = self.polygon_zone.trigger(detections=sv_detections)
+        # One label map lookup for all anchors
+        in_zone_mask = self.zone_map.contains(sv_detections, "polygon")
+        if sv_detections.tracker_id is not None:
+            entered_mask = np.isin([obj.id for obj in all_tracked_objs], sv_detections.tracker_id[in_zone_mask])
+        else:
+            entered_mask = np.zeros(len(all_tracked_objs), dtype=bool)
 
-        for obj in all_tracked_objs:
-            if obj.is_being_tracked == False and sv_detections.tracker_id is not None and obj.id in sv_detections.tracker_id[in_zone_mask]:
+        for obj, entered in zip(all_tracked_objs, entered_mask):
+            if entered:
                 obj.is_being_tracked = True
             if obj.bboxes_buffer is not None:
                 obj.bboxes_buffer.append((frame_counter, obj.get_state()[0]))
@@ -162,7 +183,6 @@ class TrafficSystem:
         detector.straight_light_zones = []
         detector.left_light_zones = []
         detector.right_light_zones = []
-        detector.zone_masks = {'straight': [], 'left': [], 'right': []}
         
         # Load zones from config (points are stored as [top_left, bottom_right] pairs)
         for direction in ['straight', 'left', 'right']:
@@ -182,7 +202,7 @@ class TrafficSystem:
                     ]
                     zone_list.append(polygon)
         
-        # Build masks
+        # Build zone label map
         detector.build_zone_mask(h, w)
         
         return detector
@@ -213,119 +233,164 @@ class TrafficSystem:
         first_run = True
         FPS = 30
         frame_buffer = None
-        
-        for result in dets:
-            if not self.running:
-                break
+        light_provider = None
+
+        try:
+            for result in dets:
+                if not self.running:
+                    break
                 
-            if first_run:
-                self.first_frame = result.orig_img
-                FPS = self.config['violation']['fps'] if self.config['violation']['fps'] is not None else 30
+                if first_run:
+                    self.first_frame = result.orig_img
+                    FPS = self.config['violation']['fps'] if self.config['violation']['fps'] is not None else 30
                 
-                # Load zones 
-                zones = load_zones()
-                polygon_points = zones.get("polygon", [])
-                lines_config = zones.get("lines_config", {}) # Expecting a dict of categories now
-                # Backward compatibility or fallback if 'lines' exists as a flat list
-                if "lines" in zones and not lines_config:
-                     # Default to violation_lines
-                     lines_config["violation_lines"] = zones["lines"]
+                    # Load zones 
+                    zones = load_zones()
+                    polygon_points = zones.get("polygon", [])
+                    lines_config = zones.get("lines_config", {}) # Expecting a dict of categories now
+                    # Backward compatibility or fallback if 'lines' exists as a flat list
+                    if "lines" in zones and not lines_config:
+                         # Default to violation_lines
+                         lines_config["violation_lines"] = zones["lines"]
                 
-                # Default polygon if none
-                if len(polygon_points) < 3:
-                     # Fallback to full frame or center?
-                     # Let's just default to a small box if missing
-                     h, w = self.first_frame.shape[:2]
-                     polygon_points = [[w//4, h//4], [w*3//4, h//4], [w*3//4, h*3//4], [w//4, h*3//4]]
+                    # Default polygon if none
+                    if len(polygon_points) < 3:
+                         # Fallback to full frame or center?
+                         # Let's just default to a small box if missing
+                         h, w = self.first_frame.shape[:2]
+                         polygon_points = [[w//4, h//4], [w*3//4, h//4], [w*3//4, h*3//4], [w//4, h*3//4]]
 
-                polygon_points = np.array(polygon_points, dtype=int)
-                self.polygon_zone = sv.PolygonZone(polygon_points, triggering_anchors=[sv.Position.CENTER])
+                    polygon_points = np.array(polygon_points, dtype=int)
+                    zones_cfg = self.config.get('zones', {})
+                    self.zone_map = build_zone_map({"polygon": polygon_points}, scale=zones_cfg.get('raster_scale', 1.0))
+                    # Optional pre-tracker filter: the polygon grown by a margin so tracks form before vehicles enter.
+                    # Reset first, a previous run with a margin must not leave its map behind
+                    self.prefilter_map = None
+                    if zones_cfg.get('prefilter_margin') is not None:
+                        self.prefilter_map = build_zone_map({"polygon": polygon_points}, scale=zones_cfg.get('raster_scale', 1.0),
+                                                            margin=zones_cfg['prefilter_margin'])
                 
-                # Frame buffer
-                buffer_duration = self.config['violation']['video_proof_duration']
-                buffer_maxlen = int(FPS * buffer_duration)
-                frame_buffer = deque(maxlen=buffer_maxlen)
+                    # Frame buffer
+                    buffer_duration = self.config['violation']['video_proof_duration']
+                    buffer_maxlen = int(FPS * buffer_duration)
+                    postroll_frames = int(FPS * self.config['violation'].get('postroll_duration', 0))
+                    frame_buffer = make_frame_buffer(buffer_maxlen, self.config['violation'])
                 
-                # Initialize Violation Manager
-                violations = [RedLightViolation(polygon_points=polygon_points, lines=lines_config, frame=self.first_frame, window_name="Traffic Violation")]
-                licensePlate_recognizer = LicensePlateRecognizer(license_model=self.license_model, character_model=self.character_model)
-                self.violation_manager = ViolationManager(violations=violations, recognizer=licensePlate_recognizer)
+                    # Initialize Violation Manager
+                    violations = [RedLightViolation(polygon_points=polygon_points, lines=lines_config, frame=self.first_frame, window_name="Traffic Violation", zone_map=self.zone_map)]
+                    licensePlate_recognizer = LicensePlateRecognizer(license_model=self.license_model, character_model=self.character_model)
+                    self.violation_manager = ViolationManager(violations=violations, recognizer=licensePlate_recognizer, stats=self.stats)
                 
-                # Initialize Light Signal Detector from saved zones
-                light_zones_config = zones.get("light_zones", {})
-                h, w = self.first_frame.shape[:2]
-                light_detector = self._init_light_detector(h, w, light_zones_config)
-                light_fsm = None
-                if light_detector is not None:
-                    initial_light_list = light_detector.detect_light_signals(self.first_frame)
-                    processed_initial_lights = []
-                    for light in initial_light_list:
-                        if light is None:
-                            processed_initial_lights.append(light)
-                        else:
-                            processed_initial_lights.append(light[0])  # Extract only the state
-                    light_fsm = LightSignalFSM(initial_states=processed_initial_lights)
+                    # Light states come from the traffic controller feed if configured,
+                    # otherwise from the Light Signal Detector initialized from saved zones
+                    light_cfg = self.config.get('light_signal', {})
+                    if self.light_provider is not None:
+                        # Left by a run that was not stopped, it may still hold the feed's socket
+                        self.light_provider.stop()
+                        self.light_provider = None
+                    light_provider = None
+                    light_detector = None
+                    if light_cfg.get('feed'):
+                        light_provider = ControllerLightProvider(source=light_cfg['feed'],
+                                                                 clock_offset=light_cfg.get('clock_offset', 0.0),
+                                                                 stale_after=light_cfg.get('stale_after', 5.0)).start()
+                        self.light_provider = light_provider
+                    else:
+                        light_zones_config = zones.get("light_zones", {})
+                        h, w = self.first_frame.shape[:2]
+                        light_detector = self._init_light_detector(h, w, light_zones_config)
+                    if light_detector is not None:
+                        initial_light_list = light_detector.detect_light_signals(self.first_frame)
+                        processed_initial_lights = []
+                        for light in initial_light_list:
+                            if light is None:
+                                processed_initial_lights.append(light)
+                            else:
+                                processed_initial_lights.append(light[0])  # Extract only the state
+                        light_fsm = LightSignalFSM(initial_states=processed_initial_lights,
+                                                  cycle_model=light_cfg.get('cycle_model', False),
+                                                  sample_window=light_cfg.get('sample_window', 2.0),
+                                                  idle_interval=light_cfg.get('idle_interval', 2.0))
+
+                        # Light detection runs in its own thread on a time-based cadence
+                        light_provider = LightSignalStage(light_detector, light_fsm,
+                                                       interval=light_cfg.get('interval', 0.2),
+                                                       history=light_cfg.get('history', 32)).start()
+                        self.light_provider = light_provider
                 
-                frame_counter = 0
-                first_run = False
+                    frame_counter = 0
+                    first_run = False
             
-            # Preprocess
-            frame, det = preprocess_detection_result(result)
-            frame_counter += 1
+                # Preprocess
+                frame, det = preprocess_detection_result(result)
+                frame_counter += 1
+                frame_time = time.time()
             
-            # Tracking
-            tracked_objs = self.tracker_instance.update(dets=det)
-            all_tracked_objs = self.tracker_instance.get_tracked_objects()
+                # Drop detections far outside the monitored area before association
+                det = filter_detections_in_zone(det, self.prefilter_map)
+
+                # Tracking
+                tracked_objs = self.tracker_instance.update(dets=det)
+                all_tracked_objs = self.tracker_instance.get_tracked_objects()
             
-            states = [obj.get_state()[0] for obj in tracked_objs]
-            ids = [obj.id for obj in tracked_objs] 
-            cls_ids = [obj.class_id for obj in tracked_objs]
+                states = [obj.get_state()[0] for obj in tracked_objs]
+                ids = [obj.id for obj in tracked_objs] 
+                cls_ids = [obj.class_id for obj in tracked_objs]
             
-            if len(states) == 0:
-                sv_detections = sv.Detections.empty()
-            else:
-                xyxy = np.array(states)
-                tracker_ids = np.array(ids)
-                tracker_cls_ids = np.array(cls_ids)
-                sv_detections = sv.Detections(
-                    xyxy=xyxy,
-                    tracker_id=tracker_ids,
-                    class_id=tracker_cls_ids
-                )
+                if len(states) == 0:
+                    sv_detections = sv.Detections.empty()
+                else:
+                    xyxy = np.array(states)
+                    tracker_ids = np.array(ids)
+                    tracker_cls_ids = np.array(cls_ids)
+                    sv_detections = sv.Detections(
+                        xyxy=xyxy,
+                        tracker_id=tracker_ids,
+                        class_id=tracker_cls_ids
+                    )
             
-            visualized_tracked_objs, visualized_sv_detections = self.filter_vehicles_in_zone(tracked_objs, all_tracked_objs, sv_detections, frame_counter, buffer_maxlen)
+                visualized_tracked_objs, visualized_sv_detections = self.filter_vehicles_in_zone(tracked_objs, all_tracked_objs, sv_detections, frame_counter, buffer_maxlen)
 
-            # Update frame buffer
-            frame_buffer.append((frame_counter, frame.copy()))
+                # Update frame buffer
+                frame_buffer.append((frame_counter, frame))
             
-            # Detect traffic light states
-            if light_detector is not None and light_fsm is not None:
-                # Detect every 10 frames to improve FPS
-                if frame_counter % 10 == 0:
-                    detected_lights = light_detector.detect_light_signals(frame)
-                    traffic_light_states = light_fsm.update(candidates=detected_lights, frame_idx=frame_counter)
+                # Traffic light states (vision detection + FSM run in the light stage worker)
+                if light_provider is not None:
+                    light_provider.submit(frame, frame_counter, timestamp=frame_time)
+                    traffic_light_states = None
                 else:
-                    traffic_light_states = light_fsm.get_states()
-            else:
-                # Fallback to hardcoded values if no light zones configured
-                traffic_light_states = [None, 'RED', None]
+                    # Fallback to hardcoded values if no light zones configured
+                    traffic_light_states = [None, 'RED', None]
             
-            # Violation Update
-            stats = self.violation_manager.update(
-                vehicles=visualized_tracked_objs, 
-                sv_detections=visualized_sv_detections, 
-                frame=frame, 
-                traffic_light_state=traffic_light_states, 
-                frame_buffer=frame_buffer, 
-                fps=FPS, 
-                save_queue=self.violation_queue
-            )
+                # Violation Update
+                stats = self.violation_manager.update(
+                    vehicles=visualized_tracked_objs, 
+                    sv_detections=visualized_sv_detections, 
+                    frame=frame, 
+                    traffic_light_state=traffic_light_states, 
+                    frame_buffer=frame_buffer, 
+                    fps=FPS, 
+                    save_queue=self.violation_queue,
+                    light_provider=light_provider,
+                    frame_idx=frame_counter,
+                    frame_time=frame_time,
+                    postroll=postroll_frames,
+                    detections=det,
+                    active_ids=[obj.id for obj in all_tracked_objs]
+                )
             
-            # Draw
-            annotated_frame = render_frame(visualized_tracked_objs, frame, visualized_sv_detections, self.box_annotator, self.label_annotator)
-            annotated_frame = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
+                # Draw
+                annotated_frame = render_frame(visualized_tracked_objs, frame, visualized_sv_detections, self.box_annotator, self.label_annotator)
+                annotated_frame = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
             
-            yield annotated_frame, stats
+                yield annotated_frame, stats
+        finally:
+            # The stream may end on its own, without stop(): free the light feed and save the counters
+            if light_provider is not None:
+                light_provider.stop()
+                if self.light_provider is light_provider:
+                    self.light_provider = None
+            self.stats.snapshot()
 
     def get_latest_frame(self):
         if self.generator:
@@ -1,5 +1,7 @@
 from track.kalman_box_tracker import KalmanBoxTracker
 import time
+import numpy as np
+from core.evidence_batch import submit_job
 from utils import MinioClient, load_config
 
 # Load config once
@@ -12,9 +14,13 @@ class Vehicle(KalmanBoxTracker):
         self.class_id = int(class_id)
 
         self.is_being_tracked = False
+        self.counted = False                 # counted in the traffic stats throughput
         self.has_violated = False
         self.going_straight = True
-        self.frame_of_violation = None
+        self.frame_of_violation = None       # private copy, only when no retention buffer is available
+        self.violation_frame_idx = None      # index of the violation frame pinned in violation_frame_store
+        self.violation_frame_store = None
+        self.violation_detections = None     # every detection of the violation frame, for the retraining labels
         self.state_when_violation = None
         self.bboxes_buffer = []
         self.violation_type = []
@@ -41,8 +47,35 @@ class Vehicle(KalmanBoxTracker):
         return self.license_plate
     
 
+    @property
+    def plate_read(self):
+        """Whether the plate reader produced an identifier, confirmed by enough votes or not (else UNIDENTIFIED)"""
+        return self.license_plate is not None or bool(self.lp_votes)
+
+    def set_violation_frame(self, frame, frame_idx=None, frame_buffer=None, detections=None):
+        """
+        Remember the frame of the violation as a pinned index into frame_buffer (a private copy if that is not possible),
+        with its detections ([[x1, y1, x2, y2, score, class_id], ...]) if given
+        """
+        self.release_violation_frame()
+        self.violation_detections = None if detections is None else np.array(detections, dtype=float).reshape(-1, 6)
+        if frame_idx is not None and hasattr(frame_buffer, 'pin') and frame_buffer.pin(frame_idx):
+            self.violation_frame_idx = frame_idx
+            self.violation_frame_store = frame_buffer
+        else:
+            self.frame_of_violation = frame.copy()
+
+    def release_violation_frame(self):
+        """Forget the frame of the violation"""
+        if self.violation_frame_store is not None:
+            self.violation_frame_store.release(self.violation_frame_idx)
+        self.violation_frame_idx = None
+        self.violation_frame_store = None
+        self.frame_of_violation = None
+        self.violation_detections = None
+
     def mark_violation(self, violation_type, frame=None, padding=None,
-                       frame_buffer=None, bboxes_buffer=None, fps=30, state=None, save_queue=None):
+                       frame_buffer=None, bboxes_buffer=None, fps=30, state=None, save_queue=None, frame_idx=None, postroll=0):
 
         if padding is None:
             padding = config['violation']['padding']            
@@ -63,23 +96,64 @@ class Vehicle(KalmanBoxTracker):
             self.violation_type.append(violation_type)
             self.violation_time.append(time.time())
 
-            if frame is not None:
+            # The violation frame may be pinned in the shared buffer instead of passed in
+            frame_store = None
+            frame_shape = None if frame is None else frame.shape
+            if frame is None and frame_idx is not None and frame_buffer is not None and hasattr(frame_buffer, 'get'):
+                if getattr(frame_buffer, 'decodes_on_get', False):
+                    # Encoded buffer: the save worker decodes the frame and cuts the proof crop
+                    if frame_buffer.holds(frame_idx):
+                        frame_store = frame_buffer
+                        frame_shape = frame_buffer.frame_shape
+                else:
+                    frame = frame_buffer.get(frame_idx)
+                    if frame is not None:
+                        frame_store = frame_buffer
+                        frame_shape = frame.shape
+
+            if frame_shape is not None:
                 x1, y1, x2, y2 = map(int, state)
-                h, w, _ = frame.shape
+                h, w = frame_shape[:2]
 
-                self.proof = frame[max(0, y1 - padding):min(h, y2 + padding),
-                                   max(0, x1 - padding):min(w, x2 + padding)].copy()
+                crop_box = (max(0, x1 - padding), max(0, y1 - padding), min(w, x2 + padding), min(h, y2 + padding))
+                self.proof = None if frame is None else frame[crop_box[1]:crop_box[3], crop_box[0]:crop_box[2]].copy()
 
                 violation_data = {
                     'vehicle_id': self.id,
                     'identifier': final_lp,
                     'violation_type': violation_type,
-                    'frame': frame.copy(),
+                    'timestamp': self.violation_time[-1],
+                    # A pinned frame is looked up by the save worker, which then releases the pin.
+                    # Otherwise the frame is handed over as is, it must not be modified afterwards
+                    'frame': None if frame_store is not None else frame,
+                    'frame_idx': frame_idx if frame_store is not None else None,
+                    'frame_store': frame_store,
                     'bbox': (x1, y1, x2, y2),
+                    'crop_box': crop_box,  # region of proof_crop in the frame
                     'bboxes': bboxes_buffer,
-                    'frame_buffer': list(frame_buffer) if frame_buffer else [],
+                    'frame_buffer': [],
+                    'window': None,  # indices of the pre-roll frames pinned in frame_store
                     'fps': fps,
-                    'proof_crop': self.proof
+                    'proof_crop': self.proof,  # None: cut from the frame by the save worker
+                    # What the retraining sampler looks at (see utils.retraining_sampler)
+                    'class_id': self.class_id,
+                    'score': self.score,
+                    'low_conf_hits': self.low_conf_hits,
+                    'plate_read': self.plate_read,
+                    'detections': self.violation_detections,
                 }
                 if save_queue is not None:
-                    save_queue.put(violation_data)
+                    if frame_store is not None:
+                        frame_store.pin(frame_idx)  # held by the save job until it is done
+                    if hasattr(frame_buffer, 'pin_window'):
+                        # Zero-copy pre-roll: the job reserves the slots instead of snapshotting frames
+                        violation_data['frame_store'] = frame_buffer
+                        violation_data['window'] = frame_buffer.pin_window()
+                        if postroll > 0 and frame_buffer.latest_idx is not None:
+                            # Post-roll frames are pinned as they arrive, the save job waits for them
+                            violation_data['window'] += frame_buffer.reserve(frame_buffer.latest_idx + 1, frame_buffer.latest_idx + postroll)
+                    elif frame_buffer:
+                        violation_data['frame_buffer'] = list(frame_buffer)
+                    submit_job(save_queue, violation_data)
+
+            self.release_violation_frame()
@@ -2,14 +2,17 @@ import supervision as sv
 import numpy as np
 from core.vehicle import Vehicle
 from typing import List
-from utils import draw_line_zone
+from utils import draw_line_zone, build_zone_map
+from core.line_crossing import LineCrossingEngine
+from core.evidence_batch import EvidenceBatch
 
 class Violation:
     """Base class of all type of traffic violations
     """
     def __init__(self, name: str, polygon_points: list, **kwargs):
         self.name = name
-        self.polygon_zone = sv.PolygonZone(polygon=polygon_points, triggering_anchors=[sv.Position.CENTER])
+        # Rasterized polygon, shared with the caller when it already compiled the same zones
+        self.zone_map = kwargs.get('zone_map') or build_zone_map({"polygon": polygon_points})
 
     def check_violation(self, vehicles: List[Vehicle]):
         """Check violation of vehicles
@@ -22,20 +25,20 @@ class Violation:
 
 class RedLightViolation(Violation):
     """Red light violation"""
+    LINE_CATEGORIES = ("violation_lines", "special_violation_lines", "left_exception_lines",
+                       "right_exception_lines", "other_exception_lines")
+
     def __init__(self, polygon_points, **kwargs):
-        super().__init__(name="RedLightViolation", polygon_points=polygon_points)
-        self.violation_lines = [] # vehicles crossing these lines will be marked as violated no matter what the traffic light state is
-        # used for special cases like no U-turn allowed no matter what the traffic light state is
-        # vehicles crossing these lines will be marked as violated no matter what the traffic light state is
-        self.special_violation_lines = [] 
-
-        # violated vehicles crossing exception lines will be marked as not violated
-        # Vehicles are only exempted from violation if they cross these lines when the corresponding traffic light is NOT red
-        # If your case requires no left turn whatever the traffic light state is, you can use this with left_light = 'RED' always
-        # But better just use special_violation_lines for that case
-        self.left_exception_lines = [] # for checking left turn exception
-        self.right_exception_lines = [] # for checking right turn exception
-        self.other_exception_lines = [] # for checking other exceptions (e.g., U-turn)
+        super().__init__(name="RedLightViolation", polygon_points=polygon_points, zone_map=kwargs.get('zone_map'))
+        # All rule lines live in one crossing engine, tagged by category:
+        # - violation_lines: vehicles crossing these lines are violated if the straight light is RED
+        # - special_violation_lines: used for special cases like no U-turn allowed,
+        #   vehicles crossing these lines will be marked as violated no matter what the traffic light state is
+        # - left/right/other_exception_lines: violated vehicles crossing exception lines will be marked as not violated.
+        #   Vehicles are only exempted from violation if they cross these lines when the corresponding traffic light is NOT red.
+        #   If your case requires no left turn whatever the traffic light state is, you can use this with left_light = 'RED' always
+        #   But better just use special_violation_lines for that case. other_exception_lines is for other exceptions (e.g., U-turn)
+        self.line_crossing = LineCrossingEngine(categories=self.LINE_CATEGORIES)
         
         if kwargs.get('lines', None):
             self.load_lines_from_config(kwargs.get('lines', None))
@@ -55,6 +58,10 @@ class RedLightViolation(Violation):
             vehicles (List[Vehicle]): List of vehicles to check
             sv_detections (sv.Detections): The detection results in supervision format
             traffic_light_state (list): State of the traffic 3 lights (if exist): turn left, go straight and turn right ("RED", "GREEN", "YELLOW")
+            light_provider (LightStateProvider, optional): if given, the light states it reports for the current frame are used instead of traffic_light_state
+            frame_idx (int, optional): index of the current frame
+            frame_time (float, optional): capture timestamp of the current frame
+            postroll (int, optional): frames recorded after a vehicle leaves the zone, appended to its video proof
         """
         # This assumes Vietnam traffic light system with 3 lights: left turn, straight, right turn and turning laws.
         # If turning right is always allowed, always set right_Light to 'GREEN'. 
@@ -62,6 +69,10 @@ class RedLightViolation(Violation):
         # If a vehicle can only turn right when the straight light is green because there is no right turn light, set right_Light = straight_Light.
         # If no light state for turning left is provided, left_Light will be set to the state of straight_Light.
         # This code now does not handle different vehicle types. So roads that allow some vehicle types to turn when the light is red are not supported.
+        light_provider = kwargs.get("light_provider")
+        if light_provider is not None:
+            traffic_light_state = light_provider.get_states(frame_idx=kwargs.get("frame_idx"), timestamp=kwargs.get("frame_time"))
+
         left_light, straight_light, right_light = traffic_light_state
         if left_light is None:
             left_light = straight_light
@@ -78,45 +89,43 @@ class RedLightViolation(Violation):
         other_exception_mask = np.zeros(n, dtype=bool)
         turning_blocked_mask = np.zeros(n, dtype=bool)
 
+        # One vectorized crossing test of all vehicles against all lines
+        crossings = self.line_crossing.trigger(sv_detections)
+
         # check violation lines crossing
-        for line in self.violation_lines:
-            crossed_in, _ = line.trigger(detections=sv_detections)
-            violated_mask |= crossed_in
+        violated_mask |= crossings["violation_lines"][0]
 
         # check special violation lines crossing
-        for line in self.special_violation_lines:
-            crossed_in, _ = line.trigger(detections=sv_detections)
-            special_violated_mask |= crossed_in
+        special_violated_mask |= crossings["special_violation_lines"][0]
 
         # left turn exception lines
-        for line in self.left_exception_lines:
-            crossed_in, _ = line.trigger(detections=sv_detections)
-            if left_light == 'RED':
-                turning_blocked_mask |= crossed_in # left turn is blocked
-            else:
-                left_exception_mask |= crossed_in # allow left turn
+        if left_light == 'RED':
+            turning_blocked_mask |= crossings["left_exception_lines"][0] # left turn is blocked
+        else:
+            left_exception_mask |= crossings["left_exception_lines"][0] # allow left turn
 
         # right turn exception lines
-        for line in self.right_exception_lines:
-            crossed_in, _ = line.trigger(detections=sv_detections)
-            if right_light == 'RED':
-                turning_blocked_mask |= crossed_in # right turn is blocked
-            else:
-                right_exception_mask |= crossed_in # allow right turn
+        if right_light == 'RED':
+            turning_blocked_mask |= crossings["right_exception_lines"][0] # right turn is blocked
+        else:
+            right_exception_mask |= crossings["right_exception_lines"][0] # allow right turn
 
         # other exception lines (always allowed), like U-turn. If U-turn is not allowed, don't add exception lines for U-turn
-        for line in self.other_exception_lines:
-            crossed_in, _ = line.trigger(detections=sv_detections)
-            other_exception_mask |= crossed_in
+        other_exception_mask |= crossings["other_exception_lines"][0]
 
         exception_mask = left_exception_mask | right_exception_mask | other_exception_mask
 
         # detect vehicles leaving the polygon zone
-        outside_polygon_mask = ~self.polygon_zone.trigger(detections=sv_detections)
+        outside_polygon_mask = ~self.zone_map.contains(sv_detections, "polygon")
 
         save_queue = kwargs.get("save_queue")
         frame_buffer = kwargs.get("frame_buffer")
+        frame_idx = kwargs.get("frame_idx")
         fps = kwargs.get("fps", 30)
+        postroll = kwargs.get("postroll", 0)
+        detections = kwargs.get("detections")
+        # Vehicles finalized in this frame share one evidence job
+        evidence_batch = EvidenceBatch() if save_queue is not None else None
         
         violated_vehicles = []
 
@@ -126,14 +135,14 @@ class RedLightViolation(Violation):
             if violated_mask[i] and straight_light == 'RED':
                 vehicle.has_violated = True
                 vehicle.straight_light_signal_when_crossing = straight_light
-                vehicle.frame_of_violation = frame.copy()
+                vehicle.set_violation_frame(frame, frame_idx, frame_buffer, detections)
                 vehicle.state_when_violation = vehicle.get_state()[0]
 
             # Special violations (e.g., no U-turn) are always violations regardless of light
             if special_violated_mask[i]:
                 vehicle.has_violated = True
                 vehicle.going_straight = False
-                vehicle.frame_of_violation = frame.copy()
+                vehicle.set_violation_frame(frame, frame_idx, frame_buffer, detections)
                 vehicle.state_when_violation = vehicle.get_state()[0]
 
             # Allow exceptions: clear violation if crossing exception lines (legal turn)
@@ -141,13 +150,13 @@ class RedLightViolation(Violation):
             if exception_mask[i] and vehicle.has_violated:
                 vehicle.has_violated = False
                 vehicle.going_straight = False
-                vehicle.frame_of_violation = None
+                vehicle.release_violation_frame()
                 vehicle.state_when_violation = None
             
             # Mark as turning (but still violated) if crossing blocked turn lines
             if turning_blocked_mask[i] and vehicle.has_violated:
                 vehicle.going_straight = False
-                vehicle.frame_of_violation = frame.copy()
+                vehicle.set_violation_frame(frame, frame_idx, frame_buffer, detections)
                 vehicle.state_when_violation = vehicle.get_state()[0]
 
             # Finalize violation when leaving the polygon zone
@@ -155,12 +164,17 @@ class RedLightViolation(Violation):
                 # Determine violation type based on whether vehicle was going straight or turning
                 if vehicle.going_straight:
                     vehicle.mark_violation("Red Light", frame=vehicle.frame_of_violation, frame_buffer=frame_buffer, 
-                                           bboxes_buffer=vehicle.bboxes_buffer, fps=fps, state=vehicle.state_when_violation, save_queue=save_queue)
+                                           bboxes_buffer=vehicle.bboxes_buffer, fps=fps, state=vehicle.state_when_violation, save_queue=evidence_batch,
+                                           frame_idx=vehicle.violation_frame_idx, postroll=postroll)
                 else:
                     vehicle.mark_violation("Red Light - Turning", frame=vehicle.frame_of_violation,
-                                           frame_buffer=frame_buffer, bboxes_buffer=vehicle.bboxes_buffer, state=vehicle.state_when_violation, fps=fps, save_queue=save_queue)
+                                           frame_buffer=frame_buffer, bboxes_buffer=vehicle.bboxes_buffer, state=vehicle.state_when_violation, fps=fps, save_queue=evidence_batch,
+                                           frame_idx=vehicle.violation_frame_idx, postroll=postroll)
                 violated_vehicles.append(vehicle)
 
+        if evidence_batch:
+            evidence_batch.flush(save_queue)
+
         return violated_vehicles
 
     def load_lines_from_config(self, lines_config):
@@ -173,8 +187,7 @@ class RedLightViolation(Violation):
             ("other_exception_lines", "other_exception_lines")
         ]
         
-        for attr_name, key in categories:
-            target_list = getattr(self, attr_name)
+        for category, key in categories:
             points_list = lines_config.get(key, [])
             
             # Expecting points_list to be list of point pairs or list of points that form lines?
@@ -184,9 +197,7 @@ class RedLightViolation(Violation):
             
             for i in range(0, len(points_list), 2):
                 if i + 1 < len(points_list):
-                    start = sv.Point(x=points_list[i][0], y=points_list[i][1])
-                    end = sv.Point(x=points_list[i+1][0], y=points_list[i+1][1])
-                    target_list.append(sv.LineZone(start=start, end=end, triggering_anchors=[sv.Position.CENTER]))
+                    self.line_crossing.add_line(points_list[i], points_list[i+1], category)
 
     def draw_line(self, frame: np.ndarray, window_name="Traffic Violation Detection"):
         """Draw the violation line on the frame
@@ -194,7 +205,7 @@ class RedLightViolation(Violation):
         Args:
             frame (np.ndarray): Frame to draw the line on
         """
-        # Define categories to draw: (attribute_name, zone_display_name)
+        # Define categories to draw: (category, zone_display_name)
         categories = [
             ("violation_lines", "Violation Lines"),
             ("special_violation_lines", "Special Violation Lines"),
@@ -203,15 +214,10 @@ class RedLightViolation(Violation):
             ("other_exception_lines", "Other Exception Lines")
         ]
 
-        for attr_name, zone_name in categories:
+        for category, zone_name in categories:
             # Draw lines for the current category
             points = draw_line_zone(frame, zone_name=zone_name, window_name=window_name)
             
-            # Get the target list from the instance
-            target_list = getattr(self, attr_name)
-            
-            # Convert points to sv.LineZone and append to the list
+            # Add the point pairs as lines of this category
             for i in range(0, len(points), 2):
-                start = sv.Point(x=points[i][0], y=points[i][1])
-                end = sv.Point(x=points[i+1][0], y=points[i+1][1])
-                target_list.append(sv.LineZone(start=start, end=end, triggering_anchors=[sv.Position.CENTER]))
\ No newline at end of file
+                self.line_crossing.add_line(points[i], points[i+1], category)
\ No newline at end of file
@@ -2,18 +2,24 @@ from typing import List
 from core.violation import Violation
 from core.vehicle import Vehicle
 from core.license_plate_recognizer import LicensePlateRecognizer
+from core.traffic_stats import TrafficStats
 from supervision import Detections
 
 class ViolationManager:
     """
     Manage violation of tracked vehicles
     """
-    def __init__(self, violations: List[Violation], recognizer: LicensePlateRecognizer, lp_detection_interval: int = 5, **kwargs):
-        self.violation_count = {violation.name: 0 for violation in violations}
+    def __init__(self, violations: List[Violation], recognizer: LicensePlateRecognizer, lp_detection_interval: int = 5,
+                 stats: TrafficStats = None, **kwargs):
+        self.stats = stats
+        # Carried over from the last stats snapshot, if any
+        self.violation_count = {violation.name: stats.total(f"violations:{violation.name}") if stats is not None else 0
+                                for violation in violations}
         self.violations = violations
         self.recognizer = recognizer
         self.frame_counter = 0
         self.lp_detection_interval = lp_detection_interval
+        self.pinned_vehicles = {}  # track id -> vehicle holding a pinned violation frame
 
     def update(self, vehicles: List[Vehicle], sv_detections: Detections, frame, traffic_light_state, **kwargs):
         """
@@ -21,20 +27,57 @@ class ViolationManager:
 
         Args:
             vehicles (List[Vehicle]): List of tracked vehicles
+            frame_time (float, optional): capture timestamp of the current frame, for the stats
+            active_ids (list, optional): ids of every track the tracker still holds, the violation frames
+                of the others are released
         """
         self.frame_counter += 1
+        frame_time = kwargs.get('frame_time')
+
+        if self.stats is not None:
+            # Throughput: every vehicle is counted once, when it is first seen in the zone
+            for vehicle in vehicles:
+                if not vehicle.counted:
+                    vehicle.counted = True
+                    self.stats.record_vehicle(frame_time)
 
         # Centralized continuous license plate detection for ALL violated vehicles
         # Only run every N frames to improve performance
         if self.frame_counter % self.lp_detection_interval == 0:
+            active_ids = []
             for vehicle in vehicles:
                 if vehicle.has_violated is True:
                     current_state = vehicle.get_state()[0]
-                    candidate_lp = self.recognizer.update(frame, current_state)
+                    candidate_lp = self.recognizer.update(frame, current_state, track_id=vehicle.id)
                     vehicle.update_license_plate(candidate_lp)
+                    active_ids.append(vehicle.id)
+            # Drop cached plate boxes of vehicles that are no longer violating
+            self.recognizer.prune(active_ids)
 
         # Check all violation types
         for violation in self.violations:
-            self.violation_count[violation.name] += len(violation.check_violation(vehicles, sv_detections, frame, traffic_light_state, **kwargs))
+            violated_vehicles = violation.check_violation(vehicles, sv_detections, frame, traffic_light_state, **kwargs)
+            self.violation_count[violation.name] += len(violated_vehicles)
+            if self.stats is not None:
+                for vehicle in violated_vehicles:
+                    self.stats.record_violation(violation.name, vehicle.plate_read, frame_time)
+
+        # Violation frames of tracks the tracker dropped are released here, not left to the GC
+        for vehicle in vehicles:
+            if vehicle.violation_frame_store is not None:
+                self.pinned_vehicles[vehicle.id] = vehicle
+        if kwargs.get('active_ids') is not None:
+            self.prune(kwargs['active_ids'])
+
+        if self.stats is not None:
+            self.stats.maybe_snapshot()
+
+        return self.violation_count
 
-        return self.violation_count
\ No newline at end of file
+    def prune(self, active_ids):
+        """Release the violation frames of tracks that are no longer active"""
+        active_ids = set(active_ids)
+        for track_id, vehicle in list(self.pinned_vehicles.items()):
+            if track_id not in active_ids or vehicle.violation_frame_store is None:
+                vehicle.release_violation_frame()
+                del self.pinned_vehicles[track_id]
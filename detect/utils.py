@@ -1,6 +1,8 @@
 import os
 import shutil
 import configparser
+import tarfile
+import zlib
 import supervision as sv
 import numpy as np
 
@@ -111,6 +113,45 @@ def generate_data_yaml(output_path, nc=1, names=None):
         f.write(f"names: {names}\n")
 
 
+def extract_retraining_shards(shard_paths, output_path, val_ratio=0.1, names=None):
+    """
+    Unpack retraining shards (tar files of utils.retraining_shards) into the YOLO layout:
+    images/<split>/<name>.jpg and labels/<split>/<name>.txt, plus data.yaml.
+
+    Samples are split by a hash of their name, so a sample stays in the same split across exports.
+    Labels carry the detector class ids, names should be the detector's class names (generic names
+    up to the largest class id seen if None). Returns the number of samples per split.
+    """
+    for split in ("train", "val"):
+        os.makedirs(os.path.join(output_path, "images", split), exist_ok=True)
+        os.makedirs(os.path.join(output_path, "labels", split), exist_ok=True)
+
+    counts = {"train": 0, "val": 0}
+    max_class_id = 0
+    for shard_path in shard_paths:
+        with tarfile.open(shard_path, "r") as tar:
+            for info in tar:
+                folder, _, filename = info.name.partition("/")
+                if not info.isfile() or folder not in ("images", "labels"):
+                    continue
+                stem = os.path.splitext(filename)[0]
+                split = "val" if zlib.crc32(stem.encode()) % 1000 < val_ratio * 1000 else "train"
+                body = tar.extractfile(info).read()
+                with open(os.path.join(output_path, folder, split, filename), "wb") as f:
+                    f.write(body)
+                if folder == "images":
+                    counts[split] += 1
+                else:
+                    for line in body.decode().splitlines():
+                        if line.strip():
+                            max_class_id = max(max_class_id, int(line.split()[0]))
+
+    if names is None:
+        names = [f"class_{i}" for i in range(max_class_id + 1)]
+    generate_data_yaml(output_path, nc=len(names), names=names)
+    return counts
+
+
 def preprocess_detection_result(result):
     """Preprocess the YOLO/Roboflow detection result for tracking algorithm
 
@@ -134,3 +175,19 @@ def preprocess_detection_result(result):
     else:
         det = np.empty((0, 6))
     return frame, det
+
+
+def filter_detections_in_zone(det, zone_map, name=None):
+    """Drop detections whose box center lies outside the zone, before they reach the tracker
+
+    Args:
+        det (ArrayLike): Detections (x1, y1, x2, y2, conf, cls_id)
+        zone_map (ZoneMap): Rasterized zones, usually grown by a margin so tracks can form before vehicles enter
+        name (str, optional): Zone to keep detections in. Any zone if None
+
+    Return:
+        det (ArrayLike): The detections inside the zone
+    """
+    if zone_map is None or len(det) == 0:
+        return det
+    return det[zone_map.contains_boxes(det[:, :4], name)]
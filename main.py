@@ -8,21 +8,25 @@ from utils import (
     parse_args_tracking,
     draw_polygon_zone, render_frame,
     handle_result_filename, violation_save_worker,
-    load_config, MinioClient
+    load_config, MinioClient, build_zone_map
 )
-from detect.utils import preprocess_detection_result
+from detect.utils import preprocess_detection_result, filter_detections_in_zone
 from core.violation import RedLightViolation
 from core.violation_manager import ViolationManager
+from core.evidence_batch import EvidenceQueue
+from core.traffic_stats import make_traffic_stats
+from core.frame_buffer import make_frame_buffer
 from core.license_plate_recognizer import LicensePlateRecognizer
 from core.light_signal_detector import LightSignalDetector
 from core.light_signal_FSM import LightSignalFSM
+from core.light_signal_stage import LightSignalStage
+from core.light_state_provider import ControllerLightProvider
 import cv2
 import numpy as np
 import supervision as sv
 import os
 import csv
 import threading
-import queue
 import time
 from collections import deque
 import line_profiler
@@ -87,7 +91,12 @@ def main():
     # (boto3/S3 connection is established during startup, not during processing)
     _ = MinioClient()
     
-    violation_queue = queue.Queue()
+    # Bounded: under a violation burst evidence is queued with copied frames, then dropped (and counted),
+    # rather than stalling the capture loop
+    storage_cfg = config.get('storage', {})
+    violation_queue = EvidenceQueue(maxsize=storage_cfg.get('queue_size', 0),
+                                    overflow=storage_cfg.get('queue_overflow', 'copy'),
+                                    overflow_size=storage_cfg.get('queue_overflow_size'))
     worker_thread = threading.Thread(target=violation_save_worker,args=(violation_queue,), daemon=True)
     worker_thread.start()
     np.random.seed(42)
@@ -117,6 +126,9 @@ def main():
 
     # First run
     first_run = True
+    # Set up by the first run, the source may have no frames at all
+    light_provider = None
+    stats = None
 
     for i, result in enumerate(dets):
         if first_run:
@@ -126,21 +138,36 @@ def main():
             FPS = config['violation']['fps'] if config['violation']['fps'] is not None else 30
             polygon_points = draw_polygon_zone(first_frame, window_name)
             polygon_points = np.array(polygon_points, dtype=int)
-            polygon_zone = sv.PolygonZone(polygon_points, triggering_anchors=[sv.Position.CENTER]) if len(polygon_points) >= 3 else None
+            zones_cfg = config.get('zones', {})
+            zone_map = build_zone_map({"polygon": polygon_points}, scale=zones_cfg.get('raster_scale', 1.0))
+            # Optional pre-tracker filter: the polygon grown by a margin so tracks form before vehicles enter
+            prefilter_map = None
+            if zones_cfg.get('prefilter_margin') is not None:
+                prefilter_map = build_zone_map({"polygon": polygon_points}, scale=zones_cfg.get('raster_scale', 1.0),
+                                               margin=zones_cfg['prefilter_margin'])
 
             # Frame buffer for video proof
             buffer_duration = config['violation']['video_proof_duration']
             buffer_maxlen = int(FPS * buffer_duration)
-            frame_buffer = deque(maxlen=buffer_maxlen)
+            postroll_frames = int(FPS * config['violation'].get('postroll_duration', 0))
+            frame_buffer = make_frame_buffer(buffer_maxlen, config['violation'])
             frame_counter = 0
 
             # Set up violation manager and violation types
-            violations = [RedLightViolation(polygon_points=polygon_points, frame=first_frame, window_name=window_name)]
+            violations = [RedLightViolation(polygon_points=polygon_points, frame=first_frame, window_name=window_name, zone_map=zone_map)]
             licensePlate_recognizer = LicensePlateRecognizer(license_model=license_model, character_model=character_model)
-            violation_manager = ViolationManager(violations=violations, recognizer=licensePlate_recognizer)
+            stats = make_traffic_stats(config)
+            violation_manager = ViolationManager(violations=violations, recognizer=licensePlate_recognizer, stats=stats)
 
             # set up light signal FSMs
-            if args.light_detect == 'True':
+            light_cfg = config.get('light_signal', {})
+            light_feed = args.light_feed if args.light_feed is not None else light_cfg.get('feed')
+            if light_feed:
+                # Signal phase comes from the traffic controller, vision-based detection is skipped
+                light_provider = ControllerLightProvider(source=light_feed,
+                                                         clock_offset=light_cfg.get('clock_offset', 0.0),
+                                                         stale_after=light_cfg.get('stale_after', 5.0)).start()
+            elif args.light_detect == 'True':
                 light_detector = LightSignalDetector(h=FRAME_HEIGHT, w=FRAME_WIDTH, frame=first_frame, window_name=window_name)
                 initial_light_list = light_detector.detect_light_signals(first_frame)
                 processed_initial_lights = []
@@ -150,12 +177,24 @@ def main():
                     else:
                         processed_initial_lights.append(light[0])  # Extract only the state
 
-                light_fsm = LightSignalFSM(initial_states=processed_initial_lights)
+                light_fsm = LightSignalFSM(initial_states=processed_initial_lights,
+                                          cycle_model=light_cfg.get('cycle_model', False),
+                                          sample_window=light_cfg.get('sample_window', 2.0),
+                                          idle_interval=light_cfg.get('idle_interval', 2.0))
+
+                # Light detection runs in its own thread on a time-based cadence
+                light_provider = LightSignalStage(light_detector, light_fsm,
+                                               interval=light_cfg.get('interval', 0.2),
+                                               history=light_cfg.get('history', 32)).start()
 
             first_run = False
 
         frame, det = preprocess_detection_result(result)
         frame_counter += 1
+        frame_time = time.time()
+
+        # Drop detections far outside the monitored area before association
+        det = filter_detections_in_zone(det, prefilter_map)
 
         # Object tracking
         tracked_objs = tracker_instance.update(dets=det)
@@ -178,10 +217,14 @@ def main():
             )
 
         # Filter vehicles inside polygon zone
-        in_zone_mask = polygon_zone.trigger(detections=sv_detections)
+        in_zone_mask = zone_map.contains(sv_detections, "polygon")
+        if sv_detections.tracker_id is not None:
+            entered_mask = np.isin([obj.id for obj in all_tracked_objs], sv_detections.tracker_id[in_zone_mask])
+        else:
+            entered_mask = np.zeros(len(all_tracked_objs), dtype=bool)
 
-        for obj in all_tracked_objs:
-            if obj.is_being_tracked == False and sv_detections.tracker_id is not None and obj.id in sv_detections.tracker_id[in_zone_mask]:
+        for obj, entered in zip(all_tracked_objs, entered_mask):
+            if entered:
                 obj.is_being_tracked = True
             if obj.bboxes_buffer is not None:
                 obj.bboxes_buffer.append((frame_counter, obj.get_state()[0]))
@@ -194,23 +237,21 @@ def main():
         visualized_sv_detections = sv_detections[visualize_mask]
 
         # Update frame buffer
-        frame_buffer.append((frame_counter, frame.copy()))
-
-        # Update light signal FSMs
-        if args.light_detect == 'True':
-            # to improve FPS, as heavy masking is quite costly (masking every frame drops the FPS to about 13)
-            if frame_counter % 5 == 0:
-                detected_lights = light_detector.detect_light_signals(frame)
-                traffic_light_states = light_fsm.update(candidates=detected_lights, frame_idx=frame_counter)
-            else:
-                traffic_light_states = light_fsm.get_states()
+        frame_buffer.append((frame_counter, frame))
+
+        # Update light state provider (vision detection + FSM run in the stage worker, the loop never waits on it)
+        if light_provider is not None:
+            light_provider.submit(frame, frame_counter, timestamp=frame_time)
+            traffic_light_states = None
         else:
             # This means the tracking is part of a larger system where traffic light states are provided externally
             # For now, we set them to None RED None
             traffic_light_states = [None, 'RED', None]
 
         # Update violation manager
-        violation_manager.update(vehicles=visualized_tracked_objs, sv_detections=visualized_sv_detections, frame=frame, traffic_light_state=traffic_light_states, frame_buffer=frame_buffer, fps=FPS, save_queue=violation_queue)
+        violation_manager.update(vehicles=visualized_tracked_objs, sv_detections=visualized_sv_detections, frame=frame, traffic_light_state=traffic_light_states, frame_buffer=frame_buffer, fps=FPS, save_queue=violation_queue,
+                                 light_provider=light_provider, frame_idx=frame_counter, frame_time=frame_time, postroll=postroll_frames,
+                                 detections=det, active_ids=[obj.id for obj in all_tracked_objs])
         
         frame = render_frame(visualized_tracked_objs, frame, visualized_sv_detections, box_annotator, label_annotator)
         cv2.imshow(window_name, frame)
@@ -229,6 +270,11 @@ def main():
     
     cv2.destroyAllWindows()
 
+    if light_provider is not None:
+        light_provider.stop()
+    if stats is not None:
+        stats.snapshot()
+
     # wait for violation saving queue to be empty
     while violation_queue.qsize() > 0:
         print(
@@ -0,0 +1,94 @@
+"""
+Measure evidence saving throughput against a local S3 stand-in (the MinIO of docker-compose),
+or against the local filesystem backend with no service at all.
+
+    docker compose up -d minio
+    MINIO_ENDPOINT=http://localhost:9000 python scripts/benchmark_uploads.py --jobs 50
+    python scripts/benchmark_uploads.py --jobs 50 --local-root /tmp/evidence
+
+Runs the same synthetic violation jobs through the single-threaded save path and through
+EvidencePipeline with the given pool sizes, and prints jobs/s and MB/s of each.
+"""
+import argparse
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import MinioClient, get_logger
+from utils.spool import EvidenceSpool
+from utils.storage_backends import LocalBackend
+from utils.workers import EvidencePipeline, save_violation_job
+
+
+def make_job(i, width, height, clip_frames, fps):
+    rng = np.random.default_rng(i)
+    frame = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    bbox = (100, 100, 300, 260)
+    record = {
+        'vehicle_id': i,
+        'identifier': f"BENCH{i:04d}",
+        'violation_type': "Benchmark",
+        'frame': frame,
+        'frame_idx': None,
+        'bbox': bbox,
+        'bboxes': [(k, bbox) for k in range(clip_frames)],
+        'proof_crop': frame[70:290, 70:330].copy(),
+    }
+    return {'records': [record], 'frame_buffer': [(k, frame) for k in range(clip_frames)], 'fps': fps}
+
+
+def run_sequential(client, logger, jobs):
+    start = time.perf_counter()
+    for job in jobs:
+        save_violation_job(client, logger, job['records'], job)
+    return time.perf_counter() - start
+
+
+def run_pipeline(client, logger, jobs, args):
+    save_queue = queue.Queue(maxsize=args.queue_size)
+    pipeline = EvidencePipeline(client, save_queue, encode_workers=args.encode_workers,
+                                upload_workers=args.upload_workers, spool=EvidenceSpool(args.spool_dir),
+                                metrics_interval=0, logger=logger)
+    start = time.perf_counter()
+    pipeline.start()
+    for job in jobs:
+        save_queue.put(job)
+    save_queue.put(None)
+    pipeline.join()
+    return time.perf_counter() - start, pipeline.metrics()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evidence upload throughput benchmark")
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--clip-frames", type=int, default=30)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--encode-workers", type=int, default=2)
+    parser.add_argument("--upload-workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=32)
+    parser.add_argument("--spool-dir", default=None, help="Spool directory (default: memory only)")
+    parser.add_argument("--local-root", default=None, help="Benchmark the local filesystem backend under this directory")
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+
+    logger = get_logger("upload_benchmark")
+    client = MinioClient(LocalBackend(args.local_root)) if args.local_root else MinioClient()
+    client.ensure_buckets()
+
+    jobs = [make_job(i, args.width, args.height, args.clip_frames, args.fps) for i in range(args.jobs)]
+
+    if not args.skip_sequential:
+        elapsed = run_sequential(client, logger, jobs)
+        print(f"sequential: {len(jobs) / elapsed:.2f} jobs/s ({elapsed:.1f}s)")
+
+    elapsed, metrics = run_pipeline(client, logger, jobs, args)
+    print(f"pipeline (encode={args.encode_workers}, upload={args.upload_workers}): "
+          f"{len(jobs) / elapsed:.2f} jobs/s, {metrics['bytes_uploaded'] / elapsed / 1e6:.1f} MB/s ({elapsed:.1f}s)")
+    print(metrics)
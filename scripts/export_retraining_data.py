@@ -0,0 +1,44 @@
+"""
+Build a YOLO dataset from the retraining shards in storage.
+
+    python scripts/export_retraining_data.py --output datasets/retraining
+    python detect/train.py --data datasets/retraining/data.yaml ...
+
+Downloads the shards (retraining bucket, shards/ prefix) that are not in --download-dir yet,
+then unpacks all of them into images/ and labels/ with detect.utils.extract_retraining_shards.
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from detect.utils import extract_retraining_shards
+from utils import MinioClient
+
+
+def download_shards(client, prefix, download_dir):
+    os.makedirs(download_dir, exist_ok=True)
+    paths = []
+    for obj in client.backend.list(client.buckets['retraining'], prefix):
+        if not obj['key'].endswith('.tar'):
+            continue
+        path = os.path.join(download_dir, obj['key'].replace('/', '_'))
+        if not os.path.exists(path) or os.path.getsize(path) != obj['size']:
+            client.backend.download(client.buckets['retraining'], obj['key'], path)
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export retraining shards as a YOLO dataset")
+    parser.add_argument("--output", required=True, help="Dataset directory (images/, labels/, data.yaml)")
+    parser.add_argument("--prefix", default="shards/", help="Shard prefix, e.g. shards/cam0/2026")
+    parser.add_argument("--download-dir", default="retraining_shards/downloaded")
+    parser.add_argument("--val-ratio", type=float, default=0.1)
+    parser.add_argument("--names", nargs="+", default=None, help="Detector class names, in class id order")
+    args = parser.parse_args()
+
+    shard_paths = download_shards(MinioClient(), args.prefix, args.download_dir)
+    counts = extract_retraining_shards(shard_paths, os.path.abspath(args.output), args.val_ratio, args.names)
+    print(f"{len(shard_paths)} shards: {counts['train']} train / {counts['val']} val samples in {args.output}")
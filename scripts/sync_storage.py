@@ -0,0 +1,35 @@
+"""
+Copy the evidence an edge node wrote with the local backend to S3/MinIO.
+
+    MINIO_ENDPOINT=http://central:9000 python scripts/sync_storage.py --local-root storage
+
+Objects already in S3 with the same key and size are skipped, so the script can run periodically
+(e.g. from cron) and only uploads what is new.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import MinioClient, load_config
+from utils.storage_backends import LocalBackend, S3Backend, sync_backends
+
+
+if __name__ == "__main__":
+    storage_config = load_config().get('storage') or {}
+    parser = argparse.ArgumentParser(description="Sync the local storage backend to S3")
+    parser.add_argument("--local-root", default=storage_config.get('local_root', 'storage'))
+    parser.add_argument("--prefix", default="")
+    parser.add_argument("--since-hours", type=float, default=None, help="Only objects modified in the last hours")
+    args = parser.parse_args()
+
+    client = MinioClient(LocalBackend(args.local_root))
+    # Endpoint and credentials from the environment, as for the S3 backend
+    target = S3Backend(client.endpoint_url, client.access_key, client.secret_key, storage_config)
+    target.ensure_buckets(client.buckets.values())
+
+    since = time.time() - args.since_hours * 3600 if args.since_hours is not None else None
+    copied = sync_backends(client.backend, target, client.buckets.values(), prefix=args.prefix, since=since)
+    print(f"{copied} objects copied from {args.local_root}")
@@ -7,42 +7,44 @@ import cv2
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils import MinioClient
+from utils import MinioClient, LocalBackend, S3Backend
 
 
-def _check_minio_connection():
-    """Check if MinIO is available"""
+@pytest.fixture(scope="session")
+def minio_client():
+    """Client of a running MinIO (MINIO_ENDPOINT), probed only by the tests that need it"""
+    shared = MinioClient()
+    client = MinioClient(S3Backend(shared.endpoint_url, shared.access_key, shared.secret_key))
     try:
-        client = MinioClient()
-        client.s3.list_buckets()
-        return True
+        client.backend.check()
     except Exception:
-        return False
+        pytest.skip("MinIO is not available - skipping storage tests")
 
+    # Ensure buckets exist for tests (crucial for CI/CD where MinIO is fresh)
+    try:
+        client.ensure_buckets()
+    except Exception as e:
+        print(f"Warning: Could not create buckets: {e}")
 
-# Check connection once at module load
-MINIO_AVAILABLE = _check_minio_connection()
+    return client
 
 
-@pytest.fixture(scope="session")
-def minio_client():
-    if not MINIO_AVAILABLE:
-        pytest.skip("MinIO is not available - skipping storage tests")
-    
-    client = MinioClient()
-    
-    # Ensure buckets exist for tests (crucial for CI/CD where MinIO is fresh)
-    for bucket_name in client.buckets.values():
-        try:
-            client.s3.head_bucket(Bucket=bucket_name)
-        except Exception:
-            try:
-                client.s3.create_bucket(Bucket=bucket_name)
-            except Exception as e:
-                print(f"Warning: Could not create bucket {bucket_name}: {e}")
-                
+@pytest.fixture(params=["local", "s3"])
+def storage_client(request, tmp_path):
+    """The storage tests run on the local backend, and on MinIO when it is available"""
+    if request.param == "s3":
+        return request.getfixturevalue("minio_client")
+    client = MinioClient(LocalBackend(str(tmp_path / "storage")))
+    client.ensure_buckets()
     return client
 
+
+@pytest.fixture(autouse=True)
+def fresh_content_store():
+    # MinioClient is a singleton, forget the frames stored by previous tests
+    MinioClient().content_store.clear()
+
+
 @pytest.fixture
 def dummy_frame():
     frame = np.zeros((480, 640, 3), dtype=np.uint8)
@@ -63,6 +63,9 @@ class TestByteTrackAlgorithm(unittest.TestCase):
         self.assertEqual(len(tracks), 1)
         # The ID should match one of the original IDs (0 or 1)
         self.assertTrue(tracks[0].id in [0, 1])
+        # The rescue is remembered for the retraining sampler
+        self.assertEqual(tracks[0].score, 0.4)
+        self.assertEqual(tracks[0].low_conf_hits, 1)
 
     def test_03_low_conf_noise_filtration(self):
         """
@@ -0,0 +1,190 @@
+import io
+import json
+import queue
+import numpy as np
+from unittest.mock import MagicMock
+from core.evidence_batch import EvidenceBatch, EvidenceQueue
+from core.frame_buffer import FrameRetentionBuffer
+from core.vehicle import Vehicle
+from utils.workers import encode_violation_job, save_violation_job
+from utils import MinioClient
+from utils.storage import ContentStore
+
+
+def _violator(vehicle_id, bbox, buffer, frame_idx):
+    vehicle = Vehicle(bbox, class_id=1)
+    vehicle.id = vehicle_id
+    vehicle.has_violated = True
+    vehicle.set_violation_frame(buffer.get(frame_idx), frame_idx=frame_idx, frame_buffer=buffer)
+    return vehicle
+
+
+def test_violations_of_one_frame_become_one_job():
+    buffer = FrameRetentionBuffer(maxlen=3)
+    for i in range(3):
+        buffer.append((i, np.full((120, 160, 3), i, dtype=np.uint8)))
+
+    batch = EvidenceBatch()
+    for vehicle_id in (1, 2, 3):
+        vehicle = _violator(vehicle_id, [10 * vehicle_id, 10, 10 * vehicle_id + 20, 40], buffer, 1)
+        vehicle.mark_violation("Red Light", frame_buffer=buffer, state=vehicle.get_state()[0], save_queue=batch,
+                               frame_idx=vehicle.violation_frame_idx, padding=0)
+    assert len(batch) == 3
+
+    save_queue = queue.Queue()
+    assert batch.flush(save_queue) == 1
+    job = save_queue.get_nowait()
+    assert save_queue.empty()
+
+    assert [record['vehicle_id'] for record in job['records']] == [1, 2, 3]
+    assert job['window'] == [0, 1, 2]
+    # The window is pinned once for the job, the violation frame once per record
+    assert buffer.pinned_count(0) == 1
+    assert buffer.pinned_count(1) == 4
+
+
+def test_job_encodes_shared_frame_and_clip_once():
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    records = [
+        {'vehicle_id': i, 'identifier': f"PLATE{i}", 'violation_type': "Red Light", 'frame': frame, 'frame_idx': None,
+         'bbox': (10 * i, 10, 10 * i + 20, 40), 'bboxes': [(0, (10 * i, 10, 10 * i + 20, 40))], 'proof_crop': frame[:10, :10]}
+        for i in (1, 2)
+    ]
+    client = MagicMock()
+    client.labeled_proofs = 'rendered'
+    client.content_store = ContentStore()
+    client.encode_proof.return_value = [{'key': "crop.jpg"}]
+    client.encode_retraining_data.return_value = [{'bucket': "retraining-data", 'key': "train.jpg"}, {'bucket': "retraining-data", 'key': "train.txt"}]
+    client.encode_thumbnail.return_value = [{'key': "thumb.jpg"}]
+    client.encode_labeled_proofs.return_value = [{'key': "a.jpg"}, {'key': "b.jpg"}]
+    client.encode_video_proofs.return_value = [{'key': "a.mp4"}, {'key': "b.mp4"}]
+
+    save_violation_job(client, MagicMock(), records, {'fps': 10, 'frame_buffer': [(0, frame), (1, frame)]})
+
+    assert client.encode_proof.call_count == 2
+    client.encode_retraining_data.assert_called_once()
+    assert client.encode_retraining_data.call_args[0][2] == [records[0]['bbox'], records[1]['bbox']]
+    client.encode_thumbnail.assert_called_once()
+    client.encode_labeled_proofs.assert_called_once()
+    client.encode_video_proofs.assert_called_once()
+    assert client.upload.call_count == 2 + 2 + 1 + 2 + 2
+
+
+def test_labeled_proofs_upload_the_same_bytes(monkeypatch):
+    client = MinioClient()
+    s3 = MagicMock()
+    monkeypatch.setattr(client, 's3', s3)
+
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    results = client.save_labeled_proofs(frame, [
+        {'identifier': "A", 'violation_type': "Red Light", 'bbox': (10, 10, 40, 40)},
+        {'identifier': "B", 'violation_type': "Red Light", 'bbox': (60, 10, 90, 40)},
+    ])
+
+    assert results == [True, True]
+    (body_a, _, key_a), (body_b, _, key_b) = [c.args[:3] for c in s3.upload_fileobj.call_args_list]
+    assert body_a.getvalue() == body_b.getvalue()
+    assert "Red Light_A_" in key_a and "Red Light_B_" in key_b
+
+
+def test_bundle_encodes_the_frame_once(monkeypatch):
+    client = MinioClient()
+    monkeypatch.setattr(client, 's3', MagicMock())
+    monkeypatch.setattr(client, 'labeled_proofs', 'annotation')
+    encodes = []
+    original = client._encode_jpeg
+    monkeypatch.setattr(client, '_encode_jpeg', lambda image: encodes.append(image.shape) or original(image))
+
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    records = [
+        {'vehicle_id': i, 'identifier': f"PLATE{i}", 'violation_type': "Red Light", 'frame': frame, 'frame_idx': None,
+         'bbox': (10 * i, 10, 10 * i + 20, 40), 'crop_box': (0, 0, 50, 60), 'bboxes': None, 'proof_crop': frame[:60, :50]}
+        for i in (1, 2)
+    ]
+    items = encode_violation_job(client, MagicMock(), records, {'fps': 10})
+
+    # One JPEG for the frame, a label, a thumbnail, and an annotation per vehicle instead of crop and labeled JPEGs
+    assert encodes == [frame.shape]
+    assert [item['content_type'] for item in items] == ['image/jpeg', 'text/plain', 'image/jpeg', 'application/json', 'application/json']
+    assert items[2]['key'].startswith("thumbnails/")
+    annotation = json.loads(items[3]['body'])
+    assert annotation['image'] == {'bucket': items[0]['bucket'], 'key': items[0]['key']}
+    assert annotation['vehicle']['crop_box'] == [0, 0, 50, 60]
+    assert len(annotation['boxes']) == 2
+
+
+def test_render_proof_draws_annotation(monkeypatch):
+    client = MinioClient()
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    image = {'bucket': 'retraining-data', 'key': 'train_1.jpg', 'body': client._encode_jpeg(frame)}
+    [item] = client.encode_proof_annotations(image, frame.shape, [
+        {'identifier': "A", 'violation_type': "Red Light", 'bbox': (10, 10, 40, 40), 'crop_box': (0, 0, 60, 50)}])
+    objects = {item['key']: item['body'], image['key']: image['body']}
+    s3 = MagicMock()
+    s3.get_object.side_effect = lambda Bucket, Key: {'Body': io.BytesIO(objects[Key])}
+    monkeypatch.setattr(client, 's3', s3)
+
+    labeled = client.render_proof(item['key'])
+    assert labeled.shape == frame.shape and labeled[10, 25, 2] == 255
+    assert client.render_proof(item['key'], crop=True).shape == (50, 60, 3)
+
+
+def _flush_into_full_queue(buffer, save_queue):
+    for i in range(3):
+        buffer.append((i, np.full((120, 160, 3), i, dtype=np.uint8)))
+    save_queue.put({'records': []})
+
+    batch = EvidenceBatch()
+    for vehicle_id in (1, 2):
+        vehicle = _violator(vehicle_id, [10 * vehicle_id, 10, 10 * vehicle_id + 20, 40], buffer, 1)
+        vehicle.mark_violation("Red Light", frame_buffer=buffer, state=vehicle.get_state()[0], save_queue=batch,
+                               frame_idx=vehicle.violation_frame_idx, padding=0)
+    # Does not wait for the save worker
+    batch.flush(save_queue)
+
+
+def test_full_queue_keeps_the_job_with_copied_frames():
+    buffer = FrameRetentionBuffer(maxlen=3)
+    save_queue = EvidenceQueue(maxsize=1, logger=MagicMock())
+    _flush_into_full_queue(buffer, save_queue)
+
+    # The slots go back to the capture loop, the violation is still saved
+    assert all(buffer.pinned_count(i) == 0 for i in range(3))
+    assert save_queue.copied == 1 and save_queue.dropped == 0 and save_queue.qsize() == 2
+    save_queue.get_nowait()
+    job = save_queue.get_nowait()
+    assert job['frame_store'] is None and job['window'] is None
+    assert [idx for idx, _ in job['frame_buffer']] == [0, 1, 2]
+    first, second = job['records']
+    assert first['frame'] is second['frame'] and first['frame'][0, 0, 0] == 1 and first['frame_idx'] is None
+    # Overwriting the slots does not change the copies
+    for i in range(3, 6):
+        buffer.append((i, np.full((120, 160, 3), i, dtype=np.uint8)))
+    assert first['frame'][0, 0, 0] == 1 and job['frame_buffer'][2][1][0, 0, 0] == 2
+
+    client = MagicMock()
+    client.labeled_proofs = 'rendered'
+    client.content_store = ContentStore()
+    encode_violation_job(client, MagicMock(), job['records'], job)
+    assert client.encode_labeled_proofs.call_count == 1
+    assert len(client.encode_video_proofs.call_args[0][0]) == 3
+
+
+def test_full_queue_drops_the_job_past_the_overflow_limit():
+    buffer = FrameRetentionBuffer(maxlen=3)
+    logger = MagicMock()
+    save_queue = EvidenceQueue(maxsize=1, overflow_size=0, logger=logger)
+    _flush_into_full_queue(buffer, save_queue)
+
+    assert save_queue.dropped == 1 and save_queue.copied == 0 and save_queue.qsize() == 1
+    assert all(buffer.pinned_count(i) == 0 for i in range(3))
+    logger.error.assert_called_once()
+
+
+def test_drop_policy_drops_the_job_and_releases_its_pins():
+    buffer = FrameRetentionBuffer(maxlen=3)
+    save_queue = EvidenceQueue(maxsize=1, overflow='drop', logger=MagicMock())
+    _flush_into_full_queue(buffer, save_queue)
+
+    assert save_queue.dropped == 1 and save_queue.qsize() == 1
+    assert all(buffer.pinned_count(i) == 0 for i in range(3))
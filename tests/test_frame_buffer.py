@@ -0,0 +1,337 @@
+import queue
+import time
+import cv2
+import pytest
+import threading
+import numpy as np
+from unittest.mock import MagicMock, patch
+from core.frame_buffer import FrameRetentionBuffer, MappedFrameBuffer, EncodedFrameBuffer, make_frame_buffer
+from core.vehicle import Vehicle
+from core.violation_manager import ViolationManager
+
+
+def _frame(value):
+    return np.full((48, 64, 3), value, dtype=np.uint8)
+
+
+def test_window_behaves_like_deque():
+    buffer = FrameRetentionBuffer(maxlen=3)
+    for i in range(5):
+        buffer.append((i, _frame(i)))
+
+    assert len(buffer) == 3
+    assert [idx for idx, _ in buffer] == [2, 3, 4]
+    assert [frame[0, 0, 0] for _, frame in buffer] == [2, 3, 4]
+    assert buffer.get(0) is None
+
+
+def test_frames_are_copied_into_preallocated_slots():
+    buffer = FrameRetentionBuffer(maxlen=2, spare_slots=1)
+    frame = _frame(1)
+    buffer.append((1, frame))
+    slots = buffer._slots
+
+    for i in range(2, 10):
+        buffer.append((i, _frame(i)))
+    # Same storage all along, and the caller's frame is not kept
+    assert buffer._slots is slots
+    assert slots.shape == (3, 48, 64, 3)
+    frame[:] = 99
+    assert all(f[0, 0, 0] != 99 for _, f in buffer)
+
+
+def test_pinned_frame_outlives_window():
+    buffer = FrameRetentionBuffer(maxlen=2)
+    buffer.append((1, _frame(1)))
+    assert buffer.pin(1)
+    for i in range(2, 6):
+        buffer.append((i, _frame(i)))
+
+    assert buffer.get(1)[0, 0, 0] == 1
+    buffer.release(1)
+    assert buffer.get(1) is None
+    assert not buffer.pin(1)
+
+
+def test_pins_are_reference_counted():
+    buffer = FrameRetentionBuffer(maxlen=1)
+    buffer.append((1, _frame(1)))
+    buffer.pin(1)
+    buffer.pin(1)
+    buffer.append((2, _frame(2)))
+
+    buffer.release(1)
+    assert buffer.get(1) is not None
+    buffer.release(1)
+    assert buffer.get(1) is None
+
+
+def test_drops_frames_when_all_slots_are_pinned():
+    buffer = FrameRetentionBuffer(maxlen=2, spare_slots=1)
+    buffer.append((1, _frame(1)))
+    buffer.append((2, _frame(2)))
+    assert buffer.pin_window() == [1, 2]
+
+    assert buffer.append((3, _frame(3)))       # uses the spare slot, frame 1 leaves the window pinned
+    assert not buffer.append((4, _frame(4)))   # nothing left
+    assert buffer.dropped == 1
+    assert buffer.get(1)[0, 0, 0] == 1
+
+    buffer.release_all([1, 2])
+    assert buffer.append((4, _frame(4)))
+    assert [idx for idx, _ in buffer] == [3, 4]
+
+
+def test_block_waits_for_release():
+    buffer = FrameRetentionBuffer(maxlen=1, spare_slots=0, on_full='block', block_timeout=2.0)
+    buffer.append((1, _frame(1)))
+    buffer.pin(1)
+
+    timer = threading.Timer(0.05, buffer.release, args=(1,))
+    timer.start()
+    assert buffer.append((2, _frame(2)))
+    timer.join()
+    assert buffer.dropped == 0
+
+
+def test_vehicle_violation_frame_is_pinned_not_copied(dummy_bbox):
+    buffer = FrameRetentionBuffer(maxlen=2)
+    frame = _frame(7)
+    buffer.append((10, frame))
+
+    vehicle = Vehicle(dummy_bbox, class_id=1)
+    vehicle.has_violated = True
+    vehicle.set_violation_frame(frame, frame_idx=10, frame_buffer=buffer)
+    assert vehicle.frame_of_violation is None
+    assert buffer.pinned_count(10) == 1
+
+    # Frame leaves the window while the vehicle is still in the zone
+    buffer.append((11, _frame(8)))
+    buffer.append((12, _frame(9)))
+
+    save_queue = queue.Queue()
+    vehicle.mark_violation("Red Light", frame_buffer=buffer, state=[10, 10, 30, 30], save_queue=save_queue,
+                           frame_idx=vehicle.violation_frame_idx, padding=0)
+
+    data = save_queue.get_nowait()
+    assert data['frame'] is None
+    assert data['frame_store'].get(data['frame_idx'])[0, 0, 0] == 7
+    # The vehicle released its pin, the save job holds its own and the pre-roll window
+    assert vehicle.violation_frame_idx is None
+    assert buffer.pinned_count(10) == 1
+    assert data['window'] == [11, 12]
+    assert data['frame_buffer'] == []
+    buffer.release(data['frame_idx'])
+    buffer.release_all(data['window'])
+    assert buffer.get(10) is None
+    assert buffer.pinned_count(11) == 0
+
+
+def test_vehicle_falls_back_to_copy_without_buffer(dummy_bbox, dummy_frame):
+    vehicle = Vehicle(dummy_bbox, class_id=1)
+    vehicle.set_violation_frame(dummy_frame, frame_idx=3, frame_buffer=None)
+    assert vehicle.frame_of_violation is not dummy_frame
+    np.testing.assert_array_equal(vehicle.frame_of_violation, dummy_frame)
+
+    vehicle.release_violation_frame()
+    assert vehicle.frame_of_violation is None
+
+
+def test_dropped_track_releases_its_pin(dummy_bbox):
+    buffer = FrameRetentionBuffer(maxlen=2)
+    buffer.append((1, _frame(1)))
+    manager = ViolationManager(violations=[], recognizer=MagicMock())
+
+    vehicle = Vehicle(dummy_bbox, class_id=1)
+    vehicle.set_violation_frame(buffer.get(1), frame_idx=1, frame_buffer=buffer)
+    manager.update([vehicle], None, None, None, active_ids=[vehicle.id])
+    assert buffer.pinned_count(1) == 1
+
+    # The tracker dropped the track, a reference kept elsewhere does not hold the pin
+    manager.update([], None, None, None, active_ids=[])
+    assert buffer.pinned_count(1) == 0
+    assert vehicle.violation_frame_idx is None
+    assert manager.pinned_vehicles == {}
+
+
+def test_max_pinned_falls_back_to_copy(dummy_bbox):
+    buffer = FrameRetentionBuffer(maxlen=4, max_pinned=2)
+    for i in range(4):
+        buffer.append((i, _frame(i)))
+
+    vehicles = [Vehicle(dummy_bbox, class_id=1) for _ in range(3)]
+    for i, vehicle in enumerate(vehicles):
+        vehicle.set_violation_frame(buffer.get(i), frame_idx=i, frame_buffer=buffer)
+
+    assert [vehicle.violation_frame_idx for vehicle in vehicles] == [0, 1, None]
+    assert vehicles[2].frame_of_violation[0, 0, 0] == 2
+    # A frame that is pinned already can be pinned again
+    assert buffer.pin(0)
+    vehicles[1].release_violation_frame()
+    assert buffer.pin(3)
+
+
+def test_encoded_buffer_keeps_window_and_pins(dummy_frame):
+    buffer = EncodedFrameBuffer(maxlen=2, quality=95, on_full='block')
+    for i in range(3):
+        buffer.append((i, dummy_frame))
+    assert buffer.flush(timeout=2.0)
+
+    assert len(buffer) == 2
+    assert [idx for idx, _ in buffer] == [1, 2]
+    assert buffer.get(0) is None
+    # Much smaller than the raw frames
+    assert buffer.nbytes < dummy_frame.nbytes // 10
+
+    decoded = buffer.get(2)
+    assert decoded.shape == dummy_frame.shape
+    assert np.abs(decoded.astype(int) - dummy_frame.astype(int)).mean() < 2
+
+    window = buffer.pin_window()
+    for i in range(3, 6):
+        buffer.append((i, dummy_frame))
+    assert window == [1, 2]
+    assert buffer.get(1) is not None
+    assert buffer.flush(timeout=2.0)
+    buffer.release_all(window)
+    assert buffer.get(1) is None
+    buffer.close()
+
+
+def test_encoded_buffer_defers_decoding_to_the_worker(dummy_bbox):
+    buffer = EncodedFrameBuffer(maxlen=4, on_full='block')
+    for i in range(3):
+        buffer.append((i, _frame(i * 40)))
+    # Not encoded yet: served raw, and pins wait for the encoder
+    vehicle = Vehicle(dummy_bbox, class_id=1)
+    vehicle.has_violated = True
+    vehicle.set_violation_frame(None, frame_idx=2, frame_buffer=buffer)
+    assert vehicle.violation_frame_idx == 2
+    assert buffer.flush(timeout=2.0)
+    assert buffer.pinned_count(2) == 1
+
+    with patch.object(buffer, '_decode', side_effect=AssertionError("decoded in the capture loop")):
+        save_queue = queue.Queue()
+        vehicle.mark_violation("Red Light", frame_buffer=buffer, state=[10, 10, 30, 30], save_queue=save_queue,
+                               frame_idx=2, padding=0)
+    data = save_queue.get_nowait()
+    assert data['proof_crop'] is None and data['crop_box'] == (10, 10, 30, 30)
+    assert data['frame_store'].get(2)[0, 0, 0] in range(78, 83)
+    buffer.close()
+
+
+def test_make_frame_buffer():
+    assert isinstance(make_frame_buffer(10), FrameRetentionBuffer)
+    assert isinstance(make_frame_buffer(10, {'preroll_encoding': 'jpeg'}), EncodedFrameBuffer)
+    ring = make_frame_buffer(10, {'spare_frame_slots': 4, 'frame_slots_on_full': 'block'})
+    assert ring.capacity == 14 and ring.on_full == 'block'
+    assert isinstance(make_frame_buffer(10, {'preroll_storage': 'disk'}), MappedFrameBuffer)
+    encoded = make_frame_buffer(10, {'preroll_encoding': 'jpeg', 'frame_slots_on_full': 'block', 'max_pinned_frames': 3})
+    assert encoded.on_full == 'block' and encoded.max_pinned == 3
+
+
+def test_jpeg_preroll_warns_that_disk_storage_is_ignored(capsys):
+    assert isinstance(make_frame_buffer(10, {'preroll_encoding': 'jpeg', 'preroll_storage': 'disk'}), EncodedFrameBuffer)
+    assert "preroll_storage 'disk' is ignored" in capsys.readouterr().out
+
+
+def test_encoded_buffer_drops_frames_when_the_encoder_falls_behind():
+    encoding = threading.Event()
+    release = threading.Event()
+    imencode = cv2.imencode
+
+    def slow_imencode(*args, **kwargs):
+        encoding.set()
+        release.wait(2.0)
+        return imencode(*args, **kwargs)
+
+    buffer = EncodedFrameBuffer(maxlen=4, max_pending=1)
+    with patch('core.frame_buffer.cv2.imencode', side_effect=slow_imencode):
+        assert buffer.append((0, _frame(0)))
+        assert encoding.wait(2.0)
+        # The capture loop does not wait for the stalled encoder
+        start = time.monotonic()
+        assert not buffer.append((1, _frame(1)))
+        assert time.monotonic() - start < 0.5 and buffer.dropped == 1
+        release.set()
+        assert buffer.flush(timeout=2.0)
+    assert buffer.append((2, _frame(2)))
+    assert buffer.flush(timeout=2.0)
+    assert [idx for idx, _ in buffer] == [0, 2]
+    buffer.close()
+
+
+def test_encoded_buffer_caps_pinned_frames(dummy_bbox):
+    buffer = EncodedFrameBuffer(maxlen=4, max_pinned=2, on_full='block')
+    for i in range(4):
+        buffer.append((i, _frame(i)))
+    assert buffer.flush(timeout=2.0)
+
+    vehicles = [Vehicle(dummy_bbox, class_id=1) for _ in range(3)]
+    for i, vehicle in enumerate(vehicles):
+        vehicle.set_violation_frame(_frame(i), frame_idx=i, frame_buffer=buffer)
+    assert [vehicle.violation_frame_idx for vehicle in vehicles] == [0, 1, None]
+    assert vehicles[2].frame_of_violation[0, 0, 0] == 2
+    vehicles[0].release_violation_frame()
+    assert buffer.pin(3)
+    buffer.close()
+
+
+def test_mapped_buffer_stores_frames_on_disk(tmp_path):
+    buffer = MappedFrameBuffer(maxlen=3, spare_slots=1, directory=str(tmp_path))
+    for i in range(5):
+        buffer.append((i, _frame(i)))
+
+    assert isinstance(buffer._slots, np.memmap)
+    assert [f[0, 0, 0] for _, f in buffer] == [2, 3, 4]
+    assert buffer.get(4)[0, 0, 0] == 4
+    # The backing file is unlinked right away
+    assert list(tmp_path.iterdir()) == []
+    buffer.close()
+
+
+@pytest.mark.parametrize("make_buffer", [
+    lambda: FrameRetentionBuffer(maxlen=3),
+    lambda: EncodedFrameBuffer(maxlen=3, on_full='block'),
+])
+def test_postroll_frames_are_pinned_on_arrival(make_buffer):
+    buffer = make_buffer()
+    buffer.append((1, _frame(10)))
+    postroll = buffer.reserve(buffer.latest_idx + 1, buffer.latest_idx + 2)
+    assert postroll == [2, 3]
+    assert not buffer.wait_for(3, timeout=0.01)
+
+    writer = threading.Thread(target=lambda: [buffer.append((i, _frame(i * 10))) for i in range(2, 8)])
+    writer.start()
+    assert buffer.wait_for(3, timeout=2.0)
+    writer.join()
+
+    # Frames 2 and 3 left the window but are still held for the job
+    assert [idx for idx, _ in buffer] == [5, 6, 7]
+    assert buffer.get(3)[0, 0, 0] in range(28, 33)
+    buffer.release_all(postroll)
+    assert buffer.get(3) is None
+
+
+def test_release_cancels_pending_reservation():
+    buffer = FrameRetentionBuffer(maxlen=2)
+    buffer.append((1, _frame(1)))
+    buffer.reserve(2, 2)
+    buffer.release(2)
+    buffer.append((2, _frame(2)))
+    assert buffer.pinned_count(2) == 0
+
+
+def test_mark_violation_reserves_postroll(dummy_bbox):
+    buffer = FrameRetentionBuffer(maxlen=2)
+    buffer.append((1, _frame(1)))
+    buffer.append((2, _frame(2)))
+
+    vehicle = Vehicle(dummy_bbox, class_id=1)
+    vehicle.has_violated = True
+    vehicle.set_violation_frame(buffer.get(2), frame_idx=2, frame_buffer=buffer)
+    save_queue = queue.Queue()
+    vehicle.mark_violation("Red Light", frame_buffer=buffer, state=[10, 10, 30, 30], save_queue=save_queue,
+                           frame_idx=2, padding=0, postroll=3)
+
+    assert save_queue.get_nowait()['window'] == [1, 2, 3, 4, 5]
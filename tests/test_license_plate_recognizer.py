@@ -0,0 +1,86 @@
+import pytest
+import numpy as np
+from unittest.mock import MagicMock
+from core.license_plate_recognizer import LicensePlateRecognizer
+
+
+def _mock_license_model(plate_xyxy):
+    """License model mock that always finds one plate at plate_xyxy (crop coordinates)"""
+    box = MagicMock()
+    box.conf = 0.9
+    box.xyxy = [MagicMock()]
+    box.xyxy[0].cpu.return_value.numpy.return_value = np.array(plate_xyxy, dtype=float)
+    box.__getitem__.return_value = box
+
+    result = MagicMock()
+    result.boxes = [box]
+
+    model = MagicMock()
+    model.predict.return_value = [result]
+    return model
+
+
+def _mock_character_model(text="51A12345", confidence=0.95):
+    model = MagicMock()
+    model.run.return_value = ([text], np.full((1, 9), confidence))
+    return model
+
+
+@pytest.fixture
+def frame():
+    return np.zeros((480, 640, 3), dtype=np.uint8)
+
+
+def test_plate_box_is_propagated(frame):
+    license_model = _mock_license_model([20, 60, 80, 80])
+    recognizer = LicensePlateRecognizer(license_model, _mock_character_model())
+
+    assert recognizer.update(frame, [100, 100, 200, 200], track_id=1) == "51A12345"
+    assert 1 in recognizer.plate_boxes
+
+    # Vehicle moved, same shape: OCR only, no new detection
+    assert recognizer.update(frame, [110, 105, 210, 205], track_id=1) == "51A12345"
+    assert license_model.predict.call_count == 1
+
+
+def test_low_ocr_confidence_triggers_redetection(frame):
+    license_model = _mock_license_model([20, 60, 80, 80])
+    character_model = _mock_character_model()
+    recognizer = LicensePlateRecognizer(license_model, character_model, min_ocr_confidence=0.6)
+
+    recognizer.update(frame, [100, 100, 200, 200], track_id=1)
+    character_model.run.return_value = (["51A12345"], np.full((1, 9), 0.3))
+    recognizer.update(frame, [100, 100, 200, 200], track_id=1)
+
+    assert license_model.predict.call_count == 2
+
+
+def test_shape_drift_triggers_redetection(frame):
+    license_model = _mock_license_model([20, 60, 80, 80])
+    recognizer = LicensePlateRecognizer(license_model, _mock_character_model(), max_shape_drift=0.2)
+
+    recognizer.update(frame, [100, 100, 200, 200], track_id=1)
+    # Aspect ratio goes from 1.0 to 2.0
+    recognizer.update(frame, [100, 100, 300, 200], track_id=1)
+
+    assert license_model.predict.call_count == 2
+
+
+def test_no_track_id_always_detects(frame):
+    license_model = _mock_license_model([20, 60, 80, 80])
+    recognizer = LicensePlateRecognizer(license_model, _mock_character_model())
+
+    recognizer.update(frame, [100, 100, 200, 200])
+    recognizer.update(frame, [100, 100, 200, 200])
+
+    assert license_model.predict.call_count == 2
+    assert recognizer.plate_boxes == {}
+
+
+def test_prune_drops_inactive_tracks(frame):
+    recognizer = LicensePlateRecognizer(_mock_license_model([20, 60, 80, 80]), _mock_character_model())
+    recognizer.update(frame, [100, 100, 200, 200], track_id=1)
+    recognizer.update(frame, [300, 100, 400, 200], track_id=2)
+
+    recognizer.prune([2])
+    assert list(recognizer.plate_boxes) == [2]
@@ -0,0 +1,95 @@
+import threading
+import pytest
+from core.light_signal_FSM import LightSignalFSM
+
+# Straight light cycle: RED 30s -> GREEN 25s -> YELLOW 5s
+CYCLE = [('RED', 30.0), ('GREEN', 25.0), ('YELLOW', 5.0)]
+
+
+def _light_at(t, offset=0.0):
+    t = (t + offset) % sum(d for _, d in CYCLE)
+    for state, duration in CYCLE:
+        if t < duration:
+            return state
+        t -= duration
+
+
+def _sample(fsm, t, state):
+    fsm.update([None, (state, 100), None], frame_idx=int(t * 10), timestamp=t)
+
+
+@pytest.fixture
+def fsm():
+    return LightSignalFSM(initial_states=[None, 'RED', None], confirm_frames=1, strength_threshold=15,
+                          cycle_model=True, sample_window=2.0, idle_interval=5.0, min_cycles=2)
+
+
+def test_fsm_without_cycle_model_always_samples():
+    fsm = LightSignalFSM(initial_states=[None, 'RED', None], confirm_frames=1)
+    assert fsm.should_sample(0.0) is True
+    assert fsm.get_confidence(0.0) == [None, 1.0, None]
+
+
+def test_cycle_model_learns_phase_durations(fsm):
+    t = 0.0
+    while t < 200.0:
+        _sample(fsm, t, _light_at(t))
+        t += 0.5
+
+    assert fsm.phase_durations[1]['RED']['mean'] == pytest.approx(30.0, abs=0.6)
+    assert fsm.phase_durations[1]['GREEN']['mean'] == pytest.approx(25.0, abs=0.6)
+    assert fsm.misses[1] == 0
+
+
+def test_cycle_model_samples_only_near_transitions(fsm):
+    t = 0.0
+    while t < 200.0:
+        _sample(fsm, t, _light_at(t))
+        t += 0.5
+
+    # t=200 is 20s into a RED phase that started at 180s: next change expected at 210s
+    assert fsm.states[1] == 'RED'
+    assert fsm.should_sample(201.0) is False
+    assert fsm.should_sample(209.0) is True
+    # Keep-alive sample once idle_interval has passed
+    assert fsm.should_sample(205.5) is True
+
+    confidence = fsm.get_confidence(201.0)
+    assert confidence[0] is None and confidence[2] is None
+    assert confidence[1] > fsm.get_confidence(209.5)[1]
+
+
+def test_cycle_model_falls_back_when_prediction_misses(fsm):
+    t = 0.0
+    while t < 200.0:
+        _sample(fsm, t, _light_at(t))
+        t += 0.5
+
+    # The controller switches to GREEN 10s early and the keep-alive sample sees it
+    _sample(fsm, 200.0, 'GREEN')
+    assert fsm.misses[1] == 1
+    assert fsm.should_sample(201.0) is True
+
+
+def test_cycle_model_is_safe_across_threads(fsm):
+    # The light worker updates while the capture thread asks whether to sample
+    errors = []
+
+    def capture():
+        try:
+            for i in range(2000):
+                fsm.should_sample(i * 0.1)
+                fsm.get_confidence(i * 0.1)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=capture)
+    thread.start()
+    t = 0.0
+    while t < 200.0:
+        _sample(fsm, t, _light_at(t))
+        t += 0.5
+    thread.join()
+
+    assert errors == []
+    assert fsm.phase_durations[1]['RED']['mean'] == pytest.approx(30.0, abs=0.6)
@@ -0,0 +1,61 @@
+import pytest
+import numpy as np
+import cv2
+from core.light_signal_detector import LightSignalDetector
+
+H, W = 480, 640
+
+# BGR colours that fall inside the detector HSV ranges
+RED = (0, 0, 255)
+GREEN = (0, 255, 0)
+
+
+def _rect(x1, y1, x2, y2):
+    return [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
+
+
+@pytest.fixture
+def detector():
+    detector = LightSignalDetector(h=H, w=W)
+    detector.straight_light_zones.append(_rect(400, 20, 420, 40))
+    detector.left_light_zones.append(_rect(440, 20, 460, 40))
+    detector.build_zone_mask(H, W)
+    return detector
+
+
+def test_roi_is_union_of_zones(detector):
+    assert detector.roi == (400, 20, 461, 41)
+
+
+def test_detect_light_signals(detector):
+    frame = np.zeros((H, W, 3), dtype=np.uint8)
+    cv2.rectangle(frame, (400, 20), (420, 40), RED, -1)
+    cv2.rectangle(frame, (440, 20), (460, 40), GREEN, -1)
+    # Colours outside the light zones must not leak into the result
+    cv2.rectangle(frame, (0, 0), (300, 300), GREEN, -1)
+
+    left, straight, right = detector.detect_light_signals(frame)
+
+    assert left[0] == 'GREEN'
+    assert straight[0] == 'RED'
+    assert straight[1] == 21 * 21
+    assert right is None
+
+
+def test_count_zone_colors(detector):
+    frame = np.zeros((H, W, 3), dtype=np.uint8)
+    cv2.rectangle(frame, (400, 20), (420, 40), RED, -1)
+
+    counts = detector.count_zone_colors(frame)
+
+    # one row per zone (straight first, then left), columns RED, YELLOW, GREEN
+    assert counts.shape == (2, 3)
+    assert counts[0, 0] == 21 * 21
+    assert counts[0, 2] == 0
+    assert counts[1].sum() == 0
+
+
+def test_no_zones():
+    detector = LightSignalDetector(h=H, w=W)
+    frame = np.zeros((H, W, 3), dtype=np.uint8)
+    assert detector.detect_light_signals(frame) == (None, None, None)
@@ -0,0 +1,59 @@
+import time
+import pytest
+import numpy as np
+import cv2
+from core.light_signal_detector import LightSignalDetector
+from core.light_signal_FSM import LightSignalFSM
+from core.light_signal_stage import LightSignalStage
+
+H, W = 480, 640
+
+
+@pytest.fixture
+def stage():
+    detector = LightSignalDetector(h=H, w=W)
+    detector.straight_light_zones.append([(400, 20), (420, 20), (420, 40), (400, 40)])
+    detector.build_zone_mask(H, W)
+    fsm = LightSignalFSM(initial_states=[None, 'RED', None], confirm_frames=1)
+    return LightSignalStage(detector, fsm, interval=0.0)
+
+
+def _frame(color):
+    frame = np.zeros((H, W, 3), dtype=np.uint8)
+    cv2.rectangle(frame, (400, 20), (420, 40), color, -1)
+    return frame
+
+
+def test_initial_states_before_any_sample(stage):
+    assert stage.get_states(frame_idx=1) == [None, 'RED', None]
+
+
+def test_states_match_frame_index(stage):
+    stage.process(stage.detector.crop_roi(_frame((0, 0, 255))), frame_idx=5, timestamp=0.0)
+    stage.process(stage.detector.crop_roi(_frame((0, 255, 0))), frame_idx=10, timestamp=1.0)
+
+    assert stage.get_states(frame_idx=7) == [None, 'RED', None]
+    assert stage.get_states(frame_idx=10) == [None, 'GREEN', None]
+    assert stage.get_state(frame_idx=12)['timestamp'] == 1.0
+    # Frames before the first sample fall back to the initial states
+    assert stage.get_states(frame_idx=2) == [None, 'RED', None]
+
+
+def test_worker_publishes_samples(stage):
+    stage.start()
+    try:
+        assert stage.submit(_frame((0, 255, 0)), frame_idx=3) is True
+        deadline = time.time() + 2
+        while stage.get_state() is None and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        stage.stop()
+
+    assert stage.get_state()['frame_idx'] == 3
+    assert stage.get_states(frame_idx=3) == [None, 'GREEN', None]
+
+
+def test_submit_respects_interval(stage):
+    stage.interval = 60
+    assert stage.submit(_frame((0, 0, 255)), frame_idx=1) is True
+    assert stage.submit(_frame((0, 0, 255)), frame_idx=2) is False
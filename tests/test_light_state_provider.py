@@ -0,0 +1,84 @@
+import json
+import time
+import socket
+import pytest
+from core.light_state_provider import ControllerLightProvider, LightStateProvider
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_states_aligned_to_frame_timestamp():
+    provider = ControllerLightProvider(stale_after=None)
+    provider.feed({"timestamp": 100.0, "states": ["RED", "GREEN", None]})
+    provider.feed({"timestamp": 110.0, "states": ["RED", "YELLOW", None]})
+    # Out of order message
+    provider.feed({"timestamp": 105.0, "left": "green", "straight": "green", "right": None})
+
+    assert provider.get_states(timestamp=99.0) == [None, 'RED', None]
+    assert provider.get_states(timestamp=100.0) == ['RED', 'GREEN', None]
+    assert provider.get_states(timestamp=107.0) == ['GREEN', 'GREEN', None]
+    assert provider.get_states(timestamp=200.0) == ['RED', 'YELLOW', None]
+
+
+def test_stale_feed_falls_back_to_default():
+    provider = ControllerLightProvider(stale_after=5.0, default_states=[None, 'RED', None])
+    provider.feed({"timestamp": 100.0, "states": [None, "GREEN", None]})
+
+    assert provider.get_states(timestamp=104.0) == [None, 'GREEN', None]
+    assert provider.get_states(timestamp=106.0) == [None, 'RED', None]
+
+
+def test_clock_offset():
+    provider = ControllerLightProvider(clock_offset=-2.0, stale_after=None)
+    provider.feed({"timestamp": 100.0, "states": [None, "GREEN", None]})
+
+    assert provider.get_states(timestamp=98.0) == [None, 'GREEN', None]
+
+
+def test_invalid_messages_are_ignored():
+    provider = ControllerLightProvider()
+    assert provider.feed("not json") is False
+    assert provider.feed({"states": ["BLUE", None, None]}) is False
+    assert provider.feed({"states": ["RED"]}) is False
+    assert provider.feed('{"states": [null, "red", null]}') is True
+
+
+def test_read_from_file(tmp_path):
+    feed_path = tmp_path / "phases.jsonl"
+    feed_path.write_text(json.dumps({"timestamp": 100.0, "states": [None, "GREEN", None]}) + "\n")
+
+    provider = ControllerLightProvider(source=str(feed_path), stale_after=None).start()
+    try:
+        assert _wait_for(lambda: provider.get_states(timestamp=101.0) == [None, 'GREEN', None])
+        with open(feed_path, "a") as f:
+            f.write(json.dumps({"timestamp": 102.0, "states": [None, "YELLOW", None]}) + "\n")
+        assert _wait_for(lambda: provider.get_states(timestamp=103.0) == [None, 'YELLOW', None])
+    finally:
+        provider.stop()
+
+
+def test_read_from_udp():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    provider = ControllerLightProvider(source=f"udp://127.0.0.1:{port}", stale_after=None).start()
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            sender.sendto(json.dumps({"timestamp": 100.0, "states": ["RED", "RED", None]}).encode(), ("127.0.0.1", port))
+        assert _wait_for(lambda: provider.get_states(timestamp=101.0) == ['RED', 'RED', None])
+    finally:
+        provider.stop()
+
+
+def test_provider_without_get_states_cannot_be_created():
+    class Incomplete(LightStateProvider):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
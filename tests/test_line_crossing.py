@@ -0,0 +1,82 @@
+import numpy as np
+import supervision as sv
+from core.line_crossing import LineCrossingEngine
+
+
+def _detections(centers, ids, size=10):
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    xyxy = np.hstack([centers - size / 2, centers + size / 2])
+    return sv.Detections(xyxy=xyxy, tracker_id=np.asarray(ids, dtype=int))
+
+
+def test_crossing_matches_line_zone():
+    lines = {
+        "violation_lines": [((0, 100), (200, 100)), ((50, 0), (50, 200))],
+        "other_exception_lines": [((200, 150), (0, 150))],
+    }
+    engine = LineCrossingEngine(categories=lines.keys())
+    zones = {}
+    for category, pairs in lines.items():
+        zones[category] = []
+        for start, end in pairs:
+            engine.add_line(start, end, category)
+            zones[category].append(sv.LineZone(start=sv.Point(*start), end=sv.Point(*end),
+                                               triggering_anchors=[sv.Position.CENTER]))
+
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(-20, 220, size=(6, 2))
+    for _ in range(60):
+        positions += rng.normal(0, 15, size=positions.shape)
+        # Tracks come and go
+        ids = np.flatnonzero(rng.random(len(positions)) > 0.2)
+        detections = _detections(positions[ids], ids)
+
+        result = engine.trigger(detections)
+        for category, category_zones in zones.items():
+            expected_in = np.zeros(len(detections), dtype=bool)
+            expected_out = np.zeros(len(detections), dtype=bool)
+            for zone in category_zones:
+                crossed_in, crossed_out = zone.trigger(detections)
+                expected_in |= crossed_in
+                expected_out |= crossed_out
+            np.testing.assert_array_equal(result[category][0], expected_in)
+            np.testing.assert_array_equal(result[category][1], expected_out)
+
+
+def test_crossing_in_and_out():
+    engine = LineCrossingEngine(categories=["violation_lines"])
+    engine.add_line((0, 100), (200, 100), "violation_lines")
+
+    # "In" is moving to the left of start -> end, i.e. upwards across this line
+    assert not engine.trigger(_detections([[100, 120]], [1]))["violation_lines"][0].any()
+    crossed_in, crossed_out = engine.trigger(_detections([[100, 80]], [1]))["violation_lines"]
+    assert crossed_in.tolist() == [True] and crossed_out.tolist() == [False]
+    crossed_in, crossed_out = engine.trigger(_detections([[100, 120]], [1]))["violation_lines"]
+    assert crossed_in.tolist() == [False] and crossed_out.tolist() == [True]
+
+
+def test_outside_limits_does_not_cross():
+    engine = LineCrossingEngine(categories=["violation_lines"])
+    engine.add_line((0, 100), (200, 100), "violation_lines")
+
+    engine.trigger(_detections([[300, 80]], [1]))
+    assert not engine.trigger(_detections([[300, 120]], [1]))["violation_lines"][0].any()
+
+
+def test_idle_tracks_are_forgotten():
+    engine = LineCrossingEngine(categories=["violation_lines"], max_idle_frames=2)
+    engine.add_line((0, 100), (200, 100), "violation_lines")
+
+    engine.trigger(_detections([[100, 120]], [1]))
+    for _ in range(3):
+        engine.trigger(_detections([[10, 10]], [2]))
+    assert engine.track_ids.tolist() == [2]
+    # Track 1 comes back on the other side: no side history, so no crossing
+    assert not engine.trigger(_detections([[100, 80]], [1]))["violation_lines"][0].any()
+
+
+def test_empty_detections():
+    engine = LineCrossingEngine(categories=["violation_lines"])
+    engine.add_line((0, 100), (200, 100), "violation_lines")
+    result = engine.trigger(sv.Detections.empty())
+    assert result["violation_lines"][0].shape == (0,)
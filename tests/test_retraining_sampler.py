@@ -0,0 +1,71 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from utils.retraining_sampler import RetrainingSampler, retraining_labels
+
+DAY = 1767225600.0  # 2026-01-01 00:00 UTC
+
+
+def _record(bbox=(10, 10, 50, 50), score=0.9, class_id=2, plate_read=True, low_conf_hits=0, detections=None):
+    return {'bbox': bbox, 'score': score, 'class_id': class_id, 'plate_read': plate_read,
+            'low_conf_hits': low_conf_hits, 'detections': detections}
+
+
+def test_labels_cover_every_detection_and_violator():
+    detections = np.array([[10, 10, 50, 50, 0.9, 2], [100, 100, 150, 150, 0.8, 3], [200, 200, 220, 220, 0.1, 1]])
+    records = [_record(detections=detections), _record(bbox=(300, 300, 340, 340), class_id=4, detections=detections)]
+
+    labels = retraining_labels(records, label_confidence=0.25)
+
+    # Low scoring detection dropped, the second violator was not detected in the frame
+    assert [class_id for class_id, _ in labels] == [2, 3, 4]
+    assert labels[2][1] == (300.0, 300.0, 340.0, 340.0)
+
+
+def test_confident_frames_are_skipped_once_the_class_quota_is_met():
+    sampler = RetrainingSampler(low_confidence=0.5, class_quota=1)
+    records = [_record()]
+    labels = sampler.labels(records)
+
+    assert sampler.admit(records, labels, now=DAY) == ['class_quota:2']
+    assert sampler.admit(records, labels, 1000, now=DAY) == ['class_quota:2']
+    assert sampler.admit(records, labels, now=DAY) == []
+
+    assert sampler.admit([_record(score=0.3)], labels, now=DAY) == ['low_confidence']
+    assert sampler.admit([_record(low_conf_hits=2)], labels, now=DAY) == ['second_stage']
+    assert sampler.admit([_record(plate_read=False)], labels, now=DAY) == ['plate_unread']
+    assert sampler.stats()['retraining_skipped'] == 1
+
+    # Quotas are daily
+    assert sampler.admit(records, labels, now=DAY + 86400) == ['class_quota:2']
+
+
+def test_daily_budget_survives_restart(tmp_path):
+    state_path = str(tmp_path / "sampler.json")
+    sampler = RetrainingSampler(daily_budget=1000, state_path=state_path)
+    records = [_record(plate_read=False)]
+    labels = sampler.labels(records)
+
+    assert sampler.admit(records, labels, now=DAY)
+    assert sampler.admit(records, labels, 1200, now=DAY) == []   # would overshoot the budget
+    assert sampler.admit(records, labels, 1000, now=DAY)
+    assert sampler.admit(records, labels, now=DAY) == []
+    assert json.load(open(state_path))['bytes'] == 1000
+
+    restarted = RetrainingSampler(daily_budget=1000, state_path=state_path)
+    assert restarted.admit(records, labels, now=DAY) == []
+    assert restarted.admit(records, labels, now=DAY + 86400) == ['plate_unread', 'class_quota:2']
+
+
+def test_concurrent_encoders_do_not_overshoot_the_budget():
+    sampler = RetrainingSampler(daily_budget=10000)
+    records = [_record(plate_read=False)]
+    labels = sampler.labels(records)
+
+    # Every encoder passed the check before any of them was charged
+    assert all(sampler.admit(records, labels, now=DAY) for _ in range(8))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        admitted = list(pool.map(lambda _: bool(sampler.admit(records, labels, 3000, now=DAY)), range(8)))
+
+    assert admitted.count(True) == 3
+    assert sampler.stats()['retraining_bytes_today'] == 9000
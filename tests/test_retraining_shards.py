@@ -0,0 +1,92 @@
+import io
+import json
+import os
+import tarfile
+from detect.utils import extract_retraining_shards
+from utils.retraining_shards import RetrainingShardWriter
+
+
+def _sample(i, size=100):
+    image = {'bucket': "retraining-data", 'key': f"train_{i}_20260101_000000.jpg", 'body': bytes([i % 256]) * size,
+             'content_type': 'image/jpeg'}
+    label = {'bucket': "retraining-data", 'key': f"train_{i}_20260101_000000.txt", 'body': b"0 0.5 0.5 0.1 0.1",
+             'content_type': 'text/plain'}
+    return image, label
+
+
+def _members(item):
+    with tarfile.open(fileobj=io.BytesIO(item['body'])) as tar:
+        return tar.getnames()
+
+
+def test_shard_closes_at_max_bytes(tmp_path):
+    writer = RetrainingShardWriter(str(tmp_path), camera="cam1", max_bytes=4096)
+
+    reference, closed = writer.add(*_sample(0), now=1000)
+    assert closed == []
+    assert reference.startswith("shards/cam1/") and reference.endswith(".tar#images/train_0_20260101_000000.jpg")
+
+    # 2 members of 1 header + 1 data block each per sample
+    _, closed = writer.add(*_sample(1), now=1001)
+    assert [item['key'].rsplit('.', 1)[1] for item in closed] == ['tar', 'json']
+    shard, manifest = closed
+    assert shard['key'] == reference.split('#')[0]
+    assert _members(shard) == ["images/train_0_20260101_000000.jpg", "labels/train_0_20260101_000000.txt",
+                               "images/train_1_20260101_000000.jpg", "labels/train_1_20260101_000000.txt"]
+    assert json.loads(manifest['body'])['samples'] == 2
+    assert len(open(writer.manifest_path).readlines()) == 1
+    assert os.listdir(tmp_path / "open") == []
+
+
+def test_shard_closes_at_max_age(tmp_path):
+    writer = RetrainingShardWriter(str(tmp_path), max_age=60)
+    writer.add(*_sample(0), now=1000)
+
+    assert writer.roll(now=1030) == []
+    closed = writer.roll(now=1060)
+    assert len(closed) == 2 and json.loads(closed[1]['body'])['samples'] == 1
+
+    # The next sample starts a new shard
+    reference, _ = writer.add(*_sample(1), now=1061)
+    assert reference.split('#')[0] != closed[0]['key']
+    assert len(writer.close()) == 2
+
+
+def test_torn_shard_is_recovered(tmp_path):
+    writer = RetrainingShardWriter(str(tmp_path))
+    for i in range(3):
+        writer.add(*_sample(i, size=2000), now=1000)
+    # Crash in the middle of the last image
+    path = writer._open_path(writer._name)
+    writer._tar.fileobj.flush()
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 3000)
+
+    recovered = RetrainingShardWriter(str(tmp_path)).close()
+    assert len(recovered) == 2
+    assert _members(recovered[0]) == [f"{folder}/train_{i}_20260101_000000.{ext}" for i in range(2)
+                                      for folder, ext in (("images", "jpg"), ("labels", "txt"))]
+
+
+def test_extract_shards_to_yolo_layout(tmp_path):
+    writer = RetrainingShardWriter(str(tmp_path / "shards"), max_bytes=10 ** 9)
+    for i in range(20):
+        writer.add(*_sample(i), now=1000)
+    shard = writer.close()[0]
+    shard_path = tmp_path / "shard.tar"
+    shard_path.write_bytes(shard['body'])
+
+    output = tmp_path / "dataset"
+    counts = extract_retraining_shards([str(shard_path)], str(output), val_ratio=0.3)
+
+    assert counts['train'] + counts['val'] == 20 and counts['val'] > 0
+    for split in ("train", "val"):
+        images = sorted(os.listdir(output / "images" / split))
+        labels = sorted(os.listdir(output / "labels" / split))
+        assert len(images) == counts[split]
+        assert [name[:-4] for name in images] == [name[:-4] for name in labels]
+    data_yaml = (output / "data.yaml").read_text()
+    assert "train: images/train" in data_yaml and "names: ['class_0']" in data_yaml
+
+    # Same split on a second export
+    assert extract_retraining_shards([str(shard_path)], str(tmp_path / "again"), val_ratio=0.3) == counts
@@ -0,0 +1,114 @@
+import queue
+import threading
+from unittest.mock import MagicMock
+import numpy as np
+from utils import MinioClient
+from utils.spool import EvidenceSpool
+from utils.workers import EvidencePipeline
+
+
+def _item(key, size=10):
+    return {'bucket': 'proofs', 'key': key, 'body': bytes([len(key)]) * size, 'content_type': 'image/jpeg',
+            'log': ('proofs', key)}
+
+
+class StallingS3:
+    """S3 stand-in whose uploads can be stalled"""
+
+    def __init__(self):
+        self.objects = {}
+        self.running = threading.Event()
+        self.running.set()
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        self.running.wait()
+        self.objects[(bucket, key)] = fileobj.read()
+
+
+def test_items_survive_a_restart(tmp_path):
+    spool = EvidenceSpool(str(tmp_path))
+    for key in ("a.jpg", "b.jpg", "c.jpg"):
+        spool.put(_item(key))
+    spool.done(spool.get())
+    spool.close()
+
+    restarted = EvidenceSpool(str(tmp_path))
+    assert len(restarted) == 2
+    entries = [restarted.get(timeout=0), restarted.get(timeout=0)]
+    assert sorted(entry['key'] for entry in entries) == ["b.jpg", "c.jpg"]
+    assert all(entry['body'] == _item(entry['key'])['body'] for entry in entries)
+    assert entries[0]['log'] == ('proofs', entries[0]['key'])
+
+
+def test_torn_manifest_and_orphans_are_ignored(tmp_path):
+    spool = EvidenceSpool(str(tmp_path))
+    spool.put(_item("a.jpg"))
+    spool.close()
+    with open(spool.manifest_path, 'a') as f:
+        f.write('{"op": "add", "id": "dead')
+    (tmp_path / "objects" / "orphan").write_bytes(b"x")
+
+    restarted = EvidenceSpool(str(tmp_path))
+    assert len(restarted) == 1
+    assert sorted(p.name for p in (tmp_path / "objects").iterdir()) == [restarted.get(timeout=0)['id']]
+
+
+def test_memory_limit_spills_to_disk(tmp_path):
+    spool = EvidenceSpool(str(tmp_path), memory_limit=25)
+    for key in ("a.jpg", "b.jpg", "c.jpg"):
+        spool.put(_item(key))
+
+    # The third body only lives on disk, put() did not wait
+    assert spool.memory_bytes == 20
+    assert [spool.get(timeout=0)['body'] for _ in range(3)] == [_item(k)['body'] for k in ("a.jpg", "b.jpg", "c.jpg")]
+
+
+def test_memory_only_spool_blocks_when_full():
+    spool = EvidenceSpool(memory_limit=15)
+    spool.put(_item("a.jpg"))
+    blocked = threading.Thread(target=spool.put, args=(_item("b.jpg"),))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+
+    spool.done(spool.get(timeout=0))
+    blocked.join(1)
+    assert not blocked.is_alive() and len(spool) == 1
+
+
+def test_retry_backs_off():
+    spool = EvidenceSpool(retry_delay=0.05)
+    spool.put(_item("a.jpg"))
+    spool.retry(spool.get(timeout=0))
+    assert spool.get(timeout=0.01) is None
+    assert spool.get(timeout=1)['key'] == "a.jpg"
+
+
+def test_stalled_storage_does_not_block_encoding(monkeypatch, tmp_path):
+    client = MinioClient()
+    s3 = StallingS3()
+    monkeypatch.setattr(client, 's3', s3)
+    s3.running.clear()
+
+    save_queue = queue.Queue(maxsize=2)
+    spool = EvidenceSpool(str(tmp_path), memory_limit=0, retry_delay=0.01)
+    pipeline = EvidencePipeline(client, save_queue, encode_workers=1, upload_workers=2, spool=spool,
+                                metrics_interval=0, logger=MagicMock())
+    pipeline.start()
+
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    for i in range(6):
+        # Same frame, a different vehicle each time
+        record = {'vehicle_id': i, 'identifier': f"P{i}", 'violation_type': "Red Light", 'frame': frame, 'frame_idx': None,
+                  'bbox': (10 + 20 * i, 10, 40 + 20 * i, 40), 'bboxes': None, 'proof_crop': frame[:20, :20]}
+        save_queue.put({'records': [record], 'frame_buffer': [], 'fps': 10}, timeout=2)
+    save_queue.join()
+
+    # Every job is encoded into the spool while storage hangs
+    assert len(spool) == 6 * 4
+    assert not s3.objects
+
+    s3.running.set()
+    save_queue.put(None)
+    pipeline.join()
+    assert len(s3.objects) == 6 * 4 and len(spool) == 0
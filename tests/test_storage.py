@@ -1,5 +1,12 @@
+import os
+import threading
 import pytest
+import cv2
+import numpy as np
 from datetime import datetime
+from unittest.mock import MagicMock
+from utils import MinioClient
+from utils.storage import ContentStore, PresignedUrlCache
 
 def test_minio_connection(minio_client):
     """Test if we can list buckets, implying connection is good"""
@@ -9,12 +16,12 @@ def test_minio_connection(minio_client):
     assert 'proofs' in bucket_names
     assert 'retraining-data' in bucket_names
 
-def test_upload_proof(minio_client, dummy_frame):
+def test_upload_proof(storage_client, dummy_frame):
     """Test uploading a proof image"""
     vehicle_id = 999
     violation_type = "TestViolation"
     
-    success = minio_client.save_proof(dummy_frame, vehicle_id, violation_type)
+    success = storage_client.save_proof(dummy_frame, vehicle_id, violation_type)
     assert success is True
     
     # Verify file exists
@@ -25,56 +32,56 @@ def test_upload_proof(minio_client, dummy_frame):
     # For now, just checking if upload returned True is a good first step.
     # To be more robust, let's list the bucket and look for recent files.
     
-    response = minio_client.s3.list_objects_v2(Bucket=minio_client.buckets['proofs'])
-    assert 'Contents' in response
+    keys = [obj['key'] for obj in storage_client.backend.list(storage_client.buckets['proofs'])]
+    assert keys
     found = False
-    for obj in response['Contents']:
-        if f"{violation_type}_{vehicle_id}" in obj['Key']:
+    for key in keys:
+        if f"{violation_type}_{vehicle_id}" in key:
             found = True
             break
     assert found is True
 
-def test_upload_retraining_data(minio_client, dummy_frame, dummy_bbox):
+def test_upload_retraining_data(storage_client, dummy_frame, dummy_bbox):
     """Test uploading retraining data (image + label)"""
     vehicle_id = 999
     
-    success = minio_client.save_retraining_data(dummy_frame, vehicle_id, dummy_bbox)
+    success = storage_client.save_retraining_data(dummy_frame, vehicle_id, dummy_bbox)
     assert success is True
     
-    response = minio_client.s3.list_objects_v2(Bucket=minio_client.buckets['retraining'])
-    assert 'Contents' in response
+    keys = [obj['key'] for obj in storage_client.backend.list(storage_client.buckets['retraining'])]
+    assert keys
     
     # Check for image and text file
     found_img = False
     found_txt = False
-    for obj in response['Contents']:
-        if f"train_{vehicle_id}" in obj['Key']:
-            if obj['Key'].endswith('.jpg'):
+    for key in keys:
+        if f"train_{vehicle_id}" in key:
+            if key.endswith('.jpg'):
                 found_img = True
-            elif obj['Key'].endswith('.txt'):
+            elif key.endswith('.txt'):
                 found_txt = True
     
     assert found_img is True
     assert found_txt is True
 
-def test_save_labeled_proof(minio_client, dummy_frame, dummy_bbox):
+def test_save_labeled_proof(storage_client, dummy_frame, dummy_bbox):
     """Test uploading labeled proof"""
     vehicle_id = 999
     violation_type = "TestViolation"
     
-    success = minio_client.save_labeled_proof(dummy_frame, vehicle_id, violation_type, dummy_bbox)
+    success = storage_client.save_labeled_proof(dummy_frame, vehicle_id, violation_type, dummy_bbox)
     assert success is True
     
-    response = minio_client.s3.list_objects_v2(Bucket=minio_client.buckets['proofs'])
-    assert 'Contents' in response
+    keys = [obj['key'] for obj in storage_client.backend.list(storage_client.buckets['proofs'])]
+    assert keys
     found = False
-    for obj in response['Contents']:
-        if f"{violation_type}_{vehicle_id}" in obj['Key'] and "labeled" in obj['Key']:
+    for key in keys:
+        if f"{violation_type}_{vehicle_id}" in key and "labeled" in key:
             found = True
             break
     assert found is True
 
-def test_save_video_proof(minio_client, dummy_frame):
+def test_save_video_proof(storage_client, dummy_frame):
     """Test uploading video proof"""
     vehicle_id = 999
     violation_type = "TestViolation"
@@ -82,14 +89,145 @@ def test_save_video_proof(minio_client, dummy_frame):
     # Create dummy frames as (frame_counter, frame) tuples
     frames = [(i, dummy_frame) for i in range(10)]
     
-    success = minio_client.save_video_proof(frames, vehicle_id, violation_type, bboxes=None, fps=10)
+    success = storage_client.save_video_proof(frames, vehicle_id, violation_type, bboxes=None, fps=10)
     assert success is True
     
-    response = minio_client.s3.list_objects_v2(Bucket=minio_client.buckets['proofs'])
-    assert 'Contents' in response
+    keys = [obj['key'] for obj in storage_client.backend.list(storage_client.buckets['proofs'])]
+    assert keys
     found = False
-    for obj in response['Contents']:
-        if f"{violation_type}_{vehicle_id}" in obj['Key'] and obj['Key'].endswith('.mp4'):
+    for key in keys:
+        if f"{violation_type}_{vehicle_id}" in key and key.endswith('.mp4'):
             found = True
             break
     assert found is True
+
+
+def test_thumbnail_is_small_and_prefixed():
+    client = MinioClient()
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    [item] = client.encode_thumbnail(frame, "7", [{'identifier': "A", 'violation_type': "Red Light", 'bbox': (100, 100, 400, 400)}])
+
+    thumbnail = cv2.imdecode(np.frombuffer(item['body'], dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert max(thumbnail.shape[:2]) == client.thumbnail_size
+    assert item['key'].startswith("thumbnails/") and item['bucket'] == client.buckets['proofs']
+
+
+def test_url_cache_reuses_until_refresh(monkeypatch):
+    client = MagicMock()
+    client.presigned_url.side_effect = lambda bucket, key, expires: f"{bucket}/{key}?n={client.presigned_url.call_count}"
+    cache = PresignedUrlCache(client, maxsize=2, expires=3600, refresh=300)
+
+    now = [1000.0]
+    monkeypatch.setattr("utils.storage.time.time", lambda: now[0])
+    first = cache.get("proofs", "a.jpg")
+    assert cache.get("proofs", "a.jpg") == first
+    assert client.presigned_url.call_count == 1
+
+    # Close to expiry the URL is signed again
+    now[0] += 3400
+    assert cache.get("proofs", "a.jpg") != first
+
+
+def test_url_cache_evicts_least_recently_used():
+    client = MagicMock()
+    client.presigned_url.side_effect = lambda bucket, key, expires: key
+    cache = PresignedUrlCache(client, maxsize=2)
+
+    cache.get("proofs", "a.jpg")
+    cache.get("proofs", "b.jpg")
+    cache.get("proofs", "a.jpg")
+    cache.get("proofs", "c.jpg")
+
+    assert len(cache) == 2
+    client.presigned_url.reset_mock()
+    cache.get("proofs", "a.jpg")
+    cache.get("proofs", "b.jpg")
+    assert [call.args[1] for call in client.presigned_url.call_args_list] == ["b.jpg"]
+
+
+def _scene(vehicle=None, bbox=(120, 100, 200, 160)):
+    # Fixed camera: the same background in every frame, a vehicle patch pasted into it
+    frame = cv2.imread(os.path.join(os.path.dirname(__file__), "..", "assets", "Red Light_1.jpg"))
+    frame = cv2.resize(frame, (320, 240), interpolation=cv2.INTER_AREA)
+    if vehicle is not None:
+        x1, y1, x2, y2 = bbox
+        frame[y1:y2, x1:x2] = np.random.default_rng(vehicle).integers(0, 255, (y2 - y1, x2 - x1, 3), dtype=np.uint8)
+    return frame
+
+
+def _noisy(frame, seed=1):
+    return np.clip(frame.astype(np.int16) + np.random.default_rng(seed).integers(-3, 4, frame.shape), 0, 255).astype(np.uint8)
+
+
+def _store(store, frame, bboxes, reference):
+    duplicate, reservation = store.find_or_reserve('retraining', store.image_hash(frame), frame, bboxes)
+    assert duplicate is None
+    store.commit(reservation, reference)
+
+
+def _lookup(store, frame, bboxes, namespace='retraining'):
+    duplicate, reservation = store.find_or_reserve(namespace, store.image_hash(frame), frame, bboxes)
+    store.cancel(reservation)
+    return duplicate
+
+
+def test_stalled_frame_is_a_duplicate():
+    bbox = (120, 100, 200, 160)
+    frame = _scene(vehicle=1)
+    store = ContentStore()
+    _store(store, frame, [bbox], "a")
+
+    again = _noisy(frame)
+    assert _lookup(store, again, [bbox]) == "a"
+    # Slightly shifted track box
+    assert _lookup(store, again, [(122, 101, 201, 161)]) == "a"
+    assert _lookup(store, frame, [bbox, (10, 10, 60, 50)]) is None
+    assert _lookup(store, frame, [bbox], namespace='proofs') is None
+
+
+def test_different_vehicles_on_a_static_background_are_not_duplicates():
+    bbox = (120, 100, 200, 160)
+    first, second = _scene(vehicle=1), _scene(vehicle=2)
+    store = ContentStore(max_distance=4)
+    _store(store, first, [bbox], "a")
+
+    # The vehicle hardly changes the hash of the whole frame, the pixels in its box tell them apart
+    assert bin(store.image_hash(first) ^ store.image_hash(second)).count("1") <= 4
+    assert _lookup(store, second, [bbox]) is None
+    # Same frame, the violation of another vehicle elsewhere
+    other = (20, 150, 90, 200)
+    assert _lookup(store, first, [other]) is None
+
+
+def test_samples_sharing_a_hash_are_all_kept():
+    bbox = (120, 100, 200, 160)
+    frames = [_scene(vehicle=i) for i in range(3)]
+    assert len({ContentStore.image_hash(frame) for frame in frames}) == 1
+    store = ContentStore(window=2)
+    for i, frame in enumerate(frames):
+        _store(store, frame, [bbox], i)
+
+    # Interleaved stalled vehicles still match, the window counts entries, not hashes
+    assert _lookup(store, frames[1], [bbox]) == 1
+    assert _lookup(store, frames[2], [bbox]) == 2
+    assert _lookup(store, frames[0], [bbox]) is None
+    assert ContentStore(window=0).find_or_reserve('retraining', 3, frames[0], [bbox]) == (None, None)
+
+
+def test_same_frame_is_stored_once_by_concurrent_encoders():
+    bbox = (120, 100, 200, 160)
+    frame = _scene(vehicle=1)
+    store = ContentStore()
+    assert _lookup(store, frame, [bbox]) is None  # cancelled, nothing stored
+    duplicate, reservation = store.find_or_reserve('retraining', store.image_hash(frame), frame, [bbox])
+    assert duplicate is None and reservation is not None
+
+    results = []
+    other = threading.Thread(target=lambda: results.append(_lookup(store, frame.copy(), [bbox])))
+    other.start()
+    other.join(timeout=0.1)
+    # Waits for the encoder storing the frame
+    assert other.is_alive()
+    store.commit(reservation, "a")
+    other.join(timeout=1)
+    assert results == ["a"]
@@ -0,0 +1,81 @@
+import queue
+import numpy as np
+import pytest
+from unittest.mock import MagicMock
+from utils import MinioClient, LocalBackend, StorageBackend
+from utils.storage_backends import make_backend, sync_backends
+from utils.workers import EvidencePipeline
+
+
+def test_local_backend_bucket_key_semantics(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    backend.put("proofs", "2026_01/a.jpg", b"one")
+    backend.put("proofs", "2026_01/a.jpg", b"two")
+    backend.put("proofs", "frames/b.jpg", b"three")
+    (tmp_path / "proofs" / "frames" / "c.jpg.1234.tmp").write_bytes(b"partial")
+
+    assert backend.get("proofs", "2026_01/a.jpg") == b"two"
+    assert [obj['key'] for obj in backend.list("proofs")] == ["2026_01/a.jpg", "frames/b.jpg"]
+    assert [obj['size'] for obj in backend.list("proofs", prefix="frames/")] == [5]
+    assert list(backend.list("models")) == []
+    assert backend.url("proofs", "frames/b.jpg") == str(tmp_path / "proofs" / "frames" / "b.jpg")
+
+    for key in ("../outside.jpg", "a//b.jpg", ""):
+        with pytest.raises(ValueError):
+            backend.put("proofs", key, b"x")
+
+
+def test_backend_is_selected_by_config(tmp_path):
+    backend = make_backend({'backend': 'local', 'local_root': str(tmp_path)})
+    assert isinstance(backend, LocalBackend) and backend.root == str(tmp_path)
+    with pytest.raises(ValueError):
+        make_backend({'backend': 'ftp'})
+
+
+def test_incomplete_backend_cannot_be_created():
+    class NoListing(StorageBackend):
+        def put(self, bucket, key, body, content_type='application/octet-stream'):
+            pass
+
+        def get(self, bucket, key):
+            return b""
+
+    with pytest.raises(TypeError):
+        NoListing()
+
+
+def test_sync_copies_only_new_objects(tmp_path):
+    edge = LocalBackend(str(tmp_path / "edge"))
+    central = LocalBackend(str(tmp_path / "central"))
+    edge.put("proofs", "a.jpg", b"a")
+    edge.put("retraining-data", "shards/cam0/s.tar", b"tar")
+
+    assert sync_backends(edge, central, ["proofs", "retraining-data"]) == 2
+    assert central.get("retraining-data", "shards/cam0/s.tar") == b"tar"
+
+    edge.put("proofs", "b.jpg", b"b")
+    assert sync_backends(edge, central, ["proofs", "retraining-data"]) == 1
+
+
+def test_pipeline_runs_on_the_local_backend(tmp_path):
+    client = MinioClient(LocalBackend(str(tmp_path)))
+    client.labeled_proofs = 'annotation'
+    assert client is not MinioClient()
+
+    frame = np.random.default_rng(0).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    record = {'vehicle_id': 7, 'identifier': "30A12345", 'violation_type': "Red Light", 'frame': frame,
+              'frame_idx': None, 'bbox': (10, 10, 40, 40), 'crop_box': (0, 0, 60, 50), 'bboxes': [(0, (10, 10, 40, 40))],
+              'proof_crop': frame[:50, :60]}
+    save_queue = queue.Queue()
+    pipeline = EvidencePipeline(client, save_queue, metrics_interval=0, logger=MagicMock())
+    pipeline.start()
+    save_queue.put({'records': [record], 'frame_buffer': [(0, frame)], 'fps': 10})
+    save_queue.put(None)
+    pipeline.join()
+
+    assert pipeline.metrics()['uploads_failed'] == 0
+    keys = record['object_keys']
+    assert client.backend.get(client.buckets['retraining'], keys['retraining'])
+    # Annotations are rendered back from the stored frame
+    assert client.render_proof(keys['labeled']).shape == frame.shape
+    assert client.render_proof(keys['labeled'], crop=True).shape == (50, 60, 3)
@@ -0,0 +1,76 @@
+from unittest.mock import MagicMock
+from core.traffic_stats import RollingCounter, TrafficStats, make_traffic_stats
+from core.violation_manager import ViolationManager
+
+
+def test_rolling_counter_reuses_slots():
+    counter = RollingCounter(bucket_seconds=60, length=3)
+    counter.add(0)
+    counter.add(59)
+    counter.add(60)
+    assert counter.series(now=60) == [(-60, 0), (0, 2), (60, 1)]
+
+    # Three minutes later the first slot is reused, the old count is gone
+    counter.add(180)
+    assert counter.series(now=180) == [(60, 1), (120, 0), (180, 1)]
+    assert len(counter.counts) == 3
+
+
+def test_rolling_counter_ignores_events_older_than_the_window():
+    counter = RollingCounter(bucket_seconds=60, length=2)
+    counter.add(600)
+    counter.add(480)
+    assert counter.total(now=600) == 1
+
+
+def test_summary_by_window_and_type():
+    stats = TrafficStats(camera="cam1")
+    for t in (10, 20, 30):
+        stats.record_vehicle(timestamp=t)
+    stats.record_violation("Red Light", plate_read=True, timestamp=20)
+    stats.record_violation("Red Light", plate_read=False, timestamp=25)
+    stats.record_violation("Wrong Lane", plate_read=True, timestamp=4000)
+
+    summary = stats.summary(granularity='hour', last=1, now=100)
+    assert summary['window']['vehicles'] == 3
+    assert summary['violations_by_type'] == {"Red Light": 2, "Wrong Lane": 0}
+    assert summary['plate_read_rate'] == 0.5
+    assert summary['totals']['violations'] == 3
+    assert stats.series('vehicles', granularity='minute', last=2, now=60) == [(0, 3), (60, 0)]
+
+
+def test_snapshot_survives_restart(tmp_path):
+    stats = TrafficStats(camera="cam1", snapshot_dir=str(tmp_path))
+    stats.record_violation("Red Light", plate_read=True, timestamp=1000)
+    stats.snapshot()
+
+    restored = TrafficStats(camera="cam1", snapshot_dir=str(tmp_path))
+    assert restored.total("violations:Red Light") == 1
+    assert restored.series("violations", granularity='day', last=1, now=1000) == [(0, 1)]
+    assert TrafficStats(camera="cam2", snapshot_dir=str(tmp_path)).total("violations") == 0
+
+
+def test_make_traffic_stats_from_config(tmp_path):
+    stats = make_traffic_stats({'system': {'camera_id': "north"}, 'stats': {'snapshot_dir': str(tmp_path), 'minutes': 5}})
+    assert stats.snapshot_path == str(tmp_path / "north.json")
+    assert stats.lengths['minute'] == 5
+
+
+def test_manager_feeds_stats_and_restores_counts(tmp_path):
+    stats = TrafficStats(snapshot_dir=str(tmp_path))
+    stats.record_violation("red_light", plate_read=False)
+
+    violation = MagicMock()
+    violation.name = "red_light"
+    vehicles = [MagicMock(counted=False, has_violated=False, license_plate="30A12345", lp_votes={}) for _ in range(2)]
+    violation.check_violation.return_value = vehicles[:1]
+
+    manager = ViolationManager(violations=[violation], recognizer=MagicMock(), stats=stats)
+    assert manager.violation_count == {"red_light": 1}
+
+    counts = manager.update(vehicles, None, None, None, frame_time=1000)
+    manager.update(vehicles, None, None, None, frame_time=1001)
+
+    assert counts["red_light"] == 3
+    assert stats.total('vehicles') == 2
+    assert stats.total('plates_read') == 2
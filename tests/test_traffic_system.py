@@ -134,3 +134,84 @@ def test_process_flow(mock_inference, mock_minio, mock_worker, mock_ocr, mock_yo
                 assert isinstance(frame, np.ndarray)
             except StopIteration:
                 pytest.fail("Generator stopped unexpectedly")
+
+
+@patch('core.traffic_system.load_config')
+@patch('core.traffic_system.YOLO')
+@patch('core.traffic_system.FastRecognizer')
+@patch('core.traffic_system.violation_save_worker')
+@patch('core.traffic_system.MinioClient')
+@patch('core.traffic_system.inference_video')
+def test_prefilter_map_reset_between_runs(mock_inference, mock_minio, mock_worker, mock_ocr, mock_yolo, mock_load_config, mock_config):
+    mock_load_config.return_value = mock_config
+    system = TrafficSystem()
+
+    mock_result = MagicMock()
+    mock_result.orig_img = np.zeros((480, 640, 3), dtype=np.uint8)
+    mock_inference.return_value = [mock_result]
+    system.tracker_instance = MagicMock()
+    system.tracker_instance.update.return_value = []
+    system.tracker_instance.get_tracked_objects.return_value = []
+    zones = {'polygon': [[0, 0], [100, 0], [100, 100], [0, 100]], 'lines_config': {'violation_lines': [[0, 50], [100, 50]]}}
+
+    with patch('core.traffic_system.preprocess_detection_result') as mock_preprocess, \
+            patch('core.traffic_system.load_zones', return_value=zones):
+        mock_preprocess.return_value = (mock_result.orig_img, np.zeros((0, 6)))
+
+        # First run filters with a margin
+        system.config['zones'] = {'prefilter_margin': 20}
+        system.running = True
+        next(system._process_flow())
+        assert system.prefilter_map is not None
+
+        # The next run has no margin configured
+        system.config['zones'] = {}
+        next(system._process_flow())
+        assert system.prefilter_map is None
+
+
+@patch('core.traffic_system.load_config')
+@patch('core.traffic_system.YOLO')
+@patch('core.traffic_system.FastRecognizer')
+@patch('core.traffic_system.violation_save_worker')
+@patch('core.traffic_system.MinioClient')
+@patch('core.traffic_system.inference_video')
+@patch('core.traffic_system.ControllerLightProvider')
+def test_light_provider_stopped_when_the_stream_ends(mock_provider_cls, mock_inference, mock_minio, mock_worker, mock_ocr, mock_yolo, mock_load_config, mock_config):
+    mock_config['light_signal'] = {'feed': "udp://0.0.0.0:5005"}
+    mock_load_config.return_value = mock_config
+    system = TrafficSystem()
+    system.stats = MagicMock()
+
+    mock_result = MagicMock()
+    mock_result.orig_img = np.zeros((480, 640, 3), dtype=np.uint8)
+    mock_inference.return_value = [mock_result]
+    system.tracker_instance = MagicMock()
+    system.tracker_instance.update.return_value = []
+    system.tracker_instance.get_tracked_objects.return_value = []
+    zones = {'polygon': [[0, 0], [100, 0], [100, 100], [0, 100]], 'lines_config': {'violation_lines': [[0, 50], [100, 50]]}}
+    first, second = MagicMock(), MagicMock()
+    for provider in (first, second):
+        provider.get_states.return_value = [None, 'RED', None]
+    mock_provider_cls.return_value.start.side_effect = [first, second]
+
+    with patch('core.traffic_system.preprocess_detection_result') as mock_preprocess, \
+            patch('core.traffic_system.load_zones', return_value=zones):
+        mock_preprocess.return_value = (mock_result.orig_img, np.zeros((0, 6)))
+        system.running = True
+
+        # The video ends on its own, without stop()
+        assert len(list(system._process_flow())) == 1
+        first.stop.assert_called_once()
+        assert system.light_provider is None
+        system.stats.snapshot.assert_called_once()
+
+        # A run left suspended is stopped by the next one
+        suspended = system._process_flow()
+        next(suspended)
+        assert system.light_provider is second
+        third = MagicMock()
+        third.get_states.return_value = [None, 'RED', None]
+        mock_provider_cls.return_value.start.side_effect = [third]
+        next(system._process_flow())
+        second.stop.assert_called()
@@ -57,3 +57,17 @@ def test_vehicle_lp_voting(dummy_bbox):
     vehicle.update_license_plate("XYZ-999")
     vehicle.update_license_plate("ABC-123")
     assert vehicle.license_plate == "ABC-123"  # Threshold met
+
+def test_plate_read_is_the_same_for_stats_and_sampler(dummy_bbox, dummy_frame):
+    vehicle = Vehicle(dummy_bbox, class_id=1)
+    assert vehicle.plate_read is False
+
+    # Below the vote threshold, the best candidate is still the identifier
+    vehicle.update_license_plate("ABC-123")
+    assert vehicle.license_plate is None and vehicle.plate_read is True
+
+    vehicle.has_violated = True
+    save_queue = MagicMock()
+    vehicle.mark_violation("RedLight", frame=dummy_frame, state=dummy_bbox, save_queue=save_queue)
+    record = save_queue.put_nowait.call_args[0][0]
+    assert record['identifier'] == "ABC-123" and record['plate_read'] is True
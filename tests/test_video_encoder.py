@@ -0,0 +1,52 @@
+import shutil
+import numpy as np
+import pytest
+from utils.video_encoder import ProofVideoEncoder, bbox_track
+
+
+def _frames(n=10, h=64, w=96):
+    return [(i, np.full((h, w, 3), i, dtype=np.uint8)) for i in range(n)]
+
+
+def test_bbox_track_uses_last_known_box():
+    boxes = [(5, (5, 5, 9, 9)), (2, (2, 2, 6, 6))]
+    track = bbox_track(boxes, [0, 1, 2, 3, 4, 5, 6])
+    assert track == [None, None, (2, 2, 6, 6), (2, 2, 6, 6), (2, 2, 6, 6), (5, 5, 9, 9), (5, 5, 9, 9)]
+
+
+def test_bbox_track_without_boxes():
+    assert bbox_track(None, [0, 1]) == [None, None]
+
+
+def test_draw_on_scratch_keeps_frames_untouched():
+    frames = _frames()
+    originals = [frame.copy() for _, frame in frames]
+    seen = []
+
+    def draw(scratch, position, frame_counter):
+        assert scratch[0, 0, 0] == frame_counter
+        seen.append(id(scratch))
+        scratch[:] = 255
+
+    body = ProofVideoEncoder(fps=10).encode(frames, draw)
+
+    assert body
+    assert len(set(seen)) == 1
+    assert all(np.array_equal(frame, original) for (_, frame), original in zip(frames, originals))
+
+
+def test_opencv_fallback_writes_mp4():
+    encoder = ProofVideoEncoder(fps=10)
+    encoder.ffmpeg_path = None
+    body = encoder.encode(_frames())
+    assert body[4:8] == b"ftyp"
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+def test_ffmpeg_streams_h264_without_temp_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("TMPDIR", str(tmp_path))
+    encoder = ProofVideoEncoder(fps=10)
+    body = encoder.encode(_frames(h=63, w=95))
+    assert body[4:8] == b"ftyp"
+    assert b"avc1" in body
+    assert not any(tmp_path.iterdir())
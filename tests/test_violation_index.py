@@ -0,0 +1,91 @@
+import queue
+from unittest.mock import MagicMock
+import numpy as np
+from utils import MinioClient, ViolationIndex
+from utils.spool import EvidenceSpool
+from utils.workers import EvidencePipeline
+
+
+def _row(i, timestamp, plate="30A12345", violation_type="Red Light"):
+    return {'vehicle_id': i, 'plate': plate, 'violation_type': violation_type, 'timestamp': timestamp,
+            'camera': "cam0", 'proof_key': f"2024_01/{violation_type}_{plate}_{i}.jpg"}
+
+
+def test_counts_and_filters(tmp_path):
+    index = ViolationIndex(str(tmp_path / "violations.db"))
+    index.add_many([_row(i, 1000 + i) for i in range(5)] + [_row(9, 2000, plate="51F99999", violation_type="Wrong Lane")])
+
+    assert index.count() == 6
+    assert index.count(start=1002, end=1004) == 2
+    assert index.count(plate="51F99999") == 1
+    assert index.count_by_type() == {"Red Light": 5, "Wrong Lane": 1}
+
+
+def test_query_pages_newest_first(tmp_path):
+    index = ViolationIndex(str(tmp_path / "violations.db"))
+    index.add_many([_row(i, 1000 + i) for i in range(5)])
+
+    first = index.query(limit=2)
+    second = index.query(limit=2, offset=2)
+    assert [row['vehicle_id'] for row in first + second] == [4, 3, 2, 1]
+    assert first[0]['proof_key'] == "2024_01/Red Light_30A12345_4.jpg"
+    assert first[0]['labeled_key'] is None
+
+
+def test_index_survives_reopen(tmp_path):
+    path = str(tmp_path / "violations.db")
+    ViolationIndex(path).add(_row(1, 1000))
+    assert ViolationIndex(path).count() == 1
+
+
+def test_pipeline_indexes_encoded_violations(monkeypatch, tmp_path):
+    client = MinioClient()
+    monkeypatch.setattr(client, 's3', MagicMock())
+    monkeypatch.setattr(client, 'labeled_proofs', 'annotation')
+    index = ViolationIndex(str(tmp_path / "violations.db"))
+
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    record = {'vehicle_id': 7, 'identifier': "30A12345", 'violation_type': "Red Light", 'timestamp': 1234.5, 'frame': frame,
+              'frame_idx': None, 'bbox': (10, 10, 40, 40), 'bboxes': [(0, (10, 10, 40, 40))], 'proof_crop': frame[:20, :20]}
+    save_queue = queue.Queue()
+    pipeline = EvidencePipeline(client, save_queue, index=index, camera="cam0", metrics_interval=0, logger=MagicMock())
+    pipeline.start()
+    save_queue.put({'records': [record], 'frame_buffer': [(0, frame)], 'fps': 10})
+    save_queue.put(None)
+    pipeline.join()
+
+    [row] = index.query(plate="30A12345")
+    assert row['timestamp'] == 1234.5 and row['camera'] == "cam0"
+    assert row['labeled_key'].endswith("_labeled.json")
+    assert row['video_key'].endswith(".mp4")
+    assert row['retraining_key'].startswith("train_7_")
+    uploaded = {call.args[2] for call in client.s3.upload_fileobj.call_args_list}
+    assert {row['labeled_key'], row['video_key'], row['retraining_key']} <= uploaded
+    assert row['thumbnail_key'].startswith("thumbnails/")
+
+
+def test_failed_index_write_keeps_the_evidence(monkeypatch, tmp_path):
+    client = MinioClient()
+    s3 = MagicMock()
+    s3.upload_fileobj.side_effect = RuntimeError("storage down")
+    monkeypatch.setattr(client, 's3', s3)
+    index = MagicMock()
+    index.add_many.side_effect = RuntimeError("database is locked")
+
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    record = {'vehicle_id': 7, 'identifier': "30A12345", 'violation_type': "Red Light", 'timestamp': 1234.5, 'frame': frame,
+              'frame_idx': None, 'bbox': (10, 10, 40, 40), 'bboxes': [(0, (10, 10, 40, 40))], 'proof_crop': frame[:20, :20]}
+    save_queue = queue.Queue()
+    spool = EvidenceSpool(str(tmp_path), retry_delay=0.01, max_retry_delay=0.02)
+    pipeline = EvidencePipeline(client, save_queue, spool=spool, index=index, drain_timeout=0.2,
+                                metrics_interval=0, logger=MagicMock())
+    pipeline.start()
+    save_queue.put({'records': [record], 'frame_buffer': [(0, frame)], 'fps': 10})
+    save_queue.put(None)
+    pipeline.join()
+
+    metrics = pipeline.metrics()
+    assert metrics['jobs_done'] == 1 and metrics['jobs_failed'] == 0 and metrics['index_failed'] == 1
+    # Every encoded item still reached the spool
+    # Every encoded item still reached the spool: retraining image and label, thumbnail, annotation and clip
+    assert len(EvidenceSpool(str(tmp_path))) == 5
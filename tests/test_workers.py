@@ -0,0 +1,241 @@
+import json
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from unittest.mock import MagicMock
+from core.frame_buffer import FrameRetentionBuffer
+from utils import MinioClient
+from utils.retraining_sampler import RetrainingSampler
+from utils.retraining_shards import RetrainingShardWriter
+from utils.spool import EvidenceSpool
+from utils.workers import EvidencePipeline, encode_violation_job
+
+
+def _job(i, frame, frame_store=None, window=None):
+    record = {'vehicle_id': i, 'identifier': f"PLATE{i}", 'violation_type': "Red Light", 'frame': frame, 'frame_idx': None,
+              'bbox': (10, 10, 40, 40), 'bboxes': [(0, (10, 10, 40, 40))], 'proof_crop': frame[:20, :20]}
+    return {'records': [record], 'frame_store': frame_store, 'window': window, 'frame_buffer': [(0, frame)], 'fps': 10}
+
+
+def _frame(i):
+    # Fixed camera: the same background, a different vehicle in the violation box of every job
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    frame[10:40, 10:40] = np.random.default_rng(i).integers(0, 255, (30, 30, 3), dtype=np.uint8)
+    return frame
+
+
+def _client(monkeypatch):
+    client = MinioClient()
+    s3 = MagicMock()
+    monkeypatch.setattr(client, 's3', s3)
+    return client, s3
+
+
+def test_pipeline_uploads_every_item(monkeypatch):
+    client, s3 = _client(monkeypatch)
+    save_queue = queue.Queue(maxsize=4)
+    pipeline = EvidencePipeline(client, save_queue, encode_workers=2, upload_workers=3,
+                                metrics_interval=0, logger=MagicMock())
+
+    pipeline.start()
+    for i in range(5):
+        save_queue.put(_job(i, _frame(i)))
+    save_queue.put(None)
+    pipeline.join()
+
+    # retraining image + label, thumbnail, proof annotation and clip per job
+    assert s3.upload_fileobj.call_count == 5 * 5
+    metrics = pipeline.metrics()
+    assert metrics['jobs_done'] == 5 and metrics['jobs_failed'] == 0
+    assert metrics['uploads_done'] == 25 and metrics['uploads_failed'] == 0
+    assert metrics['upload_queue_depth'] == 0
+
+
+def test_pipeline_releases_pins_before_uploading(monkeypatch):
+    client, s3 = _client(monkeypatch)
+    uploading = threading.Event()
+    proceed = threading.Event()
+
+    def slow_upload(*args, **kwargs):
+        uploading.set()
+        proceed.wait(5)
+    s3.upload_fileobj.side_effect = slow_upload
+
+    buffer = FrameRetentionBuffer(maxlen=3)
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    for i in range(3):
+        buffer.append((i, frame))
+    window = buffer.pin_window()
+
+    save_queue = queue.Queue()
+    pipeline = EvidencePipeline(client, save_queue, encode_workers=1, upload_workers=1, metrics_interval=0, logger=MagicMock())
+    pipeline.start()
+    save_queue.put(_job(0, frame, frame_store=buffer, window=window))
+    save_queue.join()
+
+    # The job is encoded and its frames are free again while the upload is still in flight
+    assert uploading.wait(5)
+    assert all(buffer.pinned_count(idx) == 0 for idx in window)
+
+    proceed.set()
+    save_queue.put(None)
+    pipeline.join()
+    assert pipeline.metrics()['uploads_done'] == 5
+
+
+def test_pipeline_keeps_failed_uploads_in_the_spool(monkeypatch, tmp_path):
+    client, s3 = _client(monkeypatch)
+    s3.upload_fileobj.side_effect = RuntimeError("connection reset")
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+
+    save_queue = queue.Queue()
+    spool = EvidenceSpool(str(tmp_path), retry_delay=0.01, max_retry_delay=0.02)
+    pipeline = EvidencePipeline(client, save_queue, spool=spool, drain_timeout=0.2, metrics_interval=0, logger=MagicMock())
+    pipeline.start()
+    save_queue.put(_job(0, frame))
+    save_queue.put(None)
+    pipeline.join()
+
+    metrics = pipeline.metrics()
+    assert metrics['uploads_failed'] > 5 and metrics['uploads_done'] == 0
+    assert metrics['bytes_uploaded'] == 0
+    # Retried, never dropped: everything is still there for the next start
+    assert len(EvidenceSpool(str(tmp_path))) == 5
+
+
+def test_pipeline_appends_retraining_samples_to_shards(monkeypatch, tmp_path):
+    client, s3 = _client(monkeypatch)
+    save_queue = queue.Queue()
+    shards = RetrainingShardWriter(str(tmp_path), camera="cam1")
+    pipeline = EvidencePipeline(client, save_queue, shards=shards, metrics_interval=0, logger=MagicMock())
+
+    pipeline.start()
+    jobs = [_job(i, _frame(i)) for i in range(3)]
+    for job in jobs:
+        save_queue.put(job)
+    save_queue.put(None)
+    pipeline.join()
+
+    keys = [c.args[2] for c in s3.upload_fileobj.call_args_list]
+    # frame (referenced by the annotation), thumbnail, annotation and clip per job, then one shard and its manifest
+    assert len(keys) == 3 * 4 + 2
+    assert sum(key.startswith("frames/") for key in keys) == 3
+    assert sum(key.startswith("shards/cam1/") for key in keys) == 2
+    assert sum(key.endswith(".tar") for key in keys) == 1
+    shard_key = next(key for key in keys if key.endswith(".tar"))
+    assert all(job['records'][0]['object_keys']['retraining'].startswith(shard_key + "#images/") for job in jobs)
+
+
+def test_sampler_skips_confident_frames(monkeypatch):
+    client, s3 = _client(monkeypatch)
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    detections = np.array([[10, 10, 40, 40, 0.9, 3], [100, 60, 150, 110, 0.35, 1]])
+    confident = _job(0, frame)
+    confident['records'][0].update(class_id=3, score=0.9, plate_read=True, low_conf_hits=0,
+                                   detections=detections[:1])
+    uncertain = _job(1, frame)
+    uncertain['records'][0].update(class_id=3, score=0.9, plate_read=True, low_conf_hits=0, detections=detections)
+
+    sampler = RetrainingSampler(low_confidence=0.5, class_quota=0)
+    items = encode_violation_job(client, MagicMock(), confident['records'], confident, sampler=sampler)
+    items += encode_violation_job(client, MagicMock(), uncertain['records'], uncertain, sampler=sampler)
+
+    retraining = [item for item in items if item['bucket'] == client.buckets['retraining']]
+    assert [item['key'].rsplit('.', 1)[1] for item in retraining] == ['jpg', 'txt']
+    # Real class ids, every detection of the frame
+    assert [line.split()[0] for line in retraining[1]['body'].decode().splitlines()] == ['3', '1']
+    # The skipped frame is still uploaded for its proof annotation
+    assert sum(item['key'].startswith("frames/") for item in items) == 1
+    assert sampler.stats()['retraining_sampled'] == 1 and sampler.stats()['retraining_skipped'] == 1
+
+
+def test_stalled_feed_frames_are_sampled_once(monkeypatch):
+    client, s3 = _client(monkeypatch)
+    monkeypatch.setattr(client, 'labeled_proofs', 'annotation')
+    frame = _frame(0)
+
+    items = []
+    jobs = [_job(i, frame.copy()) for i in range(3)]
+    for job in jobs:
+        items += encode_violation_job(client, MagicMock(), job['records'], job)
+
+    keys = [item['key'] for item in items]
+    assert sum(key.startswith("train_") for key in keys) == 2  # one image and its label
+    retraining_keys = {job['records'][0]['object_keys']['retraining'] for job in jobs}
+    assert len(retraining_keys) == 1
+    # The annotations reference the stored sample image instead of uploading the frame again
+    assert not any(key.startswith("frames/") for key in keys)
+    annotations = [json.loads(item['body']) for item in items if item['key'].endswith("_labeled.json")]
+    assert len(annotations) == 3 and {a['image']['key'] for a in annotations} == retraining_keys
+    # Thumbnails have the boxes of their own violation
+    assert sum(key.startswith("thumbnails/") for key in keys) == 3
+
+
+def test_different_vehicles_on_a_static_background_are_sampled_apart(monkeypatch):
+    client, s3 = _client(monkeypatch)
+    monkeypatch.setattr(client, 'labeled_proofs', 'annotation')
+    background = cv2.resize(cv2.imread(os.path.join(os.path.dirname(__file__), "..", "assets", "Red Light_1.jpg")), (160, 120))
+
+    jobs = []
+    for i in range(2):
+        frame = background.copy()
+        frame[10:40, 10:40] = np.random.default_rng(i).integers(0, 255, (30, 30, 3), dtype=np.uint8)
+        jobs.append(_job(i, frame))
+    items = []
+    for job in jobs:
+        items += encode_violation_job(client, MagicMock(), job['records'], job)
+
+    assert client.content_store.image_hash(jobs[0]['records'][0]['frame']) == \
+        client.content_store.image_hash(jobs[1]['records'][0]['frame'])
+    retraining = [item for item in items if item['key'].startswith("train_") and item['key'].endswith(".jpg")]
+    assert len(retraining) == 2
+    assert [job['records'][0]['object_keys']['retraining'] for job in jobs] == [item['key'] for item in retraining]
+    # Each annotation references the frame of its own violation
+    annotations = [json.loads(item['body']) for item in items if item['key'].endswith("_labeled.json")]
+    assert [a['image']['key'] for a in annotations] == [item['key'] for item in retraining]
+
+
+def test_proof_crop_is_cut_by_the_worker(monkeypatch):
+    client, _ = _client(monkeypatch)
+    monkeypatch.setattr(client, 'labeled_proofs', 'images')
+    frame = _frame(1)
+    job = _job(1, frame)
+    # Left to the worker by an encoded pre-roll buffer
+    job['records'][0].update(proof_crop=None, crop_box=(5, 10, 45, 30))
+    encode_proof = MagicMock(wraps=client.encode_proof)
+    monkeypatch.setattr(client, 'encode_proof', encode_proof)
+
+    encode_violation_job(client, MagicMock(), job['records'], job)
+
+    np.testing.assert_array_equal(encode_proof.call_args[0][0], frame[10:30, 5:45])
+
+
+def test_postroll_jobs_do_not_block_encoders(monkeypatch):
+    client, s3 = _client(monkeypatch)
+    buffer = FrameRetentionBuffer(maxlen=4)
+    for i in range(2):
+        buffer.append((i, _frame(i)))
+    save_queue = queue.Queue()
+    pipeline = EvidencePipeline(client, save_queue, encode_workers=1, upload_workers=1,
+                                metrics_interval=0, postroll_poll=0.01, logger=MagicMock())
+    pipeline.start()
+
+    # Post-roll up to frame 5, not captured yet
+    save_queue.put(_job(0, _frame(10), buffer, buffer.pin_window() + buffer.reserve(2, 5)))
+    save_queue.put(_job(1, _frame(11)))
+    deadline = time.time() + 2
+    while pipeline.metrics()['jobs_done'] < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    metrics = pipeline.metrics()
+    assert metrics['jobs_done'] == 1 and metrics['postroll_waiting'] == 1
+
+    for i in range(2, 6):
+        buffer.append((i, _frame(i)))
+    save_queue.put(None)
+    pipeline.join()
+
+    assert pipeline.metrics()['jobs_done'] == 2
+    assert all(buffer.pinned_count(i) == 0 for i in range(6))
@@ -0,0 +1,81 @@
+import numpy as np
+import supervision as sv
+from utils.zones import ZONE_MAP_CACHE_SIZE, ZoneMap, _compile_zone_map, build_zone_map
+
+
+def _detections(centers, size=10):
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    return sv.Detections(xyxy=np.hstack([centers - size / 2, centers + size / 2]))
+
+
+def test_zone_map_matches_polygon_zone():
+    polygon = np.array([[50, 40], [300, 60], [280, 250], [70, 220]])
+    zone_map = ZoneMap({"polygon": polygon})
+    polygon_zone = sv.PolygonZone(polygon, triggering_anchors=[sv.Position.CENTER])
+
+    # Boxes well inside the polygon bounds, so PolygonZone does not clip them
+    centers = np.random.default_rng(0).uniform(20, 280, size=(500, 2))
+    detections = _detections(centers)
+    np.testing.assert_array_equal(zone_map.contains(detections, "polygon"), polygon_zone.trigger(detections))
+
+
+def test_one_bit_per_zone():
+    zone_map = ZoneMap({
+        "a": [[0, 0], [100, 0], [100, 100], [0, 100]],
+        "b": [[50, 50], [150, 50], [150, 150], [50, 150]],
+    })
+    labels = zone_map.lookup([[25, 25], [75, 75], [125, 125], [500, 500], [-10, 10]])
+    assert labels.tolist() == [1, 3, 2, 0, 0]
+
+    detections = _detections([[25, 25], [75, 75], [125, 125]])
+    assert zone_map.contains(detections, "a").tolist() == [True, True, False]
+    assert zone_map.contains(detections, "b").tolist() == [False, True, True]
+    assert zone_map.contains(detections).tolist() == [True, True, True]
+
+
+def test_downsampled_zone_map():
+    zone_map = ZoneMap({"polygon": [[100, 100], [500, 100], [500, 500], [100, 500]]}, scale=0.25)
+    assert zone_map.labels.shape == (101, 101)
+    assert zone_map.contains(_detections([[300, 300], [600, 300], [50, 50]]), "polygon").tolist() == [True, False, False]
+
+
+def test_empty_detections():
+    zone_map = ZoneMap({"polygon": [[0, 0], [10, 0], [10, 10]]})
+    assert zone_map.contains(sv.Detections.empty(), "polygon").shape == (0,)
+
+
+def test_build_zone_map_is_cached():
+    zones = {"polygon": [[0, 0], [10, 0], [10, 10]]}
+    assert build_zone_map(zones) is build_zone_map({"polygon": np.array(zones["polygon"])})
+    assert build_zone_map(zones) is not build_zone_map(zones, scale=0.5)
+
+
+def test_zone_map_cache_is_bounded():
+    first = build_zone_map({"polygon": [[0, 0], [10, 0], [10, 10]]})
+    # Zones edited over and over in the app
+    for i in range(ZONE_MAP_CACHE_SIZE):
+        build_zone_map({"polygon": [[0, 0], [20 + i, 0], [20 + i, 20]]})
+    assert _compile_zone_map.cache_info().currsize <= ZONE_MAP_CACHE_SIZE
+    assert build_zone_map({"polygon": [[0, 0], [10, 0], [10, 10]]}) is not first
+
+
+def test_margin_grows_zone():
+    square = [[100, 100], [200, 100], [200, 200], [100, 200]]
+    grown = ZoneMap({"polygon": square}, margin=20)
+    points = [[150, 150], [90, 150], [150, 215], [75, 150], [84, 84]]
+    assert (grown.lookup(points) != 0).tolist() == [True, True, True, False, False]
+    assert (ZoneMap({"polygon": square}).lookup(points) != 0).tolist() == [True, False, False, False, False]
+
+
+def test_filter_detections_in_zone():
+    from detect.utils import filter_detections_in_zone
+
+    zone_map = build_zone_map({"polygon": [[100, 100], [200, 100], [200, 200], [100, 200]]}, margin=20)
+    det = np.array([
+        [140, 140, 160, 160, 0.9, 2],  # inside
+        [80, 140, 100, 160, 0.8, 2],   # center in the margin
+        [0, 0, 20, 20, 0.7, 3],        # far away
+    ])
+    np.testing.assert_array_equal(filter_detections_in_zone(det, zone_map), det[:2])
+    assert filter_detections_in_zone(det, None) is det
+    assert filter_detections_in_zone(np.empty((0, 6)), zone_map).shape == (0, 6)
@@ -57,11 +57,13 @@ class BaseTracker:
 
         for m in matched:
             self.trackers[m[1]].update(dets[m[0], :4])
+            self.trackers[m[1]].score = float(dets[m[0], 4])
 
         for i in unmatched_dets:
             bbox = dets[i, :4]
             class_id = int(dets[i, 5])
             tracker = self.tracker_class(bbox, class_id=class_id)
+            tracker.score = float(dets[i, 4])
             self.trackers.append(tracker)
 
         i = len(self.trackers)
@@ -130,13 +130,19 @@ class ByteTrack(BaseTracker):
         matched, unmatched_dets, unmatched_trks = self._associate_detections_to_trackers(dets, tracks)
 
         for m in matched:
-            self.trackers[m[1]].update(dets[m[0], :4])
+            tracker = self.trackers[m[1]]
+            tracker.update(dets[m[0], :4])
+            tracker.score = float(dets[m[0], 4])
+            if tracker.score < self.high_conf_threshold:
+                # Kept alive by the second association stage
+                tracker.low_conf_hits += 1
 
         for i in unmatched_dets:
             if dets[i, 4] >= self.high_conf_threshold:
                 bbox = dets[i, :4]
                 class_id = int(dets[i, 5])
                 tracker = self.tracker_class(bbox, class_id=class_id)
+                tracker.score = float(dets[i, 4])
                 self.trackers.append(tracker)
 
         i = len(self.trackers)
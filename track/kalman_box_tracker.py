@@ -47,6 +47,8 @@ class KalmanBoxTracker:
         self.time_since_update = 0
         self.id = KalmanBoxTracker.count
         self.class_id = class_id
+        self.score = None           # confidence of the last matched detection
+        self.low_conf_hits = 0      # updates that came from a low confidence (second-stage) match
         KalmanBoxTracker.count += 1
         self.history = []
         self.hits = 0
@@ -8,10 +8,12 @@ This module re-exports commonly used utilities for convenient imports.
 from utils.config import load_config, save_config
 
 # Zone management
-from utils.zones import load_zones, save_zones
+from utils.zones import load_zones, save_zones, ZoneMap, build_zone_map
 
 # Storage
 from utils.storage import MinioClient
+from utils.storage_backends import StorageBackend, S3Backend, LocalBackend
+from utils.violation_index import ViolationIndex
 
 # Logging
 from utils.logger import (
@@ -42,9 +44,9 @@ __all__ = [
     # Config
     'load_config', 'save_config',
     # Zones
-    'load_zones', 'save_zones',
+    'load_zones', 'save_zones', 'ZoneMap', 'build_zone_map',
     # Storage
-    'MinioClient',
+    'MinioClient', 'StorageBackend', 'S3Backend', 'LocalBackend', 'ViolationIndex',
     # Logging
     'get_logger', 'get_system_logger', 'log_violation', 'log_performance', 'log_upload',
     # Drawing
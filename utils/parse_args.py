@@ -58,6 +58,12 @@ def parse_args_tracking():
         choices=['True', 'False'],
         help='Enable traffic light detection.'
     )
+    parser.add_argument(
+        '--light_feed',
+        type=str,
+        default=None,
+        help='Traffic controller phase feed (udp://host:port or path to a newline-JSON file/pipe). Replaces light detection.'
+    )
     args = parser.parse_args()
     return args
 
@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from utils.spool import MB
+
+
+def retraining_labels(records, label_confidence=0.25):
+    """
+    YOLO labels of a violation frame: [(class_id, (x1, y1, x2, y2)), ...]
+
+    Every detection of the frame (record['detections'], shared by the records of one frame) scoring at
+    least label_confidence, plus the box of each violating vehicle no detection covers (it was tracked
+    through a weaker match). Without detections, the boxes and classes of the records only.
+    """
+    detections = next((record['detections'] for record in records if record.get('detections') is not None), None)
+    labels = []
+    if detections is not None:
+        detections = np.asarray(detections, dtype=float).reshape(-1, 6)
+        labels = [(int(det[5]), tuple(det[:4])) for det in detections if det[4] >= label_confidence]
+
+    for record in records:
+        bbox = tuple(float(v) for v in record['bbox'])
+        if not any(_iou(bbox, box) >= 0.5 for _, box in labels):
+            labels.append((int(record.get('class_id') or 0), bbox))
+    return labels
+
+
+def _iou(a, b):
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+
+class RetrainingSampler:
+    """
+    Decides which violation frames are worth a retraining sample.
+
+    A frame is kept when the model needed help on it:
+        'low_confidence'     a violating vehicle or any detection of the frame scored below low_confidence
+        'second_stage'       a violating vehicle was kept alive by ByteTrack low confidence matches
+        'plate_unread'       the license plate of a violating vehicle was not read
+        'class_quota:<id>'   a labeled class has fewer than class_quota samples today
+    and the bytes sampled today are still under daily_budget. The day's usage is saved to state_path
+    (if given) so a restart does not reset the budget.
+    """
+
+    def __init__(self, low_confidence=0.5, label_confidence=0.25, class_quota=100, daily_budget=512 * MB,
+                 state_path=None):
+        self.low_confidence = low_confidence
+        self.label_confidence = label_confidence
+        self.class_quota = class_quota
+        self.daily_budget = daily_budget
+        self.state_path = state_path
+
+        self._lock = threading.Lock()
+        self.day = None
+        self.bytes = 0
+        self.class_counts = {}
+        self.sampled = 0
+        self.skipped = 0
+        if state_path is not None and os.path.exists(state_path):
+            self._load()
+
+    @staticmethod
+    def _today(now):
+        return datetime.fromtimestamp(now).strftime("%Y-%m-%d")
+
+    def _roll_day(self, now):
+        day = self._today(now)
+        if day != self.day:
+            self.day = day
+            self.bytes = 0
+            self.class_counts = {}
+
+    def labels(self, records):
+        return retraining_labels(records, self.label_confidence)
+
+    def reasons(self, records, labels, now=None):
+        """Why the frame is informative, [] if it is not (the budget is not checked)"""
+        now = time.time() if now is None else now
+        reasons = []
+        detections = next((record['detections'] for record in records if record.get('detections') is not None), None)
+        scores = [record['score'] for record in records if record.get('score') is not None]
+        if detections is not None and len(detections):
+            scores += list(np.asarray(detections, dtype=float).reshape(-1, 6)[:, 4])
+        if any(score < self.low_confidence for score in scores):
+            reasons.append('low_confidence')
+        if any(record.get('low_conf_hits') for record in records):
+            reasons.append('second_stage')
+        if any(record.get('plate_read') is False for record in records):
+            reasons.append('plate_unread')
+
+        with self._lock:
+            self._roll_day(now)
+            for class_id in sorted({class_id for class_id, _ in labels}):
+                if self.class_counts.get(class_id, 0) < self.class_quota:
+                    reasons.append(f"class_quota:{class_id}")
+        return reasons
+
+    def admit(self, records, labels, nbytes=None, now=None):
+        """
+        Reasons to sample the frame, [] if it is skipped (not informative or over today's budget).
+
+        Without nbytes this only checks, before the sample is encoded. With the size of the encoded sample
+        the budget is checked and charged under one lock, so concurrent encoders cannot overshoot it.
+        """
+        now = time.time() if now is None else now
+        reasons = self.reasons(records, labels, now)
+        with self._lock:
+            self._roll_day(now)
+            if not reasons or self.bytes >= self.daily_budget or self.bytes + (nbytes or 0) > self.daily_budget:
+                self.skipped += 1
+                return []
+            if nbytes is None:
+                return reasons
+            self.bytes += nbytes
+            for class_id, _ in labels:
+                self.class_counts[class_id] = self.class_counts.get(class_id, 0) + 1
+            self.sampled += 1
+            state = {'day': self.day, 'bytes': self.bytes, 'class_counts': dict(self.class_counts)}
+        self._save(state)
+        return reasons
+
+    def _save(self, state):
+        if self.state_path is None:
+            return
+        try:
+            tmp_path = self.state_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            print(f"\nFailed to save retraining sampler state: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {'retraining_sampled': self.sampled, 'retraining_skipped': self.skipped,
+                    'retraining_bytes_today': self.bytes}
+
+    def _load(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"\nFailed to load retraining sampler state from {self.state_path}: {e}")
+            return
+        self.day = state.get('day')
+        self.bytes = state.get('bytes', 0)
+        self.class_counts = {int(class_id): count for class_id, count in state.get('class_counts', {}).items()}
@@ -0,0 +1,173 @@
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from utils.spool import MB
+
+
+class RetrainingShardWriter:
+    """
+    Appends retraining samples to rolling tar shards instead of storing two small objects per sample.
+
+    A shard is a plain tar of YOLO members, images/<name>.jpg and labels/<name>.txt, written locally
+    under <directory>/open/ and closed once it reaches max_bytes or is max_age seconds old. A closed
+    shard becomes two upload items in the retraining bucket:
+        <prefix>/<camera>/<shard>.tar   the samples
+        <prefix>/<camera>/<shard>.json  its manifest: {'key', 'samples', 'bytes', 'started', 'closed', 'members'}
+    and its manifest is appended to <directory>/manifest.jsonl. Shards left open by a crash are
+    repacked with their complete samples and closed on the next start.
+
+    Safe to share between encode threads. See detect.utils.extract_retraining_shards for the reader.
+    """
+    CONTENT_TYPE = 'application/x-tar'
+
+    def __init__(self, directory="retraining_shards", bucket="retraining-data", prefix="shards", camera=None,
+                 max_bytes=64 * MB, max_age=3600):
+        self.directory = directory
+        self.bucket = bucket
+        self.prefix = f"{prefix}/{camera or 'cam0'}"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._tar = None
+        self._name = None
+        self._members = []
+        self._bytes = 0
+        self._started = None
+        self._closed_items = []   # closed but not handed out yet
+
+        os.makedirs(os.path.join(directory, 'open'), exist_ok=True)
+        self._recover()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.jsonl')
+
+    def _open_path(self, name):
+        return os.path.join(self.directory, 'open', f"{name}.tar")
+
+    def _shard_key(self, name):
+        return f"{self.prefix}/{name}.tar"
+
+    def add(self, image_item, label_item, now=None):
+        """
+        Append one sample, the image and label upload items of MinioClient.encode_retraining_data.
+
+        Returns:
+            tuple: ('<shard key>#images/<name>.jpg' reference of the sample,
+                    upload items of the shards closed meanwhile)
+        """
+        now = time.time() if now is None else now
+        stem = os.path.splitext(os.path.basename(image_item['key']))[0]
+        with self._lock:
+            self._roll(now)
+            if self._tar is None:
+                self._start(now)
+            image_member = f"images/{stem}.jpg"
+            self._add_member(image_member, image_item['body'], now)
+            self._add_member(f"labels/{stem}.txt", label_item['body'], now)
+            self._members.append(stem)
+            reference = f"{self._shard_key(self._name)}#{image_member}"
+            if self._bytes >= self.max_bytes:
+                self._close()
+            return reference, self._take_closed()
+
+    def roll(self, now=None):
+        """Close the open shard if it is older than max_age, returns the upload items of closed shards"""
+        with self._lock:
+            self._roll(time.time() if now is None else now)
+            return self._take_closed()
+
+    def close(self):
+        """Close the open shard whatever its size or age, returns the upload items of closed shards"""
+        with self._lock:
+            self._close()
+            return self._take_closed()
+
+    def _roll(self, now):
+        if self._tar is not None and now - self._started >= self.max_age:
+            self._close()
+
+    def _take_closed(self):
+        items, self._closed_items = self._closed_items, []
+        return items
+
+    def _start(self, now):
+        self._name = f"{datetime.fromtimestamp(now).strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self._tar = tarfile.open(self._open_path(self._name), 'w')
+        self._members = []
+        self._bytes = 0
+        self._started = now
+
+    def _add_member(self, name, body, now):
+        info = tarfile.TarInfo(name)
+        info.size = len(body)
+        info.mtime = int(now)
+        self._tar.addfile(info, io.BytesIO(body))
+        self._tar.fileobj.flush()
+        self._bytes += tarfile.BLOCKSIZE + -(-len(body) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+    def _close(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        self._tar = None
+        path = self._open_path(self._name)
+        if self._members:
+            self._closed_items += self._shard_items(path, self._name, self._members, self._started, time.time())
+        os.remove(path)
+
+    def _shard_items(self, path, name, members, started, closed):
+        with open(path, 'rb') as f:
+            body = f.read()
+        key = self._shard_key(name)
+        manifest = {'key': key, 'samples': len(members), 'bytes': len(body),
+                    'started': started, 'closed': closed, 'members': members}
+        with open(self.manifest_path, 'a') as f:
+            f.write(json.dumps(manifest) + "\n")
+        return [
+            {'bucket': self.bucket, 'key': key, 'body': body, 'content_type': self.CONTENT_TYPE},
+            {'bucket': self.bucket, 'key': f"{self.prefix}/{name}.json",
+             'body': json.dumps(manifest).encode(), 'content_type': 'application/json'},
+        ]
+
+    def _recover(self):
+        """Repack the complete samples of the shards a previous run left open"""
+        open_dir = os.path.join(self.directory, 'open')
+        for filename in sorted(os.listdir(open_dir)):
+            if not filename.endswith('.tar'):
+                continue
+            name = filename[:-len('.tar')]
+            path = os.path.join(open_dir, filename)
+            bodies = {}
+            try:
+                with tarfile.open(path, 'r') as tar:
+                    for info in tar:
+                        data = tar.extractfile(info)
+                        if data is not None:
+                            bodies[info.name] = data.read()
+            except (tarfile.TarError, OSError, EOFError):
+                # Torn last member of a crash
+                pass
+
+            stems = [member[len('images/'):-len('.jpg')] for member in bodies
+                     if member.startswith('images/') and f"labels/{member[len('images/'):-len('.jpg')]}.txt" in bodies]
+            if stems:
+                started = os.path.getmtime(path)
+                with tarfile.open(path + '.tmp', 'w') as tar:
+                    for stem in stems:
+                        for member in (f"images/{stem}.jpg", f"labels/{stem}.txt"):
+                            info = tarfile.TarInfo(member)
+                            info.size = len(bodies[member])
+                            info.mtime = int(started)
+                            tar.addfile(info, io.BytesIO(bodies[member]))
+                os.replace(path + '.tmp', path)
+                self._closed_items += self._shard_items(path, name, stems, started, time.time())
+                print(f"\nRetraining shards: recovered {len(stems)} samples of {filename}")
+            os.remove(path)
@@ -0,0 +1,235 @@
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+MB = 1024 * 1024
+
+
+class EvidenceSpool:
+    """
+    Durable queue of encoded evidence waiting for upload.
+
+    put() takes upload items ({'bucket', 'key', 'body', 'content_type', 'log'}), get() hands them to
+    the upload workers, which call done() after a successful upload or retry() to try again later
+    with exponential backoff. Nothing is dropped on failure.
+
+    With a directory, every body is written to <directory>/objects/<id> and the item is appended to
+    <directory>/manifest.jsonl ({"op": "add", ...} / {"op": "done", "id": ...}), so a restarted
+    process picks up whatever was not uploaded. Bodies stay in memory only up to memory_limit bytes,
+    the rest is read back from disk when its turn comes: put() never waits for the network.
+
+    Without a directory the spool is memory-only and put() blocks while memory_limit is reached,
+    which bounds memory by slowing the encoders down instead.
+    """
+
+    def __init__(self, directory=None, memory_limit=64 * MB, retry_delay=1.0, max_retry_delay=60.0):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._cond = threading.Condition()
+        self._entries = {}       # id -> item without body, plus 'attempts'
+        self._bodies = {}        # id -> body, for the bodies held in memory
+        self._memory_bytes = 0
+        self._ready = deque()    # ids to upload now
+        self._delayed = []       # heap of (retry time, id)
+        self._in_flight = set()
+        self._closed = False
+        self._manifest = None
+
+        if directory is not None:
+            os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+            self._recover()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.jsonl')
+
+    def _object_path(self, entry_id):
+        return os.path.join(self.directory, 'objects', entry_id)
+
+    def _recover(self):
+        """Load the items a previous run left in the manifest, then compact it"""
+        pending = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line of a crash
+                        continue
+                    if record['op'] == 'add':
+                        pending[record['id']] = record
+                    elif record['op'] == 'done':
+                        pending.pop(record['id'], None)
+
+        for entry_id, record in pending.items():
+            path = self._object_path(entry_id)
+            if not os.path.exists(path) or os.path.getsize(path) != record['size']:
+                print(f"\nSpool: body of {record['key']} is missing, skipping it")
+                continue
+            entry = {key: record[key] for key in ('id', 'bucket', 'key', 'content_type', 'size')}
+            entry['log'] = tuple(record['log']) if record.get('log') else None
+            entry['attempts'] = 0
+            self._entries[entry_id] = entry
+            self._ready.append(entry_id)
+
+        # Bodies nobody refers to any more
+        for name in os.listdir(os.path.join(self.directory, 'objects')):
+            if name not in self._entries:
+                os.remove(self._object_path(name))
+
+        self._rewrite_manifest()
+        if self._entries:
+            print(f"\nSpool: recovered {len(self._entries)} pending uploads from {self.directory}")
+
+    def _rewrite_manifest(self):
+        self._close_manifest()
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in self._entries.values():
+                f.write(self._manifest_line('add', entry))
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest = open(self.manifest_path, 'a')
+
+    @staticmethod
+    def _manifest_line(op, entry):
+        if op == 'done':
+            return json.dumps({'op': 'done', 'id': entry['id']}) + "\n"
+        record = {key: entry[key] for key in ('id', 'bucket', 'key', 'content_type', 'size')}
+        record['op'] = 'add'
+        record['log'] = list(entry['log']) if entry.get('log') else None
+        return json.dumps(record) + "\n"
+
+    def __len__(self):
+        """Items not uploaded yet, including the ones being uploaded"""
+        with self._cond:
+            return len(self._entries)
+
+    @property
+    def memory_bytes(self):
+        return self._memory_bytes
+
+    def put(self, item):
+        body = item['body']
+        entry = {
+            'id': uuid.uuid4().hex,
+            'bucket': item['bucket'],
+            'key': item['key'],
+            'content_type': item['content_type'],
+            'size': len(body),
+            'log': item.get('log'),
+            'attempts': 0,
+        }
+
+        if self.directory is not None:
+            # Body first: a manifest line always points to a complete file
+            with open(self._object_path(entry['id']), 'wb') as f:
+                f.write(body)
+
+        with self._cond:
+            if self.directory is None:
+                while self._memory_bytes > 0 and self._memory_bytes + len(body) > self.memory_limit and not self._closed:
+                    self._cond.wait()
+            if self._manifest is not None:
+                self._manifest.write(self._manifest_line('add', entry))
+                self._manifest.flush()
+            if self.directory is None or self._memory_bytes + len(body) <= self.memory_limit:
+                self._bodies[entry['id']] = body
+                self._memory_bytes += len(body)
+            self._entries[entry['id']] = entry
+            self._ready.append(entry['id'])
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Next item to upload, with its body, or None once the spool is closed (or on timeout)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._delayed)[1])
+                if self._closed:
+                    return None
+                if self._ready:
+                    entry_id = self._ready.popleft()
+                    self._in_flight.add(entry_id)
+                    entry = dict(self._entries[entry_id])
+                    body = self._bodies.get(entry_id)
+                    break
+
+                wait = None if deadline is None else deadline - now
+                if self._delayed:
+                    until_retry = self._delayed[0][0] - now
+                    wait = until_retry if wait is None else min(wait, until_retry)
+                if wait is not None and wait <= 0:
+                    return None
+                self._cond.wait(wait)
+
+        if body is None:
+            with open(self._object_path(entry_id), 'rb') as f:
+                body = f.read()
+        entry['body'] = body
+        return entry
+
+    def done(self, entry):
+        """The item was uploaded, forget it"""
+        entry_id = entry['id']
+        with self._cond:
+            self._in_flight.discard(entry_id)
+            self._entries.pop(entry_id, None)
+            self._memory_bytes -= len(self._bodies.pop(entry_id, b""))
+            if self._manifest is not None:
+                self._manifest.write(self._manifest_line('done', entry))
+                self._manifest.flush()
+                if not self._entries and not self._closed:
+                    # Nothing pending, start a fresh manifest
+                    self._rewrite_manifest()
+                elif self._closed and not self._in_flight:
+                    self._close_manifest()
+            self._cond.notify_all()
+        if self.directory is not None and os.path.exists(self._object_path(entry_id)):
+            os.remove(self._object_path(entry_id))
+
+    def retry(self, entry):
+        """The upload failed, try again after a backoff"""
+        with self._cond:
+            stored = self._entries[entry['id']]
+            stored['attempts'] += 1
+            delay = min(self.retry_delay * 2 ** (stored['attempts'] - 1), self.max_retry_delay)
+            self._in_flight.discard(entry['id'])
+            heapq.heappush(self._delayed, (time.monotonic() + delay, entry['id']))
+            self._cond.notify_all()
+
+    def wait_empty(self, timeout=None):
+        """Wait until every item is uploaded. Returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._entries:
+                wait = None if deadline is None else deadline - time.monotonic()
+                if wait is not None and wait <= 0:
+                    return False
+                self._cond.wait(wait)
+            return True
+
+    def close(self):
+        """Wake up every waiting get()/put(), pending items stay on disk for the next run"""
+        with self._cond:
+            self._closed = True
+            if not self._in_flight:
+                # Otherwise the last done() closes it
+                self._close_manifest()
+            self._cond.notify_all()
+
+    def _close_manifest(self):
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
@@ -1,22 +1,37 @@
-import boto3
 from botocore.exceptions import NoCredentialsError
 import os
+import json
+import threading
+import time
 import cv2
 import numpy as np
-from io import BytesIO
+from collections import OrderedDict
 from datetime import datetime
 from dotenv import load_dotenv
+from utils.storage_backends import make_backend
+from utils.video_encoder import ProofVideoEncoder, bbox_track
 
 class MinioClient:
+    """
+    Evidence storage client: encodes evidence into upload items and stores them through a StorageBackend
+    (S3/MinIO or the local filesystem, selected by storage.backend).
+
+    MinioClient() is the shared instance built from the config. MinioClient(backend) is a separate
+    client over the given backend, e.g. a LocalBackend for tests and benchmarks.
+    """
     _instance = None
 
-    def __new__(cls):
+    def __new__(cls, backend=None):
+        if backend is not None:
+            client = super(MinioClient, cls).__new__(cls)
+            client._initialize(backend)
+            return client
         if cls._instance is None:
             cls._instance = super(MinioClient, cls).__new__(cls)
             cls._instance._initialize()
         return cls._instance
 
-    def _initialize(self):
+    def _initialize(self, backend=None):
         load_dotenv()
         self.endpoint_url = "http://localhost:9000"
         self.access_key = "minioadmin"
@@ -28,23 +43,48 @@ class MinioClient:
         self.access_key = os.environ.get("MINIO_ACCESS_KEY", "minioadmin")
         self.secret_key = os.environ.get("MINIO_SECRET_KEY", "minioadmin")
 
-        self.s3 = boto3.client(
-            's3',
-            endpoint_url=self.endpoint_url,
-            aws_access_key_id=self.access_key,
-            aws_secret_access_key=self.secret_key
-        )
+        storage_config = self._load_storage_config()
+        self.backend = backend or make_backend(storage_config, self.endpoint_url, self.access_key, self.secret_key)
+        # 'annotation': labeled proofs and crops reference the retraining image and are rendered on read,
+        # 'rendered': they are drawn and encoded as JPEGs of their own
+        self.labeled_proofs = storage_config.get('labeled_proofs', 'annotation')
+        self.thumbnail_size = storage_config.get('thumbnail_size', 320)
+        self.video_settings = {key: value for key, value in storage_config.items() if key.startswith('video_')}
+        # Retraining samples of a stalled feed are stored once and referenced by key
+        self.content_store = ContentStore(window=storage_config.get('dedup_window', 512),
+                                          max_distance=storage_config.get('dedup_distance', 0),
+                                          max_pixel_diff=storage_config.get('dedup_pixel_diff', 4.0))
         self.buckets = {
             'proofs': 'proofs',
             'retraining': 'retraining-data',
             'models': 'models'
         }
 
+    @property
+    def s3(self):
+        """boto3 client of the S3 backend"""
+        return self.backend.s3
+
+    @s3.setter
+    def s3(self, s3):
+        self.backend.s3 = s3
+
+    def ensure_buckets(self):
+        self.backend.ensure_buckets(self.buckets.values())
+
+    @staticmethod
+    def _load_storage_config():
+        try:
+            from utils.config import load_config
+            return load_config().get('storage') or {}
+        except Exception:
+            return {}
+
     def upload_file(self, file_path, bucket_name, object_name=None):
         if object_name is None:
             object_name = os.path.basename(file_path)
         try:
-            self.s3.upload_file(file_path, bucket_name, object_name)
+            self.backend.put_file(file_path, bucket_name, object_name)
             print(f"\nFile {file_path} uploaded to {bucket_name}/{object_name}")
             return True
         except FileNotFoundError:
@@ -65,133 +105,505 @@ class MinioClient:
                 print("\nFailed to encode image")
                 return False
             
-            io_buf = BytesIO(buffer)
-            self.s3.upload_fileobj(io_buf, bucket_name, object_name, ExtraArgs={'ContentType': 'image/jpeg'})
+            self.backend.put(bucket_name, object_name, buffer.tobytes(), 'image/jpeg')
             print(f"\nImage uploaded to {bucket_name}/{object_name}")
             return True
         except Exception as e:
             print(f"\nError uploading image: {e}")
             return False
 
-    def save_proof(self, frame, vehicle_id, violation_type):
+    def upload_bytes(self, data, bucket_name, object_name, content_type='application/octet-stream'):
         """
-        Save violation proof to MinIO
+        Upload already encoded bytes to storage
+        """
+        try:
+            self.backend.put(bucket_name, object_name, data, content_type)
+            print(f"\nFile uploaded to {bucket_name}/{object_name}")
+            return True
+        except Exception as e:
+            print(f"\nError uploading {object_name}: {e}")
+            return False
+
+    def upload(self, item):
+        """
+        Upload one item produced by the encode_* methods
+        """
+        return self.upload_bytes(item['body'], item['bucket'], item['key'], item['content_type'])
+
+    def upload_all(self, items):
+        return [self.upload(item) for item in items]
+
+    # Encoding and uploading are split so they can run in separate worker pools (see utils.workers).
+    # The encode_* methods do all the CPU work and return upload items:
+    #   {'bucket': str, 'key': str, 'body': bytes, 'content_type': str}
+
+    @staticmethod
+    def _encode_jpeg(image_np):
+        is_success, buffer = cv2.imencode(".jpg", image_np)
+        if not is_success:
+            print("\nFailed to encode image")
+            return None
+        return buffer.tobytes()
+
+    def encode_proof(self, frame, vehicle_id, violation_type):
+        """
+        Encode the violation proof crop
         """
         time_now = datetime.now()
         date_folder = time_now.strftime("%Y_%m")
         timestamp = time_now.strftime("%Y%m%d_%H%M%S")
         filename = f"{date_folder}/{violation_type}_{vehicle_id}_{timestamp}.jpg"
-        return self.upload_image_from_memory(frame, self.buckets['proofs'], filename)
 
-    def save_retraining_data(self, frame, vehicle_id, bbox):
+        body = self._encode_jpeg(frame)
+        if body is None:
+            return []
+        return [{'bucket': self.buckets['proofs'], 'key': filename, 'body': body, 'content_type': 'image/jpeg'}]
+
+    def encode_retraining_data(self, frame, vehicle_id, bbox, class_ids=None):
         """
-        Save retraining data (full frame + label info)
-        For now, just saving the frame. In real scenario, we'd save a corresponding .txt label.
+        Encode retraining data (full frame + label info)
+        bbox is one (x1, y1, x2, y2) box or a list of them when several vehicles share the frame,
+        class_ids their class ids (0 for every box if None).
         """
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"train_{vehicle_id}_{timestamp}.jpg"
-        
-        # Upload image
-        if self.upload_image_from_memory(frame, self.buckets['retraining'], filename):
-            # Create and upload label (dummy example for YOLO format)
-            # class x_center y_center width height
-            h, w, _ = frame.shape
-            x1, y1, x2, y2 = bbox
-            
+
+        body = self._encode_jpeg(frame)
+        if body is None:
+            return []
+
+        # Create label (YOLO format)
+        # class x_center y_center width height
+        h, w, _ = frame.shape
+        boxes = np.asarray(bbox, dtype=float).reshape(-1, 4)
+        if class_ids is None:
+            class_ids = [0] * len(boxes)
+
+        label_lines = []
+        for class_id, (x1, y1, x2, y2) in zip(class_ids, boxes):
             # Normalize coordinates
             xc = ((x1 + x2) / 2) / w
             yc = ((y1 + y2) / 2) / h
             bw = (x2 - x1) / w
             bh = (y2 - y1) / h
-            
-            label_content = f"0 {xc:.6f} {yc:.6f} {bw:.6f} {bh:.6f}"
-            label_filename = filename.replace(".jpg", ".txt")
-            
-            try:
-                self.s3.put_object(
-                    Bucket=self.buckets['retraining'],
-                    Key=label_filename,
-                    Body=label_content
-                )
-                print(f"\nLabel uploaded to {self.buckets['retraining']}/{label_filename}")
-                return True
-            except Exception as e:
-                print(f"\nError uploading label: {e}")
-                return False
-        return False
+            label_lines.append(f"{int(class_id)} {xc:.6f} {yc:.6f} {bw:.6f} {bh:.6f}")
+        label_content = "\n".join(label_lines)
+        label_filename = filename.replace(".jpg", ".txt")
 
-    def save_labeled_proof(self, frame, vehicle_id, violation_type, bbox):
+        return [
+            {'bucket': self.buckets['retraining'], 'key': filename, 'body': body, 'content_type': 'image/jpeg'},
+            {'bucket': self.buckets['retraining'], 'key': label_filename, 'body': label_content.encode(), 'content_type': 'text/plain'}
+        ]
+
+    def encode_frame(self, frame, vehicle_id, body=None):
         """
-        Save a full frame with the bounding box drawn on it as proof.
+        Encode the full frame into the proofs bucket (frames/ prefix), the image proof annotations reference
+        when there is no retraining image object. body reuses an already encoded JPEG of the frame.
+        """
+        time_now = datetime.now()
+        filename = f"frames/{time_now.strftime('%Y_%m')}/{vehicle_id}_{time_now.strftime('%Y%m%d_%H%M%S')}.jpg"
+        if body is None:
+            body = self._encode_jpeg(frame)
+        if body is None:
+            return []
+        return [{'bucket': self.buckets['proofs'], 'key': filename, 'body': body, 'content_type': 'image/jpeg'}]
+
+    def encode_labeled_proofs(self, frame, records):
+        """
+        Encode one labeled frame for several vehicles that violated on it.
+
+        All boxes are drawn on a single copy of the frame, which is encoded once and returned
+        under the key of every record ({'identifier', 'violation_type', 'bbox'}), in record order.
         """
         time_now = datetime.now()
         date_folder = time_now.strftime("%Y_%m")
         timestamp = time_now.strftime("%Y%m%d_%H%M%S")
-        filename = f"{date_folder}/{violation_type}_{vehicle_id}_{timestamp}_labeled.jpg"
-        
-        # Draw bbox
+
+        # Draw bboxes
         labeled_frame = frame.copy()
-        x1, y1, x2, y2 = map(int, bbox)
-        cv2.rectangle(labeled_frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-        cv2.putText(labeled_frame, f"ID: {vehicle_id} {violation_type}", (x1, y1 - 10), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
-        
-        return self.upload_image_from_memory(labeled_frame, self.buckets['proofs'], filename)
+        for record in records:
+            self._draw_violation_box(labeled_frame, record['bbox'], record['identifier'], record['violation_type'])
 
-    def save_video_proof(self, frames, vehicle_id, violation_type, bboxes, fps=30):
+        body = self._encode_jpeg(labeled_frame)
+        if body is None:
+            return []
+
+        items = []
+        for record in records:
+            filename = f"{date_folder}/{record['violation_type']}_{record['identifier']}_{timestamp}_labeled.jpg"
+            items.append({'bucket': self.buckets['proofs'], 'key': filename, 'body': body, 'content_type': 'image/jpeg'})
+        return items
+
+    def encode_thumbnail(self, frame, vehicle_id, records=()):
         """
-        Save a video clip as proof.
+        Encode a small copy of the frame for the gallery, under the thumbnails/ prefix of the proofs bucket.
+
+        The longest side is scaled to storage.thumbnail_size and the boxes of the records
+        ({'identifier', 'violation_type', 'bbox'}) are drawn on it.
+        """
+        time_now = datetime.now()
+        date_folder = time_now.strftime("%Y_%m")
+        timestamp = time_now.strftime("%Y%m%d_%H%M%S")
+
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.thumbnail_size / max(h, w))
+        thumbnail = cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        for record in records:
+            x1, y1, x2, y2 = (int(v * scale) for v in record['bbox'])
+            cv2.rectangle(thumbnail, (x1, y1), (x2, y2), (0, 0, 255), 1)
+
+        is_success, buffer = cv2.imencode(".jpg", thumbnail, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        if not is_success:
+            print("\nFailed to encode thumbnail")
+            return []
+        filename = f"thumbnails/{date_folder}/{vehicle_id}_{timestamp}.jpg"
+        return [{'bucket': self.buckets['proofs'], 'key': filename, 'body': buffer.tobytes(), 'content_type': 'image/jpeg'}]
+
+    def encode_proof_annotations(self, image_item, frame_shape, records):
+        """
+        Encode the labeled proof of every record as an annotation of an already encoded frame.
+
+        The annotation references image_item (usually the retraining image) instead of holding pixels:
+            {'image': {'bucket', 'key'}, 'width', 'height',
+             'vehicle': {'identifier', 'violation_type', 'bbox', 'crop_box'},
+             'boxes': [{'identifier', 'violation_type', 'bbox'}, ...]}  # every vehicle on the frame
+        render_proof() draws it on read. Returned in record order.
+        """
+        time_now = datetime.now()
+        date_folder = time_now.strftime("%Y_%m")
+        timestamp = time_now.strftime("%Y%m%d_%H%M%S")
+        h, w = frame_shape[:2]
+
+        boxes = [{'identifier': record['identifier'], 'violation_type': record['violation_type'],
+                  'bbox': [int(v) for v in record['bbox']]} for record in records]
+        items = []
+        for record, box in zip(records, boxes):
+            crop_box = record.get('crop_box') or record['bbox']
+            annotation = {
+                'image': {'bucket': image_item['bucket'], 'key': image_item['key']},
+                'width': w,
+                'height': h,
+                'vehicle': dict(box, crop_box=[int(v) for v in crop_box]),
+                'boxes': boxes,
+            }
+            filename = f"{date_folder}/{record['violation_type']}_{record['identifier']}_{timestamp}_labeled.json"
+            items.append({'bucket': self.buckets['proofs'], 'key': filename,
+                          'body': json.dumps(annotation).encode(), 'content_type': 'application/json'})
+        return items
+
+    def render_proof(self, key, crop=False):
+        """
+        Render a labeled proof annotation (see encode_proof_annotations) stored under key in the proofs bucket.
+
+        Returns:
+            np.ndarray: the BGR frame with every box drawn, or the vehicle crop without boxes if crop is True
+        """
+        annotation = json.loads(self.backend.get(self.buckets['proofs'], key))
+        image = annotation['image']
+        body = self.backend.get(image['bucket'], image['key'])
+        frame = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+        if crop:
+            x1, y1, x2, y2 = annotation['vehicle']['crop_box']
+            return frame[y1:y2, x1:x2]
+        for box in annotation['boxes']:
+            self._draw_violation_box(frame, box['bbox'], box['identifier'], box['violation_type'])
+        return frame
+
+    def encode_video_proofs(self, frames, records, fps=30):
+        """
+        Encode one video clip for several vehicles that violated together.
+
+        The boxes of every record ({'identifier', 'violation_type', 'bboxes'}) are drawn on the same
+        clip, which is encoded once and returned under the key of every record, in record order.
         """
         if not frames:
-            return False
-        
-        if bboxes:
-            bbox_map = {i: bbox for i, bbox in bboxes}
-        
+            return []
+
+        frame_counters = [frame_counter for frame_counter, _ in frames]
+        tracks = [bbox_track(record.get('bboxes'), frame_counters) for record in records]
+
+        def draw(scratch, position, frame_counter):
+            for record, track in zip(records, tracks):
+                if track[position] is not None:
+                    self._draw_violation_box(scratch, track[position], record['identifier'], record['violation_type'])
+
         time_now = datetime.now()
         date_folder = time_now.strftime("%Y_%m")
         timestamp = time_now.strftime("%Y%m%d_%H%M%S")
-        filename = f"{date_folder}/{violation_type}_{vehicle_id}_{timestamp}.mp4"
-        
-        # Create temp file
-        import tempfile
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp_file:
-            temp_path = tmp_file.name
-            
+
         try:
-            h, w, _ = frames[0][1].shape
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(temp_path, fourcc, fps, (w, h))
-            
-            for frame_counter, frame in frames:
-                draw_frame = frame.copy()
-                if bboxes:
-                    if frame_counter in bbox_map:
-                        bbox = bbox_map[frame_counter]
-                        x1, y1, x2, y2 = map(int, bbox)
-                        cv2.rectangle(draw_frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                        cv2.putText(draw_frame, f"ID: {vehicle_id} {violation_type}", (x1, y1 - 10), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
-                    else:
-                        # No bbox for this frame, draw using last known bbox
-                        previous = [k for k in bbox_map.keys() if k <= frame_counter]
-                        bbox = None
-                        if len(previous) > 0:
-                            bbox = bbox_map.get(max(previous), None)
-                        if bbox:
-                            x1, y1, x2, y2 = map(int, bbox)
-                            cv2.rectangle(draw_frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                            cv2.putText(draw_frame, f"ID: {vehicle_id} {violation_type}", (x1, y1 - 10), 
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
-                out.write(draw_frame)
-            out.release()
-            
-            # Upload
-            success = self.upload_file(temp_path, self.buckets['proofs'], filename)
-            return success
+            encoder = ProofVideoEncoder(fps, codec=self.video_settings.get('video_codec', 'libx264'),
+                                        preset=self.video_settings.get('video_preset', 'veryfast'),
+                                        crf=self.video_settings.get('video_crf', 28))
+            body = encoder.encode(frames, draw)
         except Exception as e:
-            print(f"\nError creating/uploading video proof: {e}")
+            print(f"\nError creating video proof: {e}")
+            return []
+
+        items = []
+        for record in records:
+            filename = f"{date_folder}/{record['violation_type']}_{record['identifier']}_{timestamp}.mp4"
+            items.append({'bucket': self.buckets['proofs'], 'key': filename, 'body': body, 'content_type': 'video/mp4'})
+        return items
+
+    def save_proof(self, frame, vehicle_id, violation_type):
+        """
+        Save violation proof to MinIO
+        """
+        items = self.encode_proof(frame, vehicle_id, violation_type)
+        return bool(items) and all(self.upload_all(items))
+
+    def save_retraining_data(self, frame, vehicle_id, bbox):
+        """
+        Save retraining data (full frame + label info)
+        bbox is one (x1, y1, x2, y2) box or a list of them when several vehicles share the frame.
+        """
+        items = self.encode_retraining_data(frame, vehicle_id, bbox)
+        # The label is only uploaded once its image is
+        return bool(items) and self.upload(items[0]) and self.upload(items[1])
+
+    def save_labeled_proof(self, frame, vehicle_id, violation_type, bbox):
+        """
+        Save a full frame with the bounding box drawn on it as proof.
+        """
+        return self.save_labeled_proofs(frame, [{'identifier': vehicle_id, 'violation_type': violation_type, 'bbox': bbox}])[0]
+
+    def save_labeled_proofs(self, frame, records):
+        """
+        Save one labeled frame for several vehicles that violated on it.
+
+        Returns:
+            list: upload success per record
+        """
+        items = self.encode_labeled_proofs(frame, records)
+        return self.upload_all(items) if items else [False] * len(records)
+
+    def save_video_proof(self, frames, vehicle_id, violation_type, bboxes, fps=30):
+        """
+        Save a video clip as proof.
+        """
+        return self.save_video_proofs(frames, [{'identifier': vehicle_id, 'violation_type': violation_type, 'bboxes': bboxes}], fps)[0]
+
+    def save_video_proofs(self, frames, records, fps=30):
+        """
+        Save one video clip for several vehicles that violated together.
+
+        Returns:
+            list: upload success per record
+        """
+        items = self.encode_video_proofs(frames, records, fps)
+        return self.upload_all(items) if items else [False] * len(records)
+
+    def presigned_url(self, bucket_name, object_name, expires=3600):
+        """
+        Expiring GET URL of an object, the browser downloads it from storage directly
+        (a local path with the local backend)
+        """
+        return self.backend.url(bucket_name, object_name, expires=expires)
+
+    @staticmethod
+    def _draw_violation_box(frame, bbox, vehicle_id, violation_type):
+        x1, y1, x2, y2 = map(int, bbox)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+        cv2.putText(frame, f"ID: {vehicle_id} {violation_type}", (x1, y1 - 10), 
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
+
+
+class PresignedUrlCache:
+    """
+    LRU cache of presigned URLs.
+
+    Signing is local but the gallery asks for the same objects over and over, and a stable URL
+    lets the browser cache the image. URLs are reused until `refresh` seconds before they expire.
+    """
+
+    def __init__(self, client, maxsize=1024, expires=3600, refresh=300):
+        self.client = client
+        self.maxsize = maxsize
+        self.expires = expires
+        self.refresh = refresh
+        self._urls = OrderedDict()   # (bucket, key) -> (url, expires at)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._urls)
+
+    def get(self, bucket_name, object_name):
+        now = time.time()
+        cache_key = (bucket_name, object_name)
+        with self._lock:
+            cached = self._urls.get(cache_key)
+            if cached is not None and cached[1] - self.refresh > now:
+                self._urls.move_to_end(cache_key)
+                return cached[0]
+
+        url = self.client.presigned_url(bucket_name, object_name, expires=self.expires)
+        with self._lock:
+            self._urls[cache_key] = (url, now + self.expires)
+            self._urls.move_to_end(cache_key)
+            while len(self._urls) > self.maxsize:
+                self._urls.popitem(last=False)
+        return url
+
+
+class ContentStore:
+    """
+    Recent-window index of stored retraining samples, so the frames of a stalled feed are sampled once.
+
+    A fixed camera sees the same background in every frame, so a whole-frame hash cannot tell two
+    violations apart. A frame is only a duplicate of a stored one when image_hash() (a 64-bit
+    difference hash of the downscaled grayscale image) is within max_distance bits of it (0: equal)
+    and the pixels inside every record's bbox match: each bbox overlaps a stored one by at least
+    min_iou and the mean absolute difference of the downscaled grayscale regions is at most
+    max_pixel_diff. Any number of entries may share a hash, the last `window` entries of a namespace
+    are kept. A window of 0 disables it.
+
+    find_or_reserve() returns the reference of a match, or reserves an entry for the frame in the same
+    step so another encoder checking the same frame waits for it instead of storing it twice. The
+    caller then commit()s the reference it stored or cancel()s the reservation.
+    """
+
+    REGION_SIZE = 16
+
+    def __init__(self, window=512, max_distance=0, max_pixel_diff=4.0, min_iou=0.8, reserve_timeout=10.0):
+        self.window = window
+        self.max_distance = max_distance
+        self.max_pixel_diff = max_pixel_diff
+        self.min_iou = min_iou
+        self.reserve_timeout = reserve_timeout
+        self._entries = {}   # namespace -> OrderedDict(entry id -> [hash, reference, [(bbox, region signature)], pending])
+        self._by_hash = {}   # namespace -> {hash: [entry id, ...]}
+        self._next_id = 0
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def image_hash(image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+        return int(np.packbits(bits).view('>u8')[0])
+
+    @classmethod
+    def region_signature(cls, image, bbox):
+        """Downscaled grayscale pixels of the bbox region, None if it is empty"""
+        h, w = image.shape[:2]
+        x1, y1, x2, y2 = (int(v) for v in bbox)
+        x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        region = image[y1:y2, x1:x2]
+        gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY) if region.ndim == 3 else region
+        return cv2.resize(gray, (cls.REGION_SIZE, cls.REGION_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def _same_regions(self, regions, image, bboxes):
+        if len(regions) != len(bboxes):
             return False
-        finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        for bbox in bboxes:
+            matched = False
+            for stored_bbox, signature in regions:
+                if _iou(bbox, stored_bbox) < self.min_iou:
+                    continue
+                # Compare the new frame inside the stored box, so a different vehicle at the same spot differs
+                current = self.region_signature(image, stored_bbox)
+                if current is not None and signature is not None and \
+                        float(np.abs(current - signature).mean()) <= self.max_pixel_diff:
+                    matched = True
+                    break
+            if not matched:
+                return False
+        return True
+
+    def _candidates(self, namespace, image_hash):
+        by_hash = self._by_hash.get(namespace)
+        if not by_hash:
+            return []
+        if self.max_distance <= 0:
+            return list(by_hash.get(image_hash, ()))
+        hashes = np.fromiter(by_hash.keys(), dtype=np.uint64, count=len(by_hash))
+        distances = np.unpackbits((hashes ^ np.uint64(image_hash)).view(np.uint8)).reshape(-1, 64).sum(axis=1)
+        return [entry_id for h, d in zip(hashes, distances) if d <= self.max_distance for entry_id in by_hash[int(h)]]
+
+    def _match(self, namespace, image_hash, image, bboxes):
+        entries = self._entries.get(namespace, {})
+        for entry_id in reversed(self._candidates(namespace, image_hash)):
+            if self._same_regions(entries[entry_id][2], image, bboxes):
+                return entry_id
+        return None
+
+    def find_or_reserve(self, namespace, image_hash, image, bboxes):
+        """
+        (reference, None) for a stored duplicate of image, else (None, reservation) for the caller to
+        commit() or cancel(). The reservation is None when the store is disabled.
+        """
+        if self.window <= 0:
+            return None, None
+        regions = [(tuple(bbox), self.region_signature(image, bbox)) for bbox in bboxes]
+        deadline = time.monotonic() + self.reserve_timeout
+        with self._cond:
+            while True:
+                entry_id = self._match(namespace, image_hash, image, bboxes)
+                if entry_id is None:
+                    break
+                entry = self._entries[namespace][entry_id]
+                if not entry[3]:
+                    self._entries[namespace].move_to_end(entry_id)
+                    return entry[1], None
+                # Another encoder is storing the same frame, wait for its reference
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            entries = self._entries.setdefault(namespace, OrderedDict())
+            entries[entry_id] = [image_hash, None, regions, True]
+            self._by_hash.setdefault(namespace, {}).setdefault(image_hash, []).append(entry_id)
+            while len(entries) > self.window:
+                self._remove(namespace, next(iter(entries)))
+            return None, (namespace, entry_id)
+
+    def commit(self, reservation, reference):
+        """Record the reference stored for a reserved frame"""
+        if reservation is None:
+            return
+        namespace, entry_id = reservation
+        with self._cond:
+            entry = self._entries.get(namespace, {}).get(entry_id)
+            if entry is not None:
+                entry[1], entry[3] = reference, False
+            self._cond.notify_all()
+
+    def cancel(self, reservation):
+        """Forget a reserved frame nothing was stored for, no-op once committed"""
+        if reservation is None:
+            return
+        namespace, entry_id = reservation
+        with self._cond:
+            entry = self._entries.get(namespace, {}).get(entry_id)
+            if entry is not None and entry[3]:
+                self._remove(namespace, entry_id)
+            self._cond.notify_all()
+
+    def _remove(self, namespace, entry_id):
+        image_hash = self._entries[namespace].pop(entry_id)[0]
+        ids = self._by_hash[namespace][image_hash]
+        ids.remove(entry_id)
+        if not ids:
+            del self._by_hash[namespace][image_hash]
+
+    def clear(self):
+        with self._cond:
+            self._entries = {}
+            self._by_hash = {}
+            self._cond.notify_all()
+
+
+def _iou(a, b):
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
@@ -0,0 +1,216 @@
+import abc
+import os
+import shutil
+import uuid
+from io import BytesIO
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from utils.spool import MB
+
+
+class StorageBackend(abc.ABC):
+    """
+    Object storage under bucket/key names, used by MinioClient.
+
+    Every backend has the same semantics: put() replaces the object atomically, keys are '/'-separated
+    paths inside a bucket, list() yields {'key', 'size', 'last_modified'} sorted by key. Errors are raised.
+    A backend implements every abstract method, put_file() and download() may be overridden.
+    """
+
+    @abc.abstractmethod
+    def put(self, bucket, key, body, content_type='application/octet-stream'):
+        """Store body (bytes) under bucket/key"""
+
+    def put_file(self, path, bucket, key):
+        with open(path, 'rb') as f:
+            self.put(bucket, key, f.read())
+
+    @abc.abstractmethod
+    def get(self, bucket, key):
+        """Body of the object as bytes"""
+
+    def download(self, bucket, key, path):
+        with open(path, 'wb') as f:
+            f.write(self.get(bucket, key))
+
+    @abc.abstractmethod
+    def list(self, bucket, prefix=""):
+        """{'key', 'size', 'last_modified'} of the objects under prefix, sorted by key"""
+
+    @abc.abstractmethod
+    def url(self, bucket, key, expires=3600):
+        """Where a browser (or the Gradio gallery) can load the object from"""
+
+    @abc.abstractmethod
+    def ensure_buckets(self, buckets):
+        """Create the buckets that do not exist yet"""
+
+    @abc.abstractmethod
+    def check(self):
+        """Raise if the storage cannot be reached"""
+
+
+class S3Backend(StorageBackend):
+    """
+    S3-compatible storage (MinIO) through one pooled boto3 client shared by every upload thread:
+    connections are kept alive and reused, large objects are uploaded in parts.
+    """
+
+    def __init__(self, endpoint_url, access_key, secret_key, storage_config=None):
+        storage_config = storage_config or {}
+        self.s3 = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=Config(
+                max_pool_connections=storage_config.get('max_pool_connections', 16),
+                retries={'max_attempts': storage_config.get('max_retries', 3), 'mode': 'standard'},
+                tcp_keepalive=True
+            )
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=int(storage_config.get('multipart_threshold_mb', 8) * MB),
+            multipart_chunksize=int(storage_config.get('multipart_chunksize_mb', 8) * MB),
+            max_concurrency=storage_config.get('multipart_concurrency', 4)
+        )
+
+    def put(self, bucket, key, body, content_type='application/octet-stream'):
+        self.s3.upload_fileobj(BytesIO(body), bucket, key, ExtraArgs={'ContentType': content_type},
+                               Config=self.transfer_config)
+
+    def put_file(self, path, bucket, key):
+        self.s3.upload_file(path, bucket, key, Config=self.transfer_config)
+
+    def get(self, bucket, key):
+        return self.s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    def download(self, bucket, key, path):
+        self.s3.download_file(bucket, key, path)
+
+    def list(self, bucket, prefix=""):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield {'key': obj['Key'], 'size': obj['Size'], 'last_modified': obj['LastModified'].timestamp()}
+
+    def url(self, bucket, key, expires=3600):
+        # Presigned: the browser downloads it from storage directly
+        return self.s3.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=expires)
+
+    def ensure_buckets(self, buckets):
+        for bucket in buckets:
+            try:
+                self.s3.head_bucket(Bucket=bucket)
+            except Exception:
+                self.s3.create_bucket(Bucket=bucket)
+
+    def check(self):
+        self.s3.list_buckets()
+
+
+class LocalBackend(StorageBackend):
+    """
+    Objects as files under <root>/<bucket>/<key>, written at disk speed with no service to run.
+
+    For edge nodes that sync to S3 later (see sync_backends), tests and benchmarks.
+    """
+
+    def __init__(self, root="storage"):
+        self.root = os.path.abspath(root)
+
+    def _path(self, bucket, key):
+        parts = key.split('/')
+        if not key or '..' in parts or '' in parts or '/' in bucket or bucket in ('', '.', '..'):
+            raise ValueError(f"Invalid object name {bucket}/{key}")
+        return os.path.join(self.root, bucket, *parts)
+
+    def put(self, bucket, key, body, content_type='application/octet-stream'):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Readers never see a partial object
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def put_file(self, path, bucket, key):
+        target = self._path(bucket, key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, target)
+
+    def get(self, bucket, key):
+        with open(self._path(bucket, key), 'rb') as f:
+            return f.read()
+
+    def list(self, bucket, prefix=""):
+        bucket_dir = os.path.join(self.root, bucket)
+        objects = []
+        for directory, _, filenames in os.walk(bucket_dir):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, filename)
+                key = os.path.relpath(path, bucket_dir).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    stat = os.stat(path)
+                    objects.append({'key': key, 'size': stat.st_size, 'last_modified': stat.st_mtime})
+        return iter(sorted(objects, key=lambda obj: obj['key']))
+
+    def url(self, bucket, key, expires=3600):
+        # A local path, served by the app itself
+        return self._path(bucket, key)
+
+    def ensure_buckets(self, buckets):
+        for bucket in buckets:
+            os.makedirs(os.path.join(self.root, bucket), exist_ok=True)
+
+    def check(self):
+        os.makedirs(self.root, exist_ok=True)
+        if not os.access(self.root, os.W_OK):
+            raise PermissionError(f"{self.root} is not writable")
+
+
+def make_backend(storage_config, endpoint_url=None, access_key=None, secret_key=None):
+    """Backend selected by storage.backend: 's3' (default) or 'local' (under storage.local_root)"""
+    backend = storage_config.get('backend', 's3')
+    if backend == 'local':
+        return LocalBackend(storage_config.get('local_root', 'storage'))
+    if backend == 's3':
+        return S3Backend(endpoint_url, access_key, secret_key, storage_config)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def sync_backends(source, target, buckets, prefix="", since=None):
+    """
+    Copy the objects of source missing from target (same key and size), e.g. a local edge store to S3.
+    Only objects modified after `since` (epoch seconds) are considered if given. Returns the number copied.
+    """
+    copied = 0
+    for bucket in buckets:
+        existing = {obj['key']: obj['size'] for obj in target.list(bucket, prefix)}
+        for obj in source.list(bucket, prefix):
+            if since is not None and obj['last_modified'] < since:
+                continue
+            if existing.get(obj['key']) == obj['size']:
+                continue
+            target.put(bucket, obj['key'], source.get(bucket, obj['key']), _content_type(obj['key']))
+            copied += 1
+    return copied
+
+
+def _content_type(key):
+    extension = os.path.splitext(key)[1].lower()
+    return {
+        '.jpg': 'image/jpeg',
+        '.json': 'application/json',
+        '.jsonl': 'application/json',
+        '.mp4': 'video/mp4',
+        '.tar': 'application/x-tar',
+        '.txt': 'text/plain',
+    }.get(extension, 'application/octet-stream')
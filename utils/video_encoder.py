@@ -0,0 +1,125 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import cv2
+import numpy as np
+
+
+class ProofVideoEncoder:
+    """
+    Encode violation clips to MP4 in memory.
+
+    Frames are drawn on one scratch buffer and piped as raw BGR into an ffmpeg H.264 process, whose
+    fragmented MP4 output is collected from its stdout, so no temporary file is written. Without an
+    ffmpeg binary it falls back to OpenCV's mp4v writer, which needs a temporary file.
+    """
+
+    def __init__(self, fps=30, codec='libx264', preset='veryfast', crf=28, ffmpeg_path=None):
+        self.fps = fps
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.ffmpeg_path = ffmpeg_path or shutil.which('ffmpeg')
+
+    @property
+    def uses_ffmpeg(self):
+        return self.ffmpeg_path is not None
+
+    def encode(self, frames, draw=None):
+        """
+        Encode frames ([(frame_counter, frame), ...]) and return the MP4 bytes.
+
+        draw(scratch, position, frame_counter) is called on a copy of every frame before it is
+        written, the copy is reused across frames so it must be drawn in place.
+        """
+        if not frames:
+            return b""
+        if self.uses_ffmpeg:
+            return self._encode_ffmpeg(frames, draw)
+        return self._encode_opencv(frames, draw)
+
+    def _scratch_frames(self, frames, draw):
+        scratch = np.empty_like(frames[0][1])
+        for position, (frame_counter, frame) in enumerate(frames):
+            np.copyto(scratch, frame)
+            if draw is not None:
+                draw(scratch, position, frame_counter)
+            yield scratch
+
+    def _ffmpeg_command(self, width, height):
+        return [
+            self.ffmpeg_path, '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{width}x{height}", '-r', str(self.fps), '-i', '-',
+            # yuv420p needs even dimensions
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            '-c:v', self.codec, '-preset', self.preset, '-crf', str(self.crf), '-pix_fmt', 'yuv420p',
+            # Fragmented MP4 can be written to a pipe, the moov atom does not need a seekable output
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4', '-'
+        ]
+
+    def _encode_ffmpeg(self, frames, draw):
+        h, w = frames[0][1].shape[:2]
+        process = subprocess.Popen(self._ffmpeg_command(w, h), stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        # Drain stdout and stderr while writing, otherwise ffmpeg blocks on a full pipe
+        chunks, errors = [], []
+        readers = [
+            threading.Thread(target=lambda: chunks.extend(iter(lambda: process.stdout.read(1 << 16), b"")), daemon=True),
+            threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+
+        try:
+            for scratch in self._scratch_frames(frames, draw):
+                process.stdin.write(memoryview(scratch).cast('B'))
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+            process.wait()
+            for reader in readers:
+                reader.join()
+
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with {process.returncode}: {b''.join(errors).decode(errors='replace').strip()}")
+        return b"".join(chunks)
+
+    def _encode_opencv(self, frames, draw):
+        h, w = frames[0][1].shape[:2]
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp_file:
+            temp_path = tmp_file.name
+        try:
+            out = cv2.VideoWriter(temp_path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (w, h))
+            for scratch in self._scratch_frames(frames, draw):
+                out.write(scratch)
+            out.release()
+            with open(temp_path, 'rb') as f:
+                return f.read()
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def bbox_track(bboxes, frame_counters):
+    """
+    Box of every frame of a clip, the last known one for frames without a box.
+
+    Args:
+        bboxes: [(frame_counter, (x1, y1, x2, y2)), ...] in any order
+        frame_counters: frame counters of the clip
+
+    Returns:
+        list: a box or None (no box recorded yet) per frame counter
+    """
+    if not bboxes:
+        return [None] * len(frame_counters)
+    bboxes = sorted(bboxes, key=lambda item: item[0])
+    keys = np.array([k for k, _ in bboxes])
+    # Sorted search of the last box at or before each frame
+    positions = np.searchsorted(keys, np.asarray(frame_counters), side='right') - 1
+    return [bboxes[p][1] if p >= 0 else None for p in positions]
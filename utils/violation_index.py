@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+import time
+
+
+class ViolationIndex:
+    """
+    Local SQLite index of the saved violations, one row per vehicle and violation.
+
+    The save worker adds a row when the evidence of a violation is encoded (its objects are then in the
+    spool, on their way to storage). The dashboard counts, filters and pages through this table instead
+    of listing the buckets, so queries do not depend on how many objects are stored.
+
+    Row format:
+        {'vehicle_id', 'plate', 'violation_type', 'timestamp' (epoch seconds), 'camera',
+         'proof_key', 'labeled_key', 'thumbnail_key', 'video_key', 'retraining_key'}
+    Object keys are in the proofs bucket, except retraining_key (retraining bucket), which is
+    '<shard key>#<member>' for a sample in a retraining shard. Missing ones are None.
+    """
+    COLUMNS = ('vehicle_id', 'plate', 'violation_type', 'timestamp', 'camera',
+               'proof_key', 'labeled_key', 'thumbnail_key', 'video_key', 'retraining_key')
+
+    def __init__(self, path="violations.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        # Shared by the save worker threads, serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            # WAL lets the dashboard read while the worker writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS violations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    vehicle_id INTEGER,
+                    plate TEXT,
+                    violation_type TEXT,
+                    timestamp REAL NOT NULL,
+                    camera TEXT,
+                    proof_key TEXT,
+                    labeled_key TEXT,
+                    thumbnail_key TEXT,
+                    video_key TEXT,
+                    retraining_key TEXT
+                )""")
+            # Columns added after the table was created
+            existing = {row[1] for row in self._conn.execute("PRAGMA table_info(violations)")}
+            for column in self.COLUMNS:
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE violations ADD COLUMN {column} TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_violations_timestamp ON violations (timestamp)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_violations_plate ON violations (plate, timestamp)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_violations_type ON violations (violation_type, timestamp)")
+
+    def add(self, row):
+        self.add_many([row])
+
+    def add_many(self, rows):
+        values = [tuple(row.get(column) for column in self.COLUMNS) for row in rows]
+        for value in values:
+            if value[3] is None:
+                raise ValueError("Violation row needs a timestamp")
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO violations ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                values)
+
+    @staticmethod
+    def _where(start=None, end=None, plate=None, violation_type=None, camera=None):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(end)
+        if plate is not None:
+            clauses.append("plate = ?")
+            params.append(plate)
+        if violation_type is not None:
+            clauses.append("violation_type = ?")
+            params.append(violation_type)
+        if camera is not None:
+            clauses.append("camera = ?")
+            params.append(camera)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, **filters):
+        """Number of violations matching the filters (start, end, plate, violation_type, camera)"""
+        where, params = self._where(**filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM violations{where}", params).fetchone()[0]
+
+    def count_by_type(self, **filters):
+        """{violation_type: count} of the violations matching the filters"""
+        where, params = self._where(**filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT violation_type, COUNT(*) FROM violations{where} GROUP BY violation_type", params).fetchall()
+        return {violation_type: count for violation_type, count in rows}
+
+    def query(self, limit=20, offset=0, **filters):
+        """Violations matching the filters, newest first, as row dicts (plus their 'id')"""
+        where, params = self._where(**filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM violations{where} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def violation_row(record, camera=None):
+    """Index row of one saved record (see encode_violation_job, which fills its 'object_keys')"""
+    keys = record.get('object_keys') or {}
+    return {
+        'vehicle_id': record.get('vehicle_id'),
+        'plate': record.get('identifier'),
+        'violation_type': record.get('violation_type'),
+        'timestamp': record.get('timestamp') or time.time(),
+        'camera': camera,
+        'proof_key': keys.get('proof'),
+        'labeled_key': keys.get('labeled'),
+        'thumbnail_key': keys.get('thumbnail'),
+        'video_key': keys.get('video'),
+        'retraining_key': keys.get('retraining'),
+    }
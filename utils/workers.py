@@ -6,84 +6,493 @@ for async processing of tasks like saving violations.
 """
 
 import queue
-from utils import MinioClient, get_logger, log_violation, log_upload
+import threading
+import time
+from utils import MinioClient, get_logger, load_config, log_violation, log_upload
+from utils.retraining_sampler import RetrainingSampler, retraining_labels
+from utils.retraining_shards import RetrainingShardWriter
+from utils.spool import EvidenceSpool, MB
+from utils.violation_index import ViolationIndex, violation_row
 
 
-def violation_save_worker(save_queue: queue.Queue) -> None:
+def violation_save_worker(save_queue: queue.Queue, storage_config: dict = None) -> None:
     """
     Background worker for saving violation data to storage.
 
     This worker runs in a separate thread and processes violation data
     from the queue, uploading proofs, retraining data, and video clips
-    to MinIO storage.
+    to MinIO storage. Encoding and uploading run in their own thread pools
+    (see EvidencePipeline), sized by the `storage` config section.
 
     Args:
         save_queue: Queue containing violation data dictionaries.
-                    Send None to stop the worker.
+                    Send None to stop the worker, it returns once every pending upload is done.
+        storage_config: `storage` config section, loaded from config.yaml if None.
 
-    Expected queue item format:
+    Expected queue item format (one job per frame, see EvidenceBatch):
         {
-            'vehicle_id': int,
-            'identifier': str,  # license plate or vehicle id
-            'violation_type': str,
-            'frame': np.ndarray,
-            'bbox': tuple,
-            'bboxes': list,
+            'records': [
+                {
+                    'vehicle_id': int,
+                    'identifier': str,  # license plate or vehicle id
+                    'violation_type': str,
+                    'timestamp': float,
+                    'frame': np.ndarray,  # None if the frame is pinned in frame_store
+                    'frame_idx': int,
+                    'bbox': tuple,
+                    'crop_box': tuple,  # region of proof_crop in the frame
+                    'bboxes': list,
+                    'proof_crop': np.ndarray  # None to crop crop_box from the frame
+                },
+                ...
+            ],
+            'frame_store': FrameRetentionBuffer,
+            'window': list,  # pre/post-roll frame indices pinned in frame_store, replaces frame_buffer
             'frame_buffer': list,
-            'fps': int,
-            'proof_crop': np.ndarray
+            'fps': int
         }
+    A single violation dict (the record keys plus frame_store, window, frame_buffer and fps)
+    is accepted as well.
     """
     logger = get_logger("violation_worker", file_logging=True)
-    
+
+    camera = None
+    if storage_config is None:
+        try:
+            config = load_config()
+            storage_config = config.get('storage') or {}
+            camera = config.get('system', {}).get('camera_id')
+        except Exception:
+            storage_config = {}
+
     try:
         client = MinioClient()
     except Exception as e:
-        logger.error(f"Failed to initialize MinIO client: {e}")
+        logger.error(f"Failed to initialize storage client: {e}")
         return
 
-    while True:
-        data = save_queue.get()
-        
-        # None is the signal to stop the worker
-        if data is None:
-            logger.info("Received stop signal, shutting down worker")
-            break
-
+    spool = EvidenceSpool(
+        storage_config.get('spool_dir'),
+        memory_limit=int(storage_config.get('spool_memory_mb', 64) * MB),
+        retry_delay=storage_config.get('retry_delay', 1.0),
+        max_retry_delay=storage_config.get('max_retry_delay', 60.0)
+    )
+    index = None
+    if storage_config.get('index_path'):
         try:
-            vehicle_id = data['vehicle_id']
-            identifier = data['identifier']
-            violation_type = data['violation_type']
-            frame = data['frame']
-            bbox = data['bbox']
-            bboxes = data['bboxes']
-            frame_buffer = data['frame_buffer']
-            fps = data['fps']
-            proof_crop = data['proof_crop']
+            index = ViolationIndex(storage_config['index_path'])
+        except Exception as e:
+            logger.error(f"Failed to open violation index: {e}")
+    shards = None
+    if storage_config.get('retraining_format', 'shards') == 'shards':
+        shards = RetrainingShardWriter(
+            storage_config.get('shard_dir', 'retraining_shards'),
+            bucket=client.buckets['retraining'],
+            camera=camera,
+            max_bytes=int(storage_config.get('shard_max_mb', 64) * MB),
+            max_age=storage_config.get('shard_max_seconds', 3600)
+        )
+    sampler = None
+    if storage_config.get('retraining_sampling', 'informative') == 'informative':
+        sampler = RetrainingSampler(
+            low_confidence=storage_config.get('retraining_low_confidence', 0.5),
+            label_confidence=storage_config.get('retraining_label_confidence', 0.25),
+            class_quota=storage_config.get('retraining_class_quota', 100),
+            daily_budget=int(storage_config.get('retraining_budget_mb', 512) * MB),
+            state_path=storage_config.get('retraining_state_path')
+        )
+
+    pipeline = EvidencePipeline(
+        client, save_queue,
+        encode_workers=storage_config.get('encode_workers', 2),
+        upload_workers=storage_config.get('upload_workers', 4),
+        spool=spool,
+        drain_timeout=storage_config.get('drain_timeout', 30),
+        index=index,
+        camera=camera,
+        shards=shards,
+        sampler=sampler,
+        metrics_interval=storage_config.get('metrics_interval', 30),
+        logger=logger
+    )
+    pipeline.run()
+    logger.info("Received stop signal, shutting down worker")
+
+
+class EvidencePipeline:
+    """
+    Two-stage evidence saver: encode workers turn violation jobs into upload items, upload workers
+    send them to storage through the shared pooled client.
+
+    save_queue -> [encode workers] -> spool -> [upload workers] -> MinIO
+
+    Frame pins are released as soon as a job is encoded, so the capture loop gets its slots back
+    without waiting for the network. Failed uploads stay in the spool and are retried. A disk spool
+    absorbs a slow or unreachable storage, a memory-only spool blocks the encoders once full, and
+    a full EvidenceQueue takes further jobs with copies of their frames, up to a limit, or drops them
+    (storage.queue_overflow, see core.evidence_batch.submit_job) instead of stalling capture.
+
+    Jobs whose post-roll frames have not been recorded yet are set aside instead of blocking an
+    encoder: they are encoded once frame_store has the last of them (checked every postroll_poll
+    seconds) or the post-roll is overdue, with the frames available then. On stop they are encoded
+    right away, as capture has ended.
+
+    On stop, pending uploads get drain_timeout seconds (None: no limit), what is left stays in a
+    disk spool for the next start.
+
+    With a ViolationIndex, every encoded record is added to it (see violation_row). With a
+    RetrainingShardWriter, retraining samples go to its tar shards and only closed shards are uploaded;
+    the shard age is checked every metrics_interval and the open shard is closed on stop. With a
+    RetrainingSampler, only informative frames within the daily budget become retraining samples.
+    """
+
+    def __init__(self, client, save_queue, encode_workers=2, upload_workers=4, spool=None, drain_timeout=None,
+                 index=None, camera=None, shards=None, sampler=None, metrics_interval=30, postroll_poll=0.05,
+                 logger=None):
+        self.client = client
+        self.save_queue = save_queue
+        self.index = index
+        self.camera = camera
+        self.shards = shards
+        self.sampler = sampler
+        self.spool = spool if spool is not None else EvidenceSpool()
+        self.drain_timeout = drain_timeout
+        self.encode_workers = max(1, int(encode_workers))
+        self.upload_workers = max(1, int(upload_workers))
+        self.metrics_interval = metrics_interval
+        self.postroll_poll = postroll_poll
+        self.logger = logger or get_logger("violation_worker", file_logging=True)
+        if hasattr(save_queue, 'logger'):
+            # Overflows of an EvidenceQueue are reported with the worker's logs
+            save_queue.logger = self.logger
+
+        self._lock = threading.Lock()
+        self._deferred = []  # (deadline, job) waiting for post-roll frames, oldest first
+        self._stopping = False
+        self.counters = {
+            'jobs_done': 0,
+            'jobs_failed': 0,
+            'index_failed': 0,
+            'uploads_done': 0,
+            'uploads_failed': 0,
+            'bytes_uploaded': 0,
+            'encode_seconds': 0.0,
+            'upload_seconds': 0.0,
+        }
+        self._encoders = []
+        self._uploaders = []
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.counters[key] += value
+
+    def metrics(self):
+        """Queue depth of each stage and the running totals"""
+        with self._lock:
+            metrics = dict(self.counters)
+        metrics['save_queue_depth'] = self.save_queue.qsize()
+        metrics['jobs_copied'] = getattr(self.save_queue, 'copied', 0)
+        metrics['jobs_dropped'] = getattr(self.save_queue, 'dropped', 0)
+        with self._lock:
+            metrics['postroll_waiting'] = len(self._deferred)
+        metrics['upload_queue_depth'] = len(self.spool)
+        metrics['spool_memory_bytes'] = self.spool.memory_bytes
+        if self.sampler is not None:
+            metrics.update(self.sampler.stats())
+        return metrics
+
+    def start(self):
+        self._encoders = [threading.Thread(target=self._encode_loop, daemon=True) for _ in range(self.encode_workers)]
+        self._uploaders = [threading.Thread(target=self._upload_loop, daemon=True) for _ in range(self.upload_workers)]
+        for thread in self._encoders + self._uploaders:
+            thread.start()
+
+    def join(self):
+        """Wait for the stop signal, then for every pending upload"""
+        while True:
+            alive = [thread for thread in self._encoders if thread.is_alive()]
+            if not alive:
+                break
+            alive[0].join(timeout=self.metrics_interval or None)
+            if alive[0].is_alive():
+                self.logger.info(f"Evidence pipeline: {self.metrics()}")
+                if self.shards is not None:
+                    self._put_all(self.shards.roll())
+
+        if self.shards is not None:
+            self._put_all(self.shards.close())
+
+        if not self.spool.wait_empty(self.drain_timeout):
+            self.logger.warning(f"{len(self.spool)} evidence objects not uploaded, they stay in the spool")
+        self.spool.close()
+        for thread in self._uploaders:
+            thread.join()
+        self.logger.info(f"Evidence pipeline stopped: {self.metrics()}")
+
+    def run(self):
+        self.start()
+        self.join()
+
+    def _encode_loop(self):
+        while True:
+            data = self._next_job()
+            if data is None:
+                break
+
+            records = data['records'] if 'records' in data else [data]
+            frame_store = data.get('frame_store')
+            start = time.perf_counter()
+            encoded = False
+            try:
+                items = encode_violation_job(self.client, self.logger, records, data, shards=self.shards,
+                                             sampler=self.sampler)
+                self._count(jobs_done=1)
+                encoded = True
+            except Exception as e:
+                self.logger.error(f"Error encoding violation: {e}")
+                self._count(jobs_failed=1)
+                items = []
+            finally:
+                if frame_store is not None:
+                    # Unpin the slots so the capture loop can reuse them
+                    for record in records:
+                        frame_store.release(record.get('frame_idx'))
+                    frame_store.release_all(data.get('window') or [])
+                self._count(encode_seconds=time.perf_counter() - start)
+
+            self._put_all(items)
+            if encoded and self.index is not None:
+                # The index only serves the dashboard, a failed write must not cost the evidence
+                try:
+                    self.index.add_many([violation_row(record, self.camera) for record in records])
+                except Exception as e:
+                    self.logger.error(f"Error indexing violations {[r.get('identifier') for r in records]}: {e}")
+                    self._count(index_failed=1)
+            self.save_queue.task_done()
+
+    def _next_job(self):
+        """Next job to encode, None once stopped with no job left"""
+        while True:
+            data = self._take_ready()
+            if data is not None:
+                return data
+            with self._lock:
+                waiting = bool(self._deferred)
+                if self._stopping and not waiting:
+                    return None
+            try:
+                data = self.save_queue.get(timeout=self.postroll_poll if waiting else None)
+            except queue.Empty:
+                continue
+
+            # None is the signal to stop, leave it for the other encoders
+            if data is None:
+                with self._lock:
+                    self._stopping = True
+                self.save_queue.put(None)
+                continue
+
+            remaining = _postroll_remaining(data)
+            if remaining == 0:
+                return data
+            with self._lock:
+                self._deferred.append((time.monotonic() + remaining / data['fps'] + 5, data))
 
+    def _take_ready(self):
+        """The oldest deferred job whose post-roll is recorded or overdue, None if there is none"""
+        with self._lock:
+            now = time.monotonic()
+            for i, (deadline, data) in enumerate(self._deferred):
+                if self._stopping or now >= deadline or _postroll_remaining(data) == 0:
+                    del self._deferred[i]
+                    return data
+        return None
+
+    def _put_all(self, items):
+        for item in items:
+            self.spool.put(item)
+
+    def _upload_loop(self):
+        while True:
+            item = self.spool.get()
+            if item is None:
+                break
+
+            start = time.perf_counter()
+            try:
+                success = self.client.upload(item)
+            except Exception as e:
+                self.logger.error(f"Error uploading {item['key']}: {e}")
+                success = False
+            if item.get('log'):
+                log_upload(self.logger, *item['log'], success)
+            self._count(uploads_done=int(success), uploads_failed=int(not success),
+                        bytes_uploaded=len(item['body']) if success else 0,
+                        upload_seconds=time.perf_counter() - start)
+            if success:
+                self.spool.done(item)
+            else:
+                self.spool.retry(item)
+
+
+def save_violation_job(client, logger, records, data) -> None:
+    """
+    Save the evidence of the violations finalized in one frame, in the calling thread.
+    """
+    for item in encode_violation_job(client, logger, records, data):
+        log_upload(logger, *item['log'], client.upload(item))
+
+    logger.info(f"Saved all proofs for violation IDs: {[record['identifier'] for record in records]}")
+
+
+def encode_violation_job(client, logger, records, data, shards=None, sampler=None) -> list:
+    """
+    Encode the evidence of the violations finalized in one frame into upload items.
+
+    Shared frames and the video clip are encoded once with the boxes of every vehicle on them,
+    records are still saved per vehicle. With storage.labeled_proofs 'annotation' the labeled proof
+    and the crop of a vehicle are a JSON annotation of the retraining image instead of two more
+    JPEGs (see MinioClient.render_proof). With a RetrainingSampler, only the frames it admits become
+    retraining samples. With a RetrainingShardWriter, the retraining sample is appended to its open
+    shard and the items of closed shards are returned instead. Annotations of frames without a
+    retraining image object reference the frame uploaded under frames/ in the proofs bucket. A frame
+    that repeats a recent sample of a stalled feed (MinioClient.content_store) references that
+    retraining sample instead of adding a new one, and its annotations reference the sample's image
+    when it is an object of its own. Thumbnails and rendered proofs are still stored per violation.
+    Every item carries a 'log' entry,
+    the (bucket, name) reported by log_upload, and every record gets the 'object_keys' of its
+    evidence ({'proof', 'labeled', 'thumbnail', 'video', 'retraining'}) for the violation index.
+    """
+    frame_store = data.get('frame_store')
+    fps = data['fps']
+
+    # Materialize the pinned violation frames only now, once per distinct frame
+    groups = {}
+    for record in records:
+        frame = record['frame']
+        key = id(frame)
+        if frame is None and frame_store is not None:
+            key = ('pinned', record['frame_idx'])
+            if key not in groups:
+                frame = frame_store.get(record['frame_idx'])
+        group = groups.setdefault(key, {'frame': frame, 'records': []})
+        group['records'].append(record)
+
+    frame_buffer = data.get('frame_buffer') or []
+    if data.get('window'):
+        # Post-roll frames are recorded by now unless the job was overdue (see EvidencePipeline)
+        if _postroll_remaining(data) > 0:
+            logger.warning(f"Post-roll of violations {[r['identifier'] for r in records]} incomplete, saving the frames available")
+        frame_buffer = [(idx, frame_store.get(idx)) for idx in data['window']]
+        frame_buffer = [(idx, f) for idx, f in frame_buffer if f is not None]
+
+    annotate = client.labeled_proofs == 'annotation'
+
+    for record in records:
+        record['object_keys'] = {}
+    items = []
+    for group in groups.values():
+        frame, group_records = group['frame'], group['records']
+        for record in group_records:
             # Log the violation
-            log_violation(logger, vehicle_id, violation_type, identifier)
-
-            # Save proof crop
-            success = client.save_proof(proof_crop, identifier, violation_type)
-            log_upload(logger, "proofs", f"{violation_type}_{identifier}", success)
-            
-            # Save retraining data
-            success = client.save_retraining_data(frame, vehicle_id, bbox)
-            log_upload(logger, "retraining", f"train_{vehicle_id}", success)
-            
-            # Save labeled proof
-            success = client.save_labeled_proof(frame, identifier, violation_type, bbox)
-            log_upload(logger, "proofs", f"{violation_type}_{identifier}_labeled", success)
-            
-            # Save video proof if buffer available
-            if frame_buffer:
-                success = client.save_video_proof(frame_buffer, identifier, violation_type, bboxes, fps)
-                log_upload(logger, "proofs", f"{violation_type}_{identifier}.mp4", success)
-            
-            logger.info(f"Saved all proofs for violation ID: {identifier}")
-            
-        except Exception as e:
-            logger.error(f"Error saving violation: {e}")
-        finally:
-            save_queue.task_done()
+            log_violation(logger, record['vehicle_id'], record['violation_type'], record['identifier'])
+
+        image = None  # {'bucket', 'key'} of the stored frame the annotations reference
+        if frame is not None:
+            # Retraining data, one image labeled with every detection on it, if the sampler keeps the frame
+            # and it does not repeat a recent sample (a stalled feed)
+            vehicle_id = "-".join(str(record['vehicle_id']) for record in group_records)
+            frame_hash = client.content_store.image_hash(frame)
+            bboxes = [record['bbox'] for record in group_records]
+            labels = sampler.labels(group_records) if sampler is not None else retraining_labels(group_records)
+            retraining = []
+            # Reserved atomically, an encoder checking the same frame meanwhile waits for this one
+            duplicate, reservation = client.content_store.find_or_reserve('retraining', frame_hash, frame, bboxes)
+            try:
+                if duplicate is not None:
+                    for record in group_records:
+                        record['object_keys']['retraining'] = duplicate['key']
+                    # A standalone JPEG of the same frame, the annotations reference it instead of a new upload
+                    image = duplicate['image']
+                elif sampler is None or sampler.admit(group_records, labels):
+                    retraining = client.encode_retraining_data(frame, vehicle_id, [box for _, box in labels],
+                                                               [class_id for class_id, _ in labels])
+                    # Charged only if it still fits the budget other encoders may have used meanwhile
+                    if sampler is not None and retraining and \
+                            not sampler.admit(group_records, labels, sum(len(item['body']) for item in retraining)):
+                        retraining = []
+
+                if shards is not None and retraining:
+                    reference, closed = shards.add(*retraining)
+                    client.content_store.commit(reservation, {'key': reference, 'image': None})
+                    for record in group_records:
+                        record['object_keys']['retraining'] = reference
+                    for item in closed:
+                        items += _with_log([item], "retraining", item['key'])
+                elif retraining:
+                    items += _with_log(retraining, "retraining", f"train_{vehicle_id}", group_records, 'retraining')
+                    image = {'bucket': retraining[0]['bucket'], 'key': retraining[0]['key']}
+                    client.content_store.commit(reservation, {'key': retraining[0]['key'], 'image': image})
+            finally:
+                # Nothing stored (skipped by the sampler or failed), no-op once committed
+                client.content_store.cancel(reservation)
+
+            if annotate and image is None:
+                # No retraining image object to reference, upload the frame itself (reusing its JPEG if encoded)
+                frame_items = client.encode_frame(frame, vehicle_id, body=retraining[0]['body'] if retraining else None)
+                items += _with_log(frame_items, "proofs", f"frame_{vehicle_id}")
+                image = {'bucket': frame_items[0]['bucket'], 'key': frame_items[0]['key']} if frame_items else None
+
+            # Gallery thumbnail of the labeled frame
+            items += _with_log(client.encode_thumbnail(frame, vehicle_id, group_records),
+                               "proofs", f"thumbnail_{vehicle_id}", group_records, 'thumbnail')
+
+        if annotate and image is not None:
+            # Labeled proof and crop as an annotation of the retraining image
+            for record, item in zip(group_records, client.encode_proof_annotations(image, frame.shape, group_records)):
+                items += _with_log([item], "proofs", f"{record['violation_type']}_{record['identifier']}_labeled.json",
+                                   [record], 'labeled')
+            continue
+
+        # Proof crops
+        for record in group_records:
+            if record.get('proof_crop') is None:
+                if frame is None:
+                    continue
+                # Left to this worker by an encoded pre-roll buffer
+                x1, y1, x2, y2 = record['crop_box']
+                record['proof_crop'] = frame[y1:y2, x1:x2].copy()
+            items += _with_log(client.encode_proof(record['proof_crop'], record['identifier'], record['violation_type']),
+                               "proofs", f"{record['violation_type']}_{record['identifier']}", [record], 'proof')
+
+        # Labeled proof
+        if frame is not None:
+            for record, item in zip(group_records, client.encode_labeled_proofs(frame, group_records)):
+                items += _with_log([item], "proofs", f"{record['violation_type']}_{record['identifier']}_labeled",
+                                   [record], 'labeled')
+
+    # Video proof if buffer available
+    if frame_buffer:
+        for record, item in zip(records, client.encode_video_proofs(frame_buffer, records, fps)):
+            items += _with_log([item], "proofs", f"{record['violation_type']}_{record['identifier']}.mp4", [record], 'video')
+
+    return items
+
+
+def _postroll_remaining(data):
+    """Post-roll frames of a job that have not been recorded yet"""
+    frame_store = data.get('frame_store')
+    if not data.get('window') or frame_store is None:
+        return 0
+    return max(0, data['window'][-1] - (frame_store.latest_idx or 0))
+
+
+def _with_log(items, bucket, name, records=(), kind=None):
+    for item in items:
+        item['log'] = (bucket, name)
+    if items:
+        # Object key of each record, for the violation index
+        for record in records:
+            record['object_keys'][kind] = items[0]['key']
+    return items
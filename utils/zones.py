@@ -1,6 +1,9 @@
+import functools
 import json
 import os
+import cv2
 import numpy as np
+import supervision as sv
 
 def load_zones(zone_path="zones.json"):
     """
@@ -55,3 +58,95 @@ def save_zones(zones, zone_path="zones.json"):
     except Exception as e:
         print(f"Error saving zones: {e}")
         return False
+
+
+class ZoneMap:
+    """
+    Rasterized label image of one or more polygon zones.
+
+    Every zone gets one bit, and each pixel of the label image holds the bits of all zones
+    covering it. The image only spans the bounding box of the zones (optionally downsampled
+    by scale), so testing which zones contain a set of anchor points is a single fancy-index
+    lookup, no matter how many zones there are. With a margin every zone is grown by that many
+    pixels in all directions.
+    """
+    def __init__(self, zones: dict, scale: float = 1.0, margin: int = 0):
+        """
+        Args:
+            zones (dict): zone name -> polygon points [[x, y], ...]
+            scale (float): resolution of the label image relative to the frame (<1 to downsample)
+            margin (int): pixels each zone is grown by
+        """
+        if len(zones) > 64:
+            raise ValueError("ZoneMap supports at most 64 zones")
+        self.names = list(zones)
+        self.scale = scale
+        self.margin = margin
+        self.bits = {name: np.uint64(1) << np.uint64(i) for i, name in enumerate(self.names)}
+
+        polygons = [np.asarray(points, dtype=int).reshape(-1, 2) for points in zones.values()]
+        all_points = np.vstack(polygons) if polygons else np.zeros((1, 2), dtype=int)
+        self.origin = all_points.min(axis=0) - margin
+        w, h = np.ceil((all_points.max(axis=0) + margin - self.origin + 1) * scale).astype(int)
+        radius = int(round(margin * scale))
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1)) if radius > 0 else None
+
+        dtype = next(t for t in (np.uint8, np.uint16, np.uint32, np.uint64) if np.iinfo(t).bits >= max(len(self.names), 1))
+        self.labels = np.zeros((h, w), dtype=dtype)
+        for name, polygon in zip(self.names, polygons):
+            if len(polygon) < 3:
+                continue
+            mask = np.zeros((h, w), dtype=np.uint8)
+            local = np.round((polygon - self.origin) * scale).astype(np.int32)
+            cv2.fillPoly(mask, [local], color=1)
+            if kernel is not None:
+                mask = cv2.dilate(mask, kernel)
+            self.labels[mask.astype(bool)] |= dtype(self.bits[name])
+
+    def lookup(self, points: np.ndarray) -> np.ndarray:
+        """Zone bits of each (x, y) point, 0 for points outside all zones"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        idx = np.floor((np.ceil(points) - self.origin) * self.scale).astype(int)
+        h, w = self.labels.shape
+        inside = (idx[:, 0] >= 0) & (idx[:, 0] < w) & (idx[:, 1] >= 0) & (idx[:, 1] < h)
+        result = np.zeros(len(points), dtype=np.uint64)
+        result[inside] = self.labels[idx[inside, 1], idx[inside, 0]]
+        return result
+
+    def contains_boxes(self, xyxy: np.ndarray, name=None) -> np.ndarray:
+        """Boolean mask of boxes (x1, y1, x2, y2) whose center is inside zone name (inside any zone if name is None)"""
+        xyxy = np.asarray(xyxy, dtype=float).reshape(-1, 4)
+        return self._in_zone(self.lookup((xyxy[:, :2] + xyxy[:, 2:4]) / 2), name)
+
+    def contains(self, detections: sv.Detections, name=None, anchor=sv.Position.CENTER) -> np.ndarray:
+        """Boolean mask of detections whose anchor is inside zone name (inside any zone if name is None)"""
+        if len(detections) == 0:
+            return np.zeros(0, dtype=bool)
+        return self._in_zone(self.lookup(detections.get_anchors_coordinates(anchor)), name)
+
+    def _in_zone(self, labels, name):
+        if name is None:
+            return labels != 0
+        return (labels & self.bits[name]) != 0
+
+
+ZONE_MAP_CACHE_SIZE = 8
+
+def build_zone_map(zones: dict, scale: float = 1.0, margin: int = 0) -> ZoneMap:
+    """
+    Compile zones into a ZoneMap, reusing the one already compiled for the same zones, scale and margin.
+    Only the ZONE_MAP_CACHE_SIZE most recently used maps are kept, zones edited in the app do not pile up.
+
+    Args:
+        zones (dict): zone name -> polygon points [[x, y], ...]
+        scale (float): resolution of the label image relative to the frame
+        margin (int): pixels each zone is grown by
+    """
+    key = tuple((name, tuple(map(tuple, np.asarray(points, dtype=int).reshape(-1, 2).tolist())))
+                for name, points in zones.items())
+    return _compile_zone_map(key, float(scale), int(margin))
+
+
+@functools.lru_cache(maxsize=ZONE_MAP_CACHE_SIZE)
+def _compile_zone_map(key, scale, margin):
+    return ZoneMap({name: [list(point) for point in points] for name, points in key}, scale=scale, margin=margin)